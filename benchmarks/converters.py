@@ -0,0 +1,64 @@
+"""
+Compares per-value type translators with per-statement row converters
+(see firebird.converters) on a synthetic result set.
+
+Per-value translators are called from a Python loop here, as kinterbasdb
+would call them for each value, so the numbers show conversion cost only.
+
+Run with: python benchmarks/converters.py [rows]
+"""
+
+import sys
+
+import env
+env.setup()
+
+import kinterbasdb.typeconv_fixed_decimal as typeconv_fixeddecimal
+import kinterbasdb.typeconv_text_unicode as typeconv_textunicode
+
+from django.db import connections
+
+from firebird.converters import RowConverter
+
+
+def make_rows(count):
+    "Returns rows of naked values: integer, text, fixed, text, unicode text, float, NULL."
+    return [(i, 'name %d' % i, (i * 100 + 25, -2), 'some longer description text', ('unicode', 3), 1.5, None)
+            for i in xrange(count)]
+
+
+def translators(ops):
+    "Output translators in the order of make_rows() columns, as registered by DatabaseWrapper."
+    return (None, ops.conv_out_ascii, typeconv_fixeddecimal.fixed_conv_out_precise, ops.conv_out_ascii,
+            typeconv_textunicode.unicode_conv_out, None, None)
+
+
+def per_value(rows, ops):
+    convs = translators(ops)
+    result = []
+    for row in rows:
+        values = []
+        for conv, value in zip(convs, row):
+            if conv is not None and value is not None:
+                value = conv(value)
+            values.append(value)
+        result.append(tuple(values))
+    return result
+
+
+def per_row(rows, ops):
+    description = [('C%d' % i, None, 0, 0, 0, 0, True) for i in range(len(rows[0]))]
+    return RowConverter(description).convert_rows(rows)
+
+
+def main(count):
+    ops = connections['default'].ops
+    rows = make_rows(count)
+    assert per_value(rows, ops) == per_row(rows, ops)
+    for name, func in (('per-value translators', per_value), ('row converters', per_row)):
+        seconds = env.measure(lambda: func(rows, ops), 1)
+        env.report('convert: %s' % name, seconds / count, unit='row')
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 100000)
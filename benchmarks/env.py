@@ -0,0 +1,58 @@
+"""
+Benchmark environment: puts the fake kinterbasdb (see fake/kinterbasdb)
+and the backend on sys.path and configures Django.
+
+Every database alias below points to the fake server with different
+backend options.
+"""
+
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, 'fake'))
+
+
+def database(**options):
+    return {
+        'ENGINE': 'firebird',
+        'NAME': 'bench.fdb',
+        'USER': 'SYSDBA',
+        'PASSWORD': 'masterkey',
+        'HOST': '',
+        'PORT': '',
+        'OPTIONS': options,
+    }
+
+DATABASES = {
+    'default': database(),
+    'cached': database(statement_cache_size=100),
+    'converters': database(row_converters=True),
+    'results': database(result_cache={}),
+}
+
+
+def setup():
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(DATABASES=DATABASES, DEBUG=False)
+
+
+def measure(func, number, repeat=5):
+    "Returns the best time of `repeat` runs of `number` calls of `func`, per call."
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        for j in xrange(number):
+            func()
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / number
+
+
+def report(name, seconds, items=1, unit='op'):
+    "Prints a result line: time per operation and throughput in items per second."
+    print '%-48s %12.2f us/%-4s %12.0f %s/s' % (name, seconds * 1e6, unit, items / seconds, unit)
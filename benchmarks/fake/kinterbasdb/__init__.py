@@ -0,0 +1,324 @@
+"""
+In-process stand-in for kinterbasdb, used by benchmarks.
+
+It mimics the parts of kinterbasdb API used by the backend. Statements are
+not run anywhere: each execute() sleeps for configured `latency` seconds
+and produces a result set of configured shape. Like kinterbasdb, output
+type translators are called for every fetched value of a column of the
+corresponding type, values of types without translator are returned naked.
+
+Use configure() to change latency, result shape and server version.
+"""
+
+import re
+import time
+import itertools
+from cStringIO import StringIO
+
+apilevel = '2.0'
+threadsafety = 1
+paramstyle = 'qmark'
+
+
+class Warning(StandardError):
+    pass
+
+class Error(StandardError):
+    pass
+
+class InterfaceError(Error):
+    pass
+
+class DatabaseError(Error):
+    pass
+
+class DataError(DatabaseError):
+    pass
+
+class OperationalError(DatabaseError):
+    pass
+
+class IntegrityError(DatabaseError):
+    pass
+
+class InternalError(DatabaseError):
+    pass
+
+class ProgrammingError(DatabaseError):
+    pass
+
+class NotSupportedError(DatabaseError):
+    pass
+
+
+# Transaction parameter buffer items, values as in ibase.h.
+isc_tpb_consistency = chr(1)
+isc_tpb_concurrency = chr(2)
+isc_tpb_wait = chr(6)
+isc_tpb_nowait = chr(7)
+isc_tpb_read = chr(8)
+isc_tpb_write = chr(9)
+isc_tpb_read_committed = chr(15)
+isc_tpb_rec_version = chr(17)
+isc_tpb_no_rec_version = chr(18)
+isc_tpb_lock_timeout = chr(21)
+isc_tpb_version3 = chr(3)
+
+
+class TPB(object):
+
+    def __init__(self):
+        self.access_mode = isc_tpb_write
+        self.isolation_level = isc_tpb_concurrency
+        self.lock_resolution = isc_tpb_wait
+        self.lock_timeout = None
+
+    def render(self):
+        isolation_level = self.isolation_level
+        if isinstance(isolation_level, tuple):
+            isolation_level = ''.join(isolation_level)
+        tpb = isc_tpb_version3 + self.access_mode + isolation_level + self.lock_resolution
+        if self.lock_timeout is not None:
+            tpb += isc_tpb_lock_timeout + chr(4) + chr(self.lock_timeout % 256) + '\0\0\0'
+        return tpb
+
+
+config = {
+    'latency': 0.0,
+    'rows': 100,
+    'columns': (
+        ('ID', 'INTEGER'),
+        ('NAME', 'TEXT'),
+        ('PRICE', 'FIXED'),
+        ('CREATED', 'TIMESTAMP'),
+        ('BODY', 'BLOB'),
+    ),
+    'server_version': 'WI-V2.5.0.26074 Firebird 2.5',
+    'plan': 'PLAN (BENCH NATURAL)',
+}
+
+PYTHON_TYPES = {
+    'INTEGER': int,
+    'FLOAT': float,
+    'FIXED': float,
+    'TEXT': str,
+    'TEXT_UNICODE': unicode,
+    'BLOB': str,
+    'DATE': tuple,
+    'TIME': tuple,
+    'TIMESTAMP': tuple,
+}
+
+_ids = itertools.count(1)
+gen_id_re = re.compile(r'GEN_ID\(\s*[^,]+,\s*(\d+)\s*\)', re.I)
+create_database_re = re.compile(r"CREATE DATABASE '([^']+)'", re.I)
+
+
+def configure(**options):
+    config.update(options)
+
+
+def init(**options):
+    pass
+
+
+def connect(**options):
+    return Connection(**options)
+
+
+def create_database(sql, dialect=3):
+    "Writes an empty file in place of the database."
+    path = create_database_re.search(sql).group(1)
+    if ':' in path and not path[1:3] == ':\\':
+        path = path.split(':', 1)[1]
+    open(path, 'wb').close()
+    return Connection(database=path, dialect=dialect)
+
+
+def naked_value(type_name, index):
+    "Returns a value of given type as kinterbasdb returns it with no translator."
+    if type_name == 'INTEGER':
+        return index
+    if type_name == 'FLOAT':
+        return index * 1.5
+    if type_name == 'FIXED':
+        return (index * 100 + 25, -2)
+    if type_name == 'TEXT':
+        return 'value %d' % index
+    if type_name == 'TEXT_UNICODE':
+        return ('value %d' % index, 3)
+    if type_name == 'BLOB':
+        return 'blob text of row %d' % index
+    if type_name == 'DATE':
+        return (2010, 1 + index % 12, 1 + index % 28)
+    if type_name == 'TIME':
+        return (index % 24, index % 60, index % 60)
+    if type_name == 'TIMESTAMP':
+        return (2010, 1 + index % 12, 1 + index % 28, index % 24, index % 60, index % 60)
+    raise ValueError('Unknown type %s' % type_name)
+
+
+class BlobReader(object):
+    "BLOB returned in stream mode."
+
+    def __init__(self, data):
+        self._file = StringIO(data)
+        self.closed = False
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def chunks(self, chunk_size):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self.closed = True
+
+
+class PreparedStatement(object):
+
+    def __init__(self, cursor, sql):
+        self.cursor = cursor
+        self.sql = sql
+        self.plan = config['plan']
+
+    def close(self):
+        pass
+
+
+class Connection(object):
+
+    def __init__(self, **options):
+        self.charset = options.get('charset', 'NONE')
+        self.dialect = options.get('dialect', 3)
+        self.server_version = config['server_version']
+        self.default_tpb = ''
+        self.transaction_tpb = None
+        self.trans_in = {}
+        self.trans_out = {}
+        self.closed = False
+
+    def set_type_trans_in(self, translators):
+        self.trans_in.update(translators)
+
+    def set_type_trans_out(self, translators):
+        self.trans_out.update(translators)
+
+    def cursor(self):
+        return Cursor(self)
+
+    def begin(self, tpb=None):
+        self.transaction_tpb = tpb or self.default_tpb
+
+    def commit(self, retaining=False):
+        if not retaining:
+            self.transaction_tpb = None
+
+    def rollback(self, retaining=False):
+        if not retaining:
+            self.transaction_tpb = None
+
+    def close(self):
+        self.closed = True
+
+
+class Cursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.arraysize = 1
+        self.query_plan = None
+        self.trans_out = {}
+        self._rows = iter(())
+        self._translators = ()
+
+    def set_type_trans_out(self, translators):
+        self.trans_out.update(translators)
+
+    def prep(self, sql):
+        return PreparedStatement(self, sql)
+
+    def execute(self, sql, params=()):
+        if isinstance(sql, PreparedStatement):
+            if sql.cursor is not self:
+                raise ProgrammingError('PreparedStatement was not created by this cursor.')
+            sql = sql.sql
+        if self.connection.transaction_tpb is None:
+            # Transactions are started implicitly with the default TPB.
+            self.connection.begin()
+        if config['latency']:
+            time.sleep(config['latency'])
+        self.query_plan = config['plan']
+
+        upper = sql.lstrip().upper()
+        if upper.startswith('EXECUTE BLOCK') and ' RETURNS ' in upper:
+            self._set_result((('NEW_ID', 'INTEGER'),), [(_ids.next(),) for i in range(upper.count('SUSPEND'))])
+        elif upper.startswith('INSERT') and ' RETURNING ' in upper:
+            self._set_result((('ID', 'INTEGER'),), [(_ids.next(),)])
+        elif upper.startswith('SELECT GEN_ID'):
+            step = int(gen_id_re.search(sql).group(1))
+            value = 0
+            for i in range(max(step, 1)):
+                value = _ids.next()
+            self._set_result((('GEN_ID', 'INTEGER'),), [(value,)])
+        elif upper.startswith('SELECT COUNT('):
+            self._set_result((('COUNT', 'INTEGER'),), [(config['rows'],)])
+        elif upper.startswith('SELECT') and ('RDB$' in upper and 'RDB$DATABASE' not in upper or 'MON$' in upper):
+            # System tables are empty.
+            self._set_result((('RDB$RELATION_NAME', 'TEXT'),), [])
+        elif upper.startswith('SELECT'):
+            columns = config['columns']
+            rows = (tuple([naked_value(type_name, index) for name, type_name in columns])
+                    for index in xrange(config['rows']))
+            self._set_result(columns, rows)
+        else:
+            self.description = None
+            self.rowcount = 1
+            self._rows = iter(())
+
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, params)
+
+    def _set_result(self, columns, rows):
+        self.description = tuple([
+            (name, PYTHON_TYPES[type_name], 0, 0, 0, type_name == 'FIXED' and -2 or 0, True)
+            for name, type_name in columns])
+        translators = dict(self.connection.trans_out)
+        translators.update(self.trans_out)
+        self._translators = [translators.get(type_name) for name, type_name in columns]
+        for index, translator in enumerate(self._translators):
+            if isinstance(translator, dict):
+                # {'mode': 'stream'} for BLOBs.
+                self._translators[index] = BlobReader
+        self._rows = iter(rows)
+        self.rowcount = -1
+
+    def _translate(self, row):
+        return tuple([conv(value) if conv is not None and value is not None else value
+                      for conv, value in zip(self._translators, row)])
+
+    def fetchone(self):
+        for row in self._rows:
+            return self._translate(row)
+        return None
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        return [self._translate(row) for row in itertools.islice(self._rows, size)]
+
+    def fetchall(self):
+        return [self._translate(row) for row in self._rows]
+
+    def __iter__(self):
+        return itertools.imap(self._translate, self._rows)
+
+    def close(self):
+        self._rows = iter(())
@@ -0,0 +1,20 @@
+import datetime
+
+
+def date_conv_in(value):
+    return value
+
+def time_conv_in(value):
+    return value
+
+def timestamp_conv_in(value):
+    return value
+
+def date_conv_out(parts):
+    return datetime.date(*parts)
+
+def time_conv_out(parts):
+    return datetime.time(*parts)
+
+def timestamp_conv_out(parts):
+    return datetime.datetime(*parts)
@@ -0,0 +1,8 @@
+import decimal
+
+
+def fixed_conv_in_precise((value, scale)):
+    return int(decimal.Decimal(value).scaleb(-scale))
+
+def fixed_conv_out_precise((value, scale)):
+    return decimal.Decimal(value).scaleb(scale)
@@ -0,0 +1,7 @@
+def unicode_conv_in((text, charset)):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+def unicode_conv_out((text, charset)):
+    return text.decode('utf-8')
@@ -0,0 +1,104 @@
+"""
+Benchmarks of the backend hot paths against the fake kinterbasdb:
+per-execute overhead, insert throughput, fetch and conversion throughput
+and SQL compile time. No Firebird server is needed.
+
+Run with: python benchmarks/run.py
+
+Numbers depend on the machine, compare runs made on the same one.
+Fake server latency is 0 unless FAKE_LATENCY environment variable
+(seconds) is set.
+"""
+
+import os
+
+import env
+env.setup()
+
+import datetime
+import decimal
+
+import kinterbasdb
+from django.db import connections, models
+
+from firebird.bulk import bulk_create
+
+kinterbasdb.configure(latency=float(os.environ.get('FAKE_LATENCY', 0)))
+
+
+class Item(models.Model):
+    name = models.CharField(max_length=50)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    created = models.DateTimeField()
+    body = models.TextField()
+
+    class Meta:
+        app_label = 'bench'
+
+
+def new_item():
+    return Item(name='item', price=decimal.Decimal('10.25'), body='text',
+                created=datetime.datetime(2010, 1, 1, 12, 0, 0))
+
+
+def bench_execute():
+    kinterbasdb.configure(rows=1)
+    sql = 'SELECT "ID" FROM "BENCH_ITEM" WHERE "ID" = %s'
+
+    # _cursor() returns backend CursorWrapper, without Django's own wrapper.
+    raw = connections['default']._cursor().cursor
+    qmark_sql = sql % '?'
+    env.report('execute: kinterbasdb cursor', env.measure(lambda: raw.execute(qmark_sql, (1,)), 10000))
+
+    for alias in ('default', 'cached', 'results'):
+        cursor = connections[alias]._cursor()
+        env.report('execute: CursorWrapper (%s)' % alias, env.measure(lambda: cursor.execute(sql, (1,)), 10000))
+
+
+def bench_insert():
+    kinterbasdb.configure(rows=1)
+    env.report('insert: Model.save()', env.measure(lambda: new_item().save(using='default'), 1000))
+
+    batch = 1000
+    seconds = env.measure(lambda: bulk_create([new_item() for i in xrange(batch)], using='default'), 5)
+    env.report('insert: bulk_create() of %s' % batch, seconds / batch, unit='row')
+
+
+def bench_fetch():
+    rows = 10000
+    kinterbasdb.configure(rows=rows)
+    for alias in ('default', 'converters'):
+        cursor = connections[alias]._cursor()
+
+        def fetch():
+            cursor.execute('SELECT * FROM "BENCH_ITEM"')
+            cursor.fetchall()
+
+        env.report('fetch: fetchall() (%s)' % alias, env.measure(fetch, 5) / rows, unit='row')
+
+    queryset = Item.objects.using('default').all()
+    env.report('fetch: queryset iteration', env.measure(lambda: list(queryset.iterator()), 5) / rows, unit='row')
+
+
+def bench_compile():
+    queryset = Item.objects.filter(name='item', price__gt=1).order_by('-created')[10:20]
+
+    def compile():
+        queryset.query.get_compiler('default').as_sql()
+
+    env.report('compile: sliced filtered queryset', env.measure(compile, 2000))
+
+    cursor = connections['default']._cursor()
+    sql, params = queryset.query.get_compiler('default').as_sql()
+    env.report('compile: qmark conversion', env.measure(lambda: cursor.convert_query(sql, len(params)), 20000))
+
+
+def main():
+    bench_execute()
+    bench_insert()
+    bench_fetch()
+    bench_compile()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Tests of the backend against the fake kinterbasdb (see fake/kinterbasdb).
+Statements are not run anywhere, so tests check the statements sent to
+the server and the values returned for rows of configured shape.
+
+Run with: python benchmarks/tests.py
+"""
+
+import unittest
+
+import env
+env.DATABASES['in_lists'] = env.database(in_list_table=True)
+env.setup()
+
+import kinterbasdb
+from django.db import connections, models
+
+from firebird.inlist import MAX_IN_LIST_SIZE, TABLE
+from firebird.pagination import keyset_page
+from firebird.transaction import transaction_options
+
+
+class Parent(models.Model):
+    code = models.IntegerField()
+
+    class Meta:
+        app_label = 'tests'
+
+
+class Child(models.Model):
+    parent = models.ForeignKey(Parent)
+
+    class Meta:
+        app_label = 'tests'
+
+
+class StatementLog(object):
+    "Records (sql, params) of statements executed by fake cursors."
+
+    def __init__(self):
+        self.statements = []
+
+    def start(self):
+        self.execute = kinterbasdb.Cursor.execute
+        log = self.statements
+
+        def execute(cursor, sql, params=()):
+            log.append((getattr(sql, 'sql', sql), params))
+            return self.execute(cursor, sql, params)
+        kinterbasdb.Cursor.execute = execute
+
+    def stop(self):
+        kinterbasdb.Cursor.execute = self.execute
+
+
+class FakeTestCase(unittest.TestCase):
+    "Restores the fake server configuration and logs executed statements."
+
+    def setUp(self):
+        self.config = dict(kinterbasdb.config)
+        self.log = StatementLog()
+        self.log.start()
+
+    def tearDown(self):
+        self.log.stop()
+        kinterbasdb.config.clear()
+        kinterbasdb.config.update(self.config)
+        for alias in connections:
+            connections[alias].close()
+
+
+class InListTableTest(FakeTestCase):
+
+    def setUp(self):
+        super(InListTableTest, self).setUp()
+        self.connection = connections['in_lists']
+        self.connection.cursor()
+        self.connection.in_list_table_exists = True
+
+    def test_cascading_delete(self):
+        # Both tables have two integer columns, every SELECT returns 2000 rows.
+        kinterbasdb.configure(rows=2000, columns=(('ID', 'INTEGER'), ('VALUE', 'INTEGER')))
+        Parent.objects.using('in_lists').filter(code__gt=0).delete()
+
+        statements = [sql for sql, params in self.log.statements]
+        selects = [sql for sql in statements if sql.startswith('SELECT') and 'RDB$' not in sql]
+        self.assertEqual(len(selects), 2)
+        # Children are selected by the collected parents through the IN list table.
+        self.assertTrue('"tests_child"."parent_id" IN (SELECT INT_VALUE FROM %s' % TABLE in selects[1])
+        loads = [sql for sql in statements[:statements.index(selects[1])] if sql.startswith('EXECUTE BLOCK')]
+        self.assertTrue(loads)
+        for sql, params in self.log.statements:
+            if not sql.startswith('EXECUTE BLOCK'):
+                self.assertTrue(len(params) <= MAX_IN_LIST_SIZE)
+        self.assertTrue([sql for sql in statements if sql.startswith('DELETE FROM "tests_child"')])
+
+    def test_subquery(self):
+        kinterbasdb.configure(rows=1, columns=(('ID', 'INTEGER'), ('VALUE', 'INTEGER')))
+        parents = Parent.objects.using('in_lists').filter(pk__in=range(2000))
+        list(Child.objects.using('in_lists').filter(parent__in=parents))
+
+        sql, params = self.log.statements[-1]
+        self.assertTrue('IN (SELECT INT_VALUE FROM %s' % TABLE in sql)
+        list_id = params[-1]
+        loaded = [p for s, p in self.log.statements[:-1] if s.startswith('EXECUTE BLOCK')]
+        self.assertEqual(sum([len(p) for p in loaded]), 4000)
+        self.assertTrue(list_id in loaded[0])
+
+    def test_compiled_only(self):
+        # Nothing would load values for a statement which isn't executed.
+        queryset = Parent.objects.using('in_lists').filter(pk__in=range(2000))
+        sql, params = queryset.query.get_compiler('in_lists').as_sql()
+        self.assertFalse(TABLE in sql)
+        self.assertEqual(len(params), 2000)
+        self.assertEqual(self.log.statements, [])
+
+
+class TransactionOptionsTest(FakeTestCase):
+
+    def test_commit_in_block(self):
+        connection = connections['default']
+        connection.cursor()
+        raw_default_tpb = connection.connection.default_tpb
+        with transaction_options(isolation_level='read_committed'):
+            tpb = connection.connection.transaction_tpb
+            self.assertNotEqual(tpb, raw_default_tpb)
+            # save() commits unless transactions are managed.
+            Parent(code=1).save()
+            self.assertEqual(connection.connection.transaction_tpb, None)
+            list(Parent.objects.all())
+            self.assertEqual(connection.connection.transaction_tpb, tpb)
+        self.assertEqual(connection.connection.default_tpb, raw_default_tpb)
+        list(Parent.objects.all())
+        self.assertEqual(connection.connection.transaction_tpb, raw_default_tpb)
+
+
+class KeysetPageTest(FakeTestCase):
+
+    def setUp(self):
+        super(KeysetPageTest, self).setUp()
+        kinterbasdb.configure(rows=2, columns=(('ID', 'INTEGER'), ('CODE', 'INTEGER')))
+
+    def test_values(self):
+        items, last = keyset_page(Parent.objects.values('id', 'code'), ordering=('-code',), size=2)
+        self.assertEqual(items[-1], {'id': 1, 'code': 1})
+        self.assertEqual(last, (1, 1))
+        items, last = keyset_page(Parent.objects.values('id', 'code'), ordering=('-code',), last=last, size=2)
+        sql, params = self.log.statements[-1]
+        self.assertTrue('"tests_parent"."code" <= ?' in sql)
+        self.assertEqual(list(params[:2]), [1, 1])
+
+    def test_instances(self):
+        items, last = keyset_page(Parent.objects.all(), size=2)
+        self.assertEqual(last, (1,))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,379 @@
+"""
+Index advisor.
+
+Collects executed statements along with their Firebird PLANs and suggests
+indexes for tables read with NATURAL (full) scans or sorted without an
+index, ranked by the number of statements that would use them:
+
+    advisor = IndexAdvisor(using='default')
+    advisor.start()
+    ...  # let the application run for a while
+    advisor.stop()
+    for suggestion in advisor.suggestions():
+        print suggestion.queries, suggestion.sql()
+
+start() registers an instrumentation hook (see firebird.instrumentation),
+so 'instrumentation' option must be set. Statements without a sampled
+PLAN are prepared (not executed) when suggestions are made, to get it.
+Statements can also be added with add(), e.g. SQL texts seen in
+MON$STATEMENTS (see fbadvise management command).
+
+Suggested columns are the ones a statement compares (equality first) or
+orders by, taken from the statement text, so suggestions are a starting
+point to be reviewed, not a guarantee. Foreign key columns of installed
+models which aren't the leading column of any index are suggested too.
+Existing indexes are taken from the introspection catalog (see
+DatabaseIntrospection.get_catalog()), inactive ones covering suggested
+columns are suggested to be activated. Tables estimated to have fewer
+than `min_rows` rows are skipped.
+"""
+
+import re
+import threading
+
+from django.db import connections, router, DEFAULT_DB_ALIAS
+from django.db.backends import util
+from django.db.models import get_models, ForeignKey
+
+from firebird.instrumentation import normalize_sql
+
+# Tables with fewer estimated rows are read fast enough without an index.
+MIN_ROWS = 10000
+
+# Columns of a suggested index.
+MAX_COLUMNS = 3
+
+statement_re = re.compile(r'^\s*(?:SELECT|UPDATE|DELETE)\b', re.I)
+system_re = re.compile(r'\bRDB\$|\bMON\$', re.I)
+
+identifier = r'("[^"]+"|[A-Za-z_][\w$]*)'
+table_re = re.compile(r'\b(?:FROM|JOIN|UPDATE)\s+%s(?:\s+(?:AS\s+)?%s)?' % (identifier, identifier), re.I)
+# Operators an index can be used for, LIKE and CONTAINING can't in general.
+operator = r'\s*(=|<>|!=|<=|>=|<|>|NOT\s+IN\b|IN\b|IS\b|STARTING\b|BETWEEN\b)'
+condition_re = re.compile(r'%s\.%s%s' % (identifier, identifier, operator), re.I)
+# Right hand sides of join conditions.
+join_re = re.compile(r'=\s*%s\.%s' % (identifier, identifier), re.I)
+# Unqualified columns are recognized only quoted, in single table statements.
+unqualified_re = re.compile(r'(?<![.\w"])("[^"]+")%s' % operator, re.I)
+order_by_re = re.compile(r'\bORDER\s+BY\s+(.+?)(?:\bROWS\b|\bFOR\s+UPDATE\b|$)', re.I | re.S)
+order_item_re = re.compile(r'^(?:%s\.)?%s(?:\s+(ASC|DESC)\w*)?' % (identifier, identifier), re.I)
+
+natural_re = re.compile(r'([\w$"]+)\s+NATURAL\b', re.I)
+sort_re = re.compile(r'\bSORT\s*\(', re.I)
+
+KEYWORDS = set(['ON', 'WHERE', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'JOIN', 'CROSS', 'NATURAL',
+                'SET', 'ORDER', 'GROUP', 'HAVING', 'UNION', 'ROWS', 'PLAN', 'FOR', 'WITH'])
+
+
+def unquote(name):
+    return name.strip('"')
+
+
+def get_aliases(sql):
+    "Returns {alias: table} of tables `sql` reads, tables are their own aliases."
+    aliases = {}
+    for table, alias in table_re.findall(sql):
+        table = unquote(table)
+        aliases[table] = table
+        if alias and alias.upper() not in KEYWORDS:
+            aliases[unquote(alias)] = table
+    return aliases
+
+
+def get_conditions(sql, aliases):
+    """
+    Returns {alias: [(column, equality)]} of columns compared by `sql`,
+    in order of appearance.
+    """
+    conditions = {}
+
+    def add(alias, column, equality):
+        columns = conditions.setdefault(alias, [])
+        for index, (other, other_equality) in enumerate(columns):
+            if other == column:
+                if equality and not other_equality:
+                    columns[index] = (column, True)
+                return
+        columns.append((column, equality))
+
+    for alias, column, op in condition_re.findall(sql):
+        op = op.upper()
+        add(unquote(alias), unquote(column), op in ('=', 'IN', 'IS'))
+    for alias, column in join_re.findall(sql):
+        add(unquote(alias), unquote(column), True)
+    tables = set(aliases.values())
+    if len(tables) == 1:
+        table = tables.pop()
+        for column, op in unqualified_re.findall(sql):
+            add(table, unquote(column), op.upper() in ('=', 'IN', 'IS'))
+    return conditions
+
+
+def get_order_by(sql):
+    "Returns [(alias, column, descending)] of ORDER BY items of `sql`, None if some aren't columns."
+    match = order_by_re.search(sql)
+    if match is None:
+        return []
+    items = []
+    for item in match.group(1).split(','):
+        item_match = order_item_re.match(item.strip())
+        if item_match is None:
+            return None
+        alias, column, direction = item_match.groups()
+        items.append((alias and unquote(alias) or None, unquote(column), (direction or '').upper() == 'DESC'))
+    return items
+
+
+def candidate_columns(conditions):
+    "Returns index columns for `conditions`: equality ones and then a single range one."
+    equal = [column for column, equality in conditions if equality]
+    ranges = [column for column, equality in conditions if not equality]
+    return tuple((equal + ranges[:1])[:MAX_COLUMNS])
+
+
+class Suggestion(object):
+    """
+    Suggested index on `columns` of `table`. `reasons` are a subset of
+    'natural_scan', 'sort' and 'foreign_key', `statements` maps normalized
+    SQL of statements which would use the index to their executions.
+    """
+
+    def __init__(self, table, columns, descending=False):
+        self.table = table
+        self.columns = columns
+        self.descending = descending
+        self.reasons = set()
+        self.statements = {}
+        self.total_time = 0.0
+        self.rows = None
+        # Name of an existing inactive index on the columns.
+        self.inactive_index = None
+
+    @property
+    def queries(self):
+        "Number of distinct statements affected."
+        return len(self.statements)
+
+    @property
+    def executions(self):
+        return sum(self.statements.values())
+
+    def add_statement(self, statement):
+        if statement.sql not in self.statements:
+            self.total_time += statement.total_time
+        self.statements[statement.sql] = statement.count
+
+    def index_name(self):
+        return util.truncate_name('IDX_%s_%s' % (self.table, '_'.join(self.columns)), 31).upper()
+
+    def sql(self, quote_name=None):
+        """
+        Returns CREATE INDEX (or ALTER INDEX ... ACTIVE) statement, names
+        are quoted with `quote_name` if given.
+        """
+        qn = quote_name or (lambda name: '"%s"' % name)
+        if self.inactive_index:
+            return 'ALTER INDEX %s ACTIVE' % qn(self.inactive_index)
+        return 'CREATE %sINDEX %s ON %s (%s)' % (
+            self.descending and 'DESCENDING ' or '', qn(self.index_name()), qn(self.table),
+            ', '.join([qn(column) for column in self.columns]))
+
+    def as_dict(self):
+        return {
+            'table': self.table,
+            'columns': self.columns,
+            'descending': self.descending,
+            'reasons': sorted(self.reasons),
+            'queries': self.queries,
+            'executions': self.executions,
+            'total_time': self.total_time,
+            'rows': self.rows,
+            'sql': self.sql(),
+        }
+
+
+class Statement(object):
+    "Executions of statements of the same normalized SQL."
+
+    def __init__(self, sql, example):
+        self.sql = sql
+        # An executable form, for preparing it.
+        self.example = example
+        self.plan = None
+        self.count = 0
+        self.total_time = 0.0
+
+
+class IndexAdvisor(object):
+    "Suggests indexes for statements executed on `using` database."
+
+    def __init__(self, using=None, min_rows=MIN_ROWS):
+        self.using = using or DEFAULT_DB_ALIAS
+        self.min_rows = min_rows
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        "Starts collecting statements executed through the instrumented connection."
+        instrumentation = connections[self.using].instrumentation
+        if instrumentation is None:
+            raise ValueError("Instrumentation of database %s isn't enabled, "
+                             "set 'instrumentation' in its OPTIONS." % self.using)
+        instrumentation.add_hook(self.record)
+
+    def stop(self):
+        instrumentation = connections[self.using].instrumentation
+        if instrumentation is not None:
+            instrumentation.remove_hook(self.record)
+
+    def record(self, record):
+        "Instrumentation hook."
+        self.add(record.sql, record.plan, record.duration)
+
+    def add(self, sql, plan=None, duration=0.0, count=1):
+        "Adds `count` executions of `sql` (with `plan` if known)."
+        if not statement_re.match(sql) or system_re.search(sql):
+            return
+        normalized = normalize_sql(sql)
+        self._lock.acquire()
+        try:
+            statement = self.statements.get(normalized)
+            if statement is None:
+                statement = self.statements[normalized] = Statement(normalized, sql)
+            statement.count += count
+            statement.total_time += duration
+            if plan:
+                statement.plan = plan
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.statements = {}
+        finally:
+            self._lock.release()
+
+    def get_plan(self, sql):
+        "Returns PLAN of `sql` prepared without executing it, None if it can't be prepared."
+        connection = connections[self.using]
+        connection.cursor()
+        cursor = connection.connection.cursor()
+        try:
+            return cursor.prep(sql).plan
+        except Exception:
+            return None
+        finally:
+            cursor.close()
+
+    def suggestions(self, foreign_keys=True):
+        """
+        Returns a list of Suggestions ranked by the number of affected
+        statements, then executions and time. Columns which are already
+        the leading part of an active index are left out, those of an
+        inactive one are suggested to be activated.
+        """
+        connection = connections[self.using]
+        cursor = connection.cursor()
+        catalog = connection.introspection.get_catalog(cursor)
+        self._lock.acquire()
+        try:
+            statements = self.statements.values()
+        finally:
+            self._lock.release()
+
+        suggestions = {}
+        estimates = {}
+
+        def suggest(table, columns, descending, reason, statements):
+            if table not in catalog.tables:
+                return
+            index = get_covering_index(catalog.indexes.get(table, []), columns)
+            if index is not None and not index['inactive']:
+                return
+            if table not in estimates:
+                estimates[table] = connection.introspection.get_row_estimate(cursor, table)
+            rows = estimates[table]
+            if rows is not None and rows < self.min_rows:
+                return
+            key = (table, columns, descending)
+            suggestion = suggestions.get(key)
+            if suggestion is None:
+                suggestion = suggestions[key] = Suggestion(table, columns, descending)
+                suggestion.rows = rows
+                if index is not None:
+                    suggestion.inactive_index = index['name']
+            suggestion.reasons.add(reason)
+            for statement in statements:
+                suggestion.add_statement(statement)
+
+        # (table, column) pairs compared by each statement.
+        compared = {}
+        for statement in statements:
+            aliases = get_aliases(statement.example)
+            lookup = dict([(alias.upper(), table) for alias, table in aliases.items()])
+            lookup.update(aliases)
+            conditions = get_conditions(statement.example, aliases)
+            compared[statement] = set()
+            for alias, columns in conditions.items():
+                table = lookup.get(alias) or lookup.get(alias.upper())
+                compared[statement].update([(table, column) for column, equality in columns])
+
+            if statement.plan is None:
+                statement.plan = self.get_plan(statement.example)
+            if not statement.plan:
+                continue
+            for alias in natural_re.findall(statement.plan):
+                alias = unquote(alias)
+                table = lookup.get(alias) or lookup.get(alias.upper())
+                if table is None:
+                    continue
+                columns = candidate_columns(conditions.get(alias) or conditions.get(table) or [])
+                if columns:
+                    suggest(table, columns, False, 'natural_scan', [statement])
+
+            order_by = sort_re.search(statement.plan) and get_order_by(statement.example)
+            if order_by:
+                single = None
+                if len(set(aliases.values())) == 1:
+                    single = aliases.values()[0]
+                tables = set([alias and lookup.get(alias) or single for alias, column, descending in order_by])
+                directions = set([descending for alias, column, descending in order_by])
+                # An index serves ORDER BY of a single table in a single direction.
+                if len(tables) == 1 and None not in tables and len(directions) == 1:
+                    columns = tuple([column for alias, column, descending in order_by][:MAX_COLUMNS])
+                    suggest(tables.pop(), columns, directions.pop(), 'sort', [statement])
+
+        if foreign_keys:
+            for table, column in self.get_foreign_keys():
+                suggest(table, (column,), False, 'foreign_key',
+                        [statement for statement in statements if (table, column) in compared[statement]])
+
+        result = suggestions.values()
+        result.sort(key=lambda s: (s.queries, s.executions, s.total_time), reverse=True)
+        return result
+
+    def get_foreign_keys(self):
+        "Returns (table, column) pairs of foreign keys of installed models."
+        qn = connections[self.using].ops.quote_name
+        result = []
+        for model in get_models(include_auto_created=True):
+            opts = model._meta
+            if opts.proxy or not opts.managed or not router.allow_syncdb(self.using, model):
+                continue
+            for field in opts.local_fields:
+                if isinstance(field, ForeignKey):
+                    result.append((unquote(qn(opts.db_table)), unquote(qn(field.column))))
+        return result
+
+
+def get_covering_index(indexes, columns):
+    "Returns the one of `indexes` `columns` are the leading columns of, an active one if any."
+    columns = list(columns)
+    covering = None
+    for index in indexes:
+        if index['fields'][:len(columns)] == columns:
+            if not index['inactive']:
+                return index
+            covering = index
+    return covering
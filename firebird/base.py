@@ -7,7 +7,9 @@ http://www.firebirdsql.org/index.php?op=devel&sub=python
 
 import re
 import sys
+import time
 import base64
+import datetime
 
 try:
     import kinterbasdb as Database
@@ -22,6 +24,16 @@ from django.db.backends.signals import connection_created
 from firebird.creation import DatabaseCreation
 from firebird.introspection import DatabaseIntrospection
 from firebird.client import DatabaseClient
+from firebird.statements import StatementCache
+from firebird.pool import get_pool
+from firebird.keys import allocator
+from firebird.utils import StreamStats
+from firebird.converters import RowConverter, ROW_CONVERTED_TYPES
+from firebird.instrumentation import get_instrumentation
+from firebird.transaction import build_tpb
+from firebird.inlist import MAX_IN_LIST_SIZE
+from firebird.monitoring import Monitor
+from firebird.resultcache import CachedRows, get_result_cache, transaction_ended
 
 from django.conf import settings
 
@@ -30,6 +42,22 @@ import kinterbasdb.typeconv_datetime_stdlib as typeconv_datetime
 import kinterbasdb.typeconv_fixed_decimal as typeconv_fixeddecimal
 import kinterbasdb.typeconv_text_unicode as typeconv_textunicode
 
+# Default number of rows fetched at once by streaming CursorWrapper methods.
+STREAM_CHUNK_SIZE = 1000
+
+# Statements changing database schema.
+DDL_STATEMENTS = ('CREATE', 'ALTER', 'DROP', 'RECREATE')
+
+# Memo of qmark conversions by (query, number of parameters) and of quoted
+# names, emptied when they grow over the size (the same few statements and
+# names come again and again).
+CONVERTED_QUERIES_SIZE = 1000
+converted_queries = {}
+# Longer queries (EXECUTE BLOCK inserts, IN list loads) are rarely repeated,
+# they are converted without the memo.
+MAX_CONVERTED_QUERY_LENGTH = 4096
+QUOTED_NAMES_SIZE = 1000
+
 DatabaseError = Database.DatabaseError
 IntegrityError = Database.IntegrityError
 OperationalError = Database.OperationalError
@@ -46,8 +74,15 @@ class CursorWrapper(object):
     We need to do some data translation too.
     See: http://kinterbasdb.sourceforge.net/dist_docs/usage.html for Dynamic Type Translation
     """
-    def __init__(self, cursor):
+    def __init__(self, cursor, db=None):
         self.cursor = cursor
+        self.own_cursor = cursor
+        self.db = db
+        self.statement = None
+        self.stream_stats = None
+        self.converter = None
+        self.record = None
+        self.pending_result = None
         
     def __getattr__(self, attr):
         if attr in self.__dict__:
@@ -56,55 +91,270 @@ class CursorWrapper(object):
             return getattr(self.cursor, attr)
 
     def __iter__(self):
-        return iter(self.cursor)
+        if self.db is not None and self.db.fetch_chunk_size:
+            return self.stream()
+        if self.converter is None and self.record is None:
+            return iter(self.cursor)
+        return self.iter_rows()
+
+    def iter_rows(self):
+        for row in self.cursor:
+            if self.converter is not None:
+                row = self.converter.convert_row(row)
+            if self.record is not None:
+                self.record.add_rows(1)
+            yield row
+
+    def stream(self, chunk_size=None):
+        """
+        Yields rows one by one, reading them in chunks with fetchmany(),
+        so memory use doesn't depend on result set size.
+        """
+        for rows in self.stream_chunks(chunk_size):
+            for row in rows:
+                yield row
+
+    def stream_chunks(self, chunk_size=None):
+        """
+        Yields lists of at most `chunk_size` rows ('fetch_chunk_size' option by default).
+        Read statistics are kept in `stream_stats` and added to connection's ones.
+        """
+        if chunk_size is None:
+            chunk_size = self.db is not None and self.db.fetch_chunk_size or STREAM_CHUNK_SIZE
+        stats = self.stream_stats = StreamStats()
+        started = time.time()
+        try:
+            while True:
+                rows = self.fetchmany(chunk_size)
+                if not rows:
+                    break
+                stats.add_chunk(len(rows))
+                # Time spent by the consumer between chunks is not ours.
+                stats.elapsed += time.time() - started
+                yield rows
+                started = time.time()
+        finally:
+            if self.db is not None:
+                self.db.stream_stats.merge(stats)
+
+    def __del__(self):
+        self.release_statement()
+
+    def prepare(self, query):
+        """
+        Returns a statement object to be passed to kinterbasdb cursor.
+
+        When prepared statements cache is enabled, cached PreparedStatement
+        is leased and the cursor it is bound to is used for execution.
+        """
+        self.release_statement()
+        cache = None
+        if self.db is not None:
+            cache = self.db.statement_cache
+        if cache is not None and cache.is_cacheable(query):
+            self.statement = cache.acquire(query)
+            if self.statement is not None:
+                self.cursor = self.statement.cursor
+                return self.statement.statement
+        return query
+
+    def release_statement(self):
+        statement = self.__dict__.get('statement')
+        # Cached rows may stand for the cursor too.
+        self.cursor = self.own_cursor
+        if statement is not None:
+            self.statement = None
+            statement.release()
+
+    def close(self):
+        self.release_statement()
+        self.own_cursor.close()
 
     def execute(self, query, args=None):
         
+        statement = query.lstrip()[:13].upper()
+        if statement.startswith(DDL_STATEMENTS) or statement == 'SET GENERATOR':
+            # Generators may be dropped, recreated or reset (e.g. by flush),
+            # keys of blocks reserved from them would be given out again.
+            allocator.reset()
+        if self.db is not None and statement.startswith(DDL_STATEMENTS):
+            # Schema is about to change, cached catalog and results become stale.
+            self.db.introspection.invalidate_catalog()
+            if self.db.result_cache is not None:
+                self.db.result_cache.clear()
+            if self.db.statement_cache is not None:
+                # Prepared statements keep their tables in use, which makes
+                # DROP or ALTER of them fail.
+                self.release_statement()
+                self.db.statement_cache.clear()
+
         # This is a workaround for KInterbasDB locks
         if query.find('DROP') != -1:
             # self.cursor.close()
             # someday will recreate cursor here 
             pass
             
+        started = time.time()
         try:
-            #print query, args
             if not args:
                 args = ()
-                return self.cursor.execute(query)
             else:
                 query = self.convert_query(query, len(args))
-                return self.cursor.execute(query, args)
+            if self.lookup_result(query, args):
+                self.setup_converter()
+                self.record = None
+                return None
+            # prepare() may switch self.cursor to the statement's own cursor.
+            statement = self.prepare(query)
+            if args:
+                result = self.cursor.execute(statement, args)
+            else:
+                result = self.cursor.execute(statement)
+            if self.pending_result is not None:
+                self.store_result()
         except Database.IntegrityError, e:
-            raise utils.IntegrityError, utils.IntegrityError(*tuple(e)+('sql: '+query,)+args), sys.exc_info()[2]
+            self.raise_error(utils.IntegrityError, e, query, tuple(args))
         except Database.DatabaseError, e:
-            raise utils.DatabaseError, utils.DatabaseError(*tuple(e)+('sql: '+query,)+args), sys.exc_info()[2]
+            self.raise_error(utils.DatabaseError, e, query, tuple(args))
+        self.setup_converter()
+        self.instrument(query, started)
+        return result
+
+    def lookup_result(self, query, args):
+        """
+        Looks the statement up in the result cache if it is enabled (see
+        firebird.resultcache). On hit, cached rows become the result set and
+        True is returned. On miss, the statement result is to be stored
+        once it is executed (see store_result()).
+        """
+        self.pending_result = None
+        cache = None
+        if self.db is not None and not self.db.changed_tables:
+            cache = self.db.result_cache
+        if cache is None:
+            return False
+        tables = cache.get_statement_tables(query)
+        if tables is None:
+            return False
+        key = cache.make_key(query, args)
+        result = cache.get(key, tables)
+        if result is not None:
+            self.release_statement()
+            self.cursor = CachedRows(result.description, result.rows)
+            return True
+        # Versions are taken before execution, so that changes made
+        # meanwhile make the stored result stale.
+        self.pending_result = (key, cache.get_versions(tables))
+        return False
+
+    def store_result(self):
+        """
+        Reads up to 'max_rows' rows of the statement just executed into the
+        result cache, the rest (if any) is read from the cursor as usual.
+        """
+        key, versions = self.pending_result
+        self.pending_result = None
+        cache = self.db.result_cache
+        description = self.cursor.description
+        rows = self.cursor.fetchmany(cache.max_rows + 1)
+        rest = None
+        if self.db.blob_stream and [v for row in rows for v in row if hasattr(v, 'read')]:
+            # BLOB readers don't outlive the transaction.
+            rest = self.cursor
+        elif not cache.set(key, description, rows, versions):
+            rest = self.cursor
+        self.cursor = CachedRows(description, rows, rest)
 
     def executemany(self, query, args):
+        started = time.time()
         try:
-            #print query, args
             if not args:
                 args = ()
-                return self.cursor.executemany(query)
             else:
                 query = self.convert_query(query, len(args[0]))
-                return self.cursor.executemany(query, args)
+            statement = self.prepare(query)
+            result = self.cursor.executemany(statement, args)
         except Database.IntegrityError, e:
-            raise utils.IntegrityError, utils.IntegrityError(*tuple(e)+('sql: '+query,)+args), sys.exc_info()[2]
+            self.raise_error(utils.IntegrityError, e, query, ('%d parameter sets' % len(args),))
         except Database.DatabaseError, e:
-            raise utils.DatabaseError, utils.DatabaseError(*tuple(e)+('sql: '+query,)+args), sys.exc_info()[2]
+            self.raise_error(utils.DatabaseError, e, query, ('%d parameter sets' % len(args),))
+        self.converter = None
+        self.instrument(query, started)
+        return result
+
+    def raise_error(self, error_class, error, query, params):
+        """
+        Re-raises kinterbasdb `error` as Django `error_class` keeping its
+        arguments (SQLCODE, message) first, so that error kind can be told
+        (see firebird.retry.classify_error()), and adding the query.
+        """
+        raise error_class, error_class(*tuple(error.args)+('sql: '+query,)+params), sys.exc_info()[2]
 
-        
     def convert_query(self, query, num_params):
-        return query % tuple("?" * num_params)
+        """
+        Returns `query` with %s placeholders replaced by ? ones and %%
+        by %, the same way as Python string formatting does.
+        """
+        if len(query) > MAX_CONVERTED_QUERY_LENGTH:
+            return query % (('?',) * num_params)
+        key = (query, num_params)
+        converted = converted_queries.get(key)
+        if converted is None:
+            converted = query % (('?',) * num_params)
+            if len(converted_queries) >= CONVERTED_QUERIES_SIZE:
+                converted_queries.clear()
+            converted_queries[key] = converted
+        return converted
     
+    def setup_converter(self):
+        "Prepares row converter for the statement just executed if they are enabled."
+        self.converter = None
+        if self.db is not None and self.db.row_converters and self.cursor.description:
+            self.converter = RowConverter(self.cursor.description)
+
+    def instrument(self, query, started):
+        "Records the statement just executed if instrumentation is enabled."
+        self.record = None
+        instrumentation = self.db is not None and self.db.instrumentation
+        if instrumentation:
+            plan = None
+            duration = time.time() - started
+            if instrumentation.should_capture_plan():
+                plan = self.get_plan()
+            self.record = instrumentation.record(query, duration, plan)
+
+    def get_plan(self):
+        "Returns Firebird PLAN of the statement just executed, None if not available."
+        try:
+            if self.statement is not None:
+                return self.statement.statement.plan
+            return self.cursor.query_plan
+        except Exception:
+            return None
+
     def fetchone(self):
-        return self.cursor.fetchone()
+        row = self.cursor.fetchone()
+        if self.converter is not None:
+            row = self.converter.convert_row(row)
+        if self.record is not None and row is not None:
+            self.record.add_rows(1)
+        return row
 
     def fetchmany(self, size=None):
-        return self.cursor.fetchmany(size)
+        rows = self.cursor.fetchmany(size)
+        if self.converter is not None:
+            rows = self.converter.convert_rows(rows)
+        if self.record is not None:
+            self.record.add_rows(len(rows))
+        return rows
 
     def fetchall(self):
-        return self.cursor.fetchall()
+        rows = self.cursor.fetchall()
+        if self.converter is not None:
+            rows = self.converter.convert_rows(rows)
+        if self.record is not None:
+            self.record.add_rows(len(rows))
+        return rows
  
 class DatabaseFeatures(BaseDatabaseFeatures):
     """
@@ -131,6 +381,7 @@ class DatabaseOperations(BaseDatabaseOperations):
         self.dialect = dialect
         self._cache = None
         self._engine_version = None
+        self._quoted_names = {}
         self.FB_CHARSET_CODE = 3 #UNICODE_FSS
     
     def autoinc_sql(self, table, column):
@@ -158,6 +409,16 @@ class DatabaseOperations(BaseDatabaseOperations):
         return "EXTRACT(%s FROM %s)" % (lkp_type.upper(), field_name)
 
     def date_trunc_sql(self, lookup_type, field_name):
+        if self.dialect == 3:
+            # Native date arithmetic, no string building and parsing.
+            if lookup_type == 'year':
+                # YEARDAY is 0 for January 1.
+                sql = "CAST(%s AS DATE) - EXTRACT(YEARDAY FROM %s)" % (field_name, field_name)
+            elif lookup_type == 'month':
+                sql = "CAST(%s AS DATE) - EXTRACT(DAY FROM %s) + 1" % (field_name, field_name)
+            elif lookup_type == 'day':
+                sql = "CAST(%s AS DATE)" % field_name
+            return "CAST(%s AS TIMESTAMP)" % sql
         if lookup_type == 'year':
              sql = "EXTRACT(year FROM %s)||'-01-01 00:00:00'" % field_name
         elif lookup_type == 'month':
@@ -167,26 +428,73 @@ class DatabaseOperations(BaseDatabaseOperations):
         return "CAST(%s AS TIMESTAMP)" % sql
     
     def lookup_cast(self, lookup_type):
-        if lookup_type in ('iexact', 'istartswith', 'iendswith'):
+        if lookup_type in ('iexact', 'icontains', 'istartswith', 'iendswith'):
             return "UPPER(%s)"
         return "%s"
     
     def fulltext_search_sql(self, field_name):
         # We use varchar for TextFields so this is possible
         # Look at http://www.volny.cz/iprenosil/interbase/ip_ib_strings.htm
-        return '%%s CONTAINING %s' % self.quote_name(field_name)
+        # Fields registered in firebird.fulltext get a trigram index prefilter.
+        return '%s CONTAINING %%s' % field_name
 
     def return_insert_id(self):
         return 'RETURNING %s', ()
 
     def last_insert_id(self, cursor, table_name, pk_name):
-        # Method used for Firebird prior 2. Method is unreliable, but nothing else could be done
+        # Method used for Firebird prior 2 only, later versions use INSERT ... RETURNING
+        # (see can_return_id_from_insert). Method is unreliable, but nothing else could be done
         cursor.execute('SELECT GEN_ID(%s, 0) FROM rdb$database' % (self.get_generator_name(table_name),))
         return cursor.fetchone()[0]
 
+    def execute_block_insert_sql(self, table, columns, types, num_rows, pk_column=None, pk_type='integer'):
+        """
+        Returns EXECUTE BLOCK statement (Firebird 2.0+) inserting `num_rows`
+        rows in one go. Block parameters are declared with given column
+        `types`. If `pk_column` is given, the block returns generated keys.
+        """
+        qn = self.quote_name
+        insert = 'INSERT INTO %s (%s) VALUES (%%s)' % (qn(table), ', '.join([qn(c) for c in columns]))
+        if pk_column:
+            insert += ' RETURNING %s INTO :NEW_ID; SUSPEND' % qn(pk_column)
+
+        params = []
+        body = []
+        for row in range(num_rows):
+            names = []
+            for db_type in types:
+                name = 'P%d' % len(params)
+                params.append('%s %s = %%s' % (name, db_type))
+                names.append(':' + name)
+            body.append('%s;' % (insert % ', '.join(names)))
+
+        returns = ''
+        if pk_column:
+            returns = ' RETURNS (NEW_ID %s)' % pk_type
+        return 'EXECUTE BLOCK (%s)%s AS BEGIN %s END' % (', '.join(params), returns, ' '.join(body))
+
+    def sql_flush(self, style, tables, sequences):
+        # Rows referenced by foreign keys of other tables can't be deleted
+        # before the referencing ones, tables are expected to come in
+        # a workable order or be empty (e.g. in a new test database).
+        sql = ['%s %s %s;' % (
+                style.SQL_KEYWORD('DELETE'),
+                style.SQL_KEYWORD('FROM'),
+                style.SQL_FIELD(self.quote_name(table))
+                ) for table in tables]
+        for sequence in sequences:
+            sql.append('%s %s %s 0;' % (
+                style.SQL_KEYWORD('SET GENERATOR'),
+                style.SQL_FIELD(self.get_generator_name(sequence['table'])),
+                style.SQL_KEYWORD('TO')))
+        return sql
+
     def max_name_length(self):
         return 31
 
+    def max_in_list_size(self):
+        return MAX_IN_LIST_SIZE
+
     def convert_values(self, value, field):
         return super(DatabaseOperations, self).convert_values(value, field)
 
@@ -194,6 +502,15 @@ class DatabaseOperations(BaseDatabaseOperations):
         return query.query_class(DefaultQueryClass)
             
     def quote_name(self, name):
+        quoted = self._quoted_names.get(name)
+        if quoted is None:
+            quoted = self._quote_name(name)
+            if len(self._quoted_names) >= QUOTED_NAMES_SIZE:
+                self._quoted_names.clear()
+            self._quoted_names[name] = quoted
+        return quoted
+
+    def _quote_name(self, name):
         # Dialect differences as described in http://mc-computing.com/databases/Firebird/SQL_Dialect.html
         if self.dialect==1:
             name = name.upper()
@@ -212,9 +529,15 @@ class DatabaseOperations(BaseDatabaseOperations):
         return '%s_TR' % util.truncate_name(table_name, self.max_name_length() - 3).upper()
 
     def year_lookup_bounds(self, value):
+        # Firebird timestamps keep 1/10000 of a second.
+        first = '%s-01-01 00:00:00'
+        second = '%s-12-31 23:59:59.9999'
+        return [first % value, second % value]
+
+    def year_lookup_bounds_for_date_field(self, value):
         first = '%s-01-01'
-        second = self.conv_in_date('%s-12-31 23:59:59.999999' % value)
-        return [first % value, second]
+        second = '%s-12-31'
+        return [first % value, second % value]
     
     def conv_in_ascii(self, text):
         if text is not None:
@@ -225,6 +548,9 @@ class DatabaseOperations(BaseDatabaseOperations):
             return utils_encoding.smart_str(text, 'ascii')   
 
     def conv_in_blob(self, text): 
+        if hasattr(text, 'read'):
+            # kinterbasdb reads file-like objects in chunks itself.
+            return text
         return typeconv_textunicode.unicode_conv_in((utils_encoding.smart_unicode(text), self.FB_CHARSET_CODE))
 
     def conv_in_fixed(self, (val, scale)):
@@ -242,7 +568,6 @@ class DatabaseOperations(BaseDatabaseOperations):
         return typeconv_datetime.timestamp_conv_in(timestamp)
 
     def conv_in_time(self, value):
-        import datetime
         if isinstance(value, datetime.datetime):
             value = datetime.time(value.hour, value.minute, value.second, value.microsecond)
         return typeconv_datetime.time_conv_in(value)   
@@ -277,12 +602,13 @@ class DatabaseWrapper(BaseDatabaseWrapper):
     """
     Represents a database connection.
     """
+    vendor = 'firebird'
     
     operators = {
         'exact': '= %s',
         'iexact': '= UPPER(%s)',
         'contains': "LIKE %s ESCAPE'\\'",
-        'icontains': 'CONTAINING %s', #case is ignored
+        'icontains': "LIKE UPPER(%s) ESCAPE'\\'",  # value comes wrapped in %
         'gt': '> %s',
         'gte': '>= %s',
         'lt': '< %s',
@@ -310,12 +636,58 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         if settings_dict['PASSWORD']:
             self.settings['password'] = settings_dict['PASSWORD']               
         self.settings.update(settings_dict['OPTIONS'])
+
+        # Backend options, not to be passed to kinterbasdb connect().
+        self.statement_cache_size = self.settings.pop('statement_cache_size', 0)
+        self.statement_cache = None
+        self.pool_options = self.settings.pop('pool', None)
+        self.key_block_size = self.settings.pop('key_block_size', None)
+        self.fetch_chunk_size = self.settings.pop('fetch_chunk_size', None)
+        self.row_converters = self.settings.pop('row_converters', False)
+        self.blob_stream = self.settings.pop('blob_stream', False)
+        result_cache_options = self.settings.pop('result_cache', None)
+        in_list_table = self.settings.pop('in_list_table', None)
+        instrumentation_options = self.settings.pop('instrumentation', None)
+        transaction_options = self.settings.pop('transaction', None)
+        self.stream_stats = StreamStats()
         
         self.dialect = self.settings['dialect']
         
         if 'init_params' in self.settings:
             Database.init(**self.settings['init_params'])
 
+        self.result_cache = None
+        if result_cache_options is not None:
+            self.result_cache = get_result_cache(self.alias, **result_cache_options)
+        # Tables changed by the current transaction (see firebird.resultcache).
+        self.changed_tables = set()
+
+        self.in_list_threshold = None
+        if in_list_table is True:
+            self.in_list_threshold = MAX_IN_LIST_SIZE
+        elif in_list_table:
+            self.in_list_threshold = int(in_list_table)
+        self.in_list_table_exists = None
+        self.in_list_counter = 0
+        # IN list filters of the statement being compiled, see firebird.compiler.
+        self.compiled_in_lists = None
+
+        self.default_tpb = None
+        self.tpb_override = None
+        if transaction_options is not None:
+            self.default_tpb = build_tpb(transaction_options).render()
+
+        self.pool = None
+        self.pooled = None
+        self.instrumentation = None
+        if instrumentation_options is not None:
+            self.instrumentation = get_instrumentation(self.alias, **instrumentation_options)
+        if self.pool_options is not None:
+            self.pool = get_pool(Database.connect, self.settings, self.connection_setup(), **self.pool_options)
+
+        self.monitor = None
+        self.attachment = None
+
         self.server_version = None
         self.features = DatabaseFeatures(self)
         self.ops = DatabaseOperations(self, dialect=self.dialect)
@@ -325,46 +697,225 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         self.validation = BaseDatabaseValidation(self)
 
     def _cursor(self):
-        new_connection = False
-        
         if self.connection is None:
-            new_connection = True
+            self._connect()
+        return CursorWrapper(self.connection.cursor(), self)
+
+    def _connect(self):
+        if self.settings_dict['NAME'] != self.settings.get('database', ''):
+            # NAME was changed after init, e.g. by the test runner.
+            self.use_database(self.settings_dict['NAME'])
+        if self.pool is not None:
+            self.pooled = self.pool.checkout()
+            self.connection = self.pooled.connection
+            state = self.pooled.state
+        else:
             self.connection = Database.connect(**self.settings)
-            connection_created.send(sender=self.__class__)
-             
-        cursor = self.connection.cursor()
-        
-        if new_connection:
-            if self.connection.charset == 'UTF8':
-                self.ops.FB_CHARSET_CODE = 4 # UTF-8 with Firebird 2.0+
-
-            self.connection.set_type_trans_in({
-                'DATE':             self.ops.conv_in_date,
-                'TIME':             self.ops.conv_in_time,
-                'TIMESTAMP':        self.ops.conv_in_timestamp,
-                'FIXED':            self.ops.conv_in_fixed,
-                'TEXT':             self.ops.conv_in_ascii,
-                'TEXT_UNICODE':     self.ops.conv_in_unicode,
-                'BLOB':             self.ops.conv_in_blob
-            })
-            self.connection.set_type_trans_out({
-                'DATE':             typeconv_datetime.date_conv_out,
-                'TIME':             typeconv_datetime.time_conv_out,
-                'TIMESTAMP':        typeconv_datetime.timestamp_conv_out,
-                'FIXED':            typeconv_fixeddecimal.fixed_conv_out_precise,
-                'TEXT':             self.ops.conv_out_ascii,
-                'TEXT_UNICODE':     typeconv_textunicode.unicode_conv_out,
-                'BLOB':             self.ops.conv_out_blob
-            })
-            
-            version = re.search(r'\s(\d{1,2})\.(\d{1,2})', self.connection.server_version)
-            self.server_version = tuple([int(x) for x in version.groups()])
-            
-            # feature for Firebird version 2 and above
-            if self.server_version[0] >=2:
-                self.features.can_return_id_from_insert = True
-        
-        return CursorWrapper(cursor)
+            state = {}
+        connection_created.send(sender=self.__class__)
+
+        if not state:
+            self._init_connection(state)
+
+        self.server_version = state['server_version']
+        self.statement_cache = state.get('statement_cache')
+        self.in_list_table_exists = None
+        self.attachment = None
+        # Used by kinterbasdb for transactions it starts implicitly, a block
+        # of firebird.transaction.transaction_options() may have changed it.
+        self.connection.default_tpb = state['default_tpb']
+
+        if self.connection.charset == 'UTF8':
+            self.ops.FB_CHARSET_CODE = 4 # UTF-8 with Firebird 2.0+
+
+        # feature for Firebird version 2 and above
+        if self.server_version[0] >=2:
+            self.features.can_return_id_from_insert = True
+
+    def connection_setup(self):
+        """
+        Returns options a physical connection is set up with by _connect()
+        and _init_connection(). Pooled connections are kept set up between
+        checkouts, so databases differing in these get separate pools.
+        """
+        return (
+            ('row_converters', bool(self.row_converters)),
+            ('blob_stream', bool(self.blob_stream)),
+            ('statement_cache_size', self.statement_cache_size),
+            ('default_tpb', self.default_tpb),
+        )
+
+    def _init_connection(self, state):
+        """
+        Sets up a newly opened physical connection and stores the results
+        in `state`. Pooled connections keep their state between checkouts,
+        so this is done only once per physical connection.
+        """
+        self._set_type_translators(self.connection)
+
+        version = re.search(r'\s(\d{1,2})\.(\d{1,2})', self.connection.server_version)
+        state['server_version'] = tuple([int(x) for x in version.groups()])
+
+        if self.statement_cache_size:
+            state['statement_cache'] = StatementCache(self.connection, self.statement_cache_size)
+
+        state['default_tpb'] = self.default_tpb
+        if self.default_tpb is None:
+            state['default_tpb'] = self.connection.default_tpb
+
+    def _set_type_translators(self, connection, plain=False):
+        """
+        Registers type translators of the backend on kinterbasdb `connection`.
+        `plain` connections return whole values, without row converters or
+        BLOB streams.
+        """
+        connection.set_type_trans_in({
+            'DATE':             self.ops.conv_in_date,
+            'TIME':             self.ops.conv_in_time,
+            'TIMESTAMP':        self.ops.conv_in_timestamp,
+            'FIXED':            self.ops.conv_in_fixed,
+            'TEXT':             self.ops.conv_in_ascii,
+            'TEXT_UNICODE':     self.ops.conv_in_unicode,
+            'BLOB':             self.ops.conv_in_blob
+        })
+        trans_out = {
+            'DATE':             typeconv_datetime.date_conv_out,
+            'TIME':             typeconv_datetime.time_conv_out,
+            'TIMESTAMP':        typeconv_datetime.timestamp_conv_out,
+            'FIXED':            typeconv_fixeddecimal.fixed_conv_out_precise,
+            'TEXT':             self.ops.conv_out_ascii,
+            'TEXT_UNICODE':     typeconv_textunicode.unicode_conv_out,
+            'BLOB':             self.ops.conv_out_blob
+        }
+        if self.row_converters and not plain:
+            # No translator means naked values, they are converted
+            # per row by CursorWrapper (see firebird.converters).
+            for type_name in ROW_CONVERTED_TYPES:
+                trans_out[type_name] = None
+        if self.blob_stream and not plain:
+            # Readers of TextField values are wrapped into BlobStreams by
+            # compilers (see SQLCompiler.resolve_text_blobs()).
+            trans_out['BLOB'] = {'mode': 'stream'}
+        connection.set_type_trans_out(trans_out)
+
+    def _commit(self):
+        try:
+            return super(DatabaseWrapper, self)._commit()
+        finally:
+            transaction_ended(self)
+
+    def _rollback(self):
+        try:
+            return super(DatabaseWrapper, self)._rollback()
+        finally:
+            transaction_ended(self)
+
+    def close(self):
+        self.introspection.invalidate_catalog()
+        transaction_ended(self)
+        self.tpb_override = None
+        if self.pooled is not None:
+            # Pooled connections are returned (rolled back) instead of being closed.
+            pooled, self.pooled = self.pooled, None
+            self.connection = None
+            self.statement_cache = None
+            self.pool.checkin(pooled)
+            return
+        if self.statement_cache is not None:
+            self.statement_cache.clear()
+            self.statement_cache = None
+        super(DatabaseWrapper, self).close()
+
+    def use_database(self, name):
+        """
+        Makes the wrapper connect to database `name` (file path or alias)
+        from now on. The current connection is closed.
+        """
+        self.close()
+        self.close_monitor()
+        self.settings_dict['NAME'] = name
+        # A new dictionary, the pool of the previous database keeps its own.
+        self.settings = dict(self.settings, database=name)
+        if self.pool_options is not None:
+            self.pool = get_pool(Database.connect, self.settings, self.connection_setup(), **self.pool_options)
+
+    def bulk_insert(self, table, columns, types, rows, pk_column=None, pk_type='integer', batch_size=None):
+        """
+        Inserts `rows` into `table` packing them into EXECUTE BLOCK statements.
+        See firebird.bulk.bulk_insert().
+        """
+        from firebird.bulk import bulk_insert
+        return bulk_insert(self, table, columns, types, rows, pk_column=pk_column,
+                           pk_type=pk_type, batch_size=batch_size)
+
+    def allocate_keys(self, table, count=1):
+        """
+        Returns a list of `count` new primary keys for `table` reserved from
+        its generator in blocks of 'key_block_size' keys (see firebird.keys).
+        """
+        return allocator.allocate(self, table, count, self.key_block_size)
+
+    def query_stats(self, order_by='total_time'):
+        """
+        Returns statistics aggregated per normalized SQL, see
+        firebird.instrumentation.Instrumentation.get_stats().
+        """
+        if self.instrumentation is None:
+            return []
+        return self.instrumentation.get_stats(order_by)
+
+    def result_cache_stats(self):
+        """
+        Returns result cache counters, see
+        firebird.resultcache.ResultCache.stats().
+        """
+        if self.result_cache is None:
+            return {}
+        return self.result_cache.stats()
+
+    def get_monitor(self):
+        "Returns firebird.monitoring.Monitor with a separate connection."
+        if self.monitor is None:
+            self.monitor = Monitor(self._connect_monitor)
+        return self.monitor
+
+    def _connect_monitor(self):
+        "Opens the connection of the monitor, values are converted as usual."
+        connection = Database.connect(**self.settings)
+        self._set_type_translators(connection, plain=True)
+        return connection
+
+    def monitoring_snapshot(self):
+        """
+        Returns firebird.monitoring.Snapshot of monitoring tables, read
+        through a separate connection (Firebird 2.1+).
+        """
+        return self.get_monitor().snapshot()
+
+    def cancel_statements(self, attachment_id):
+        "Cancels statements running on server attachment `attachment_id` (Firebird 2.5+)."
+        self.get_monitor().cancel_statements(attachment_id)
+
+    def executor(self, workers=4, read_only=True):
+        """
+        Returns firebird.executor.QueryExecutor running tasks concurrently
+        on `workers` connections to this database.
+        """
+        from firebird.executor import QueryExecutor
+        return QueryExecutor(self.alias, workers, read_only)
+
+    def close_monitor(self):
+        if self.monitor is not None:
+            self.monitor.close()
+            self.monitor = None
+
+    def attachment_id(self):
+        "Returns server id of the current connection (MON$ATTACHMENT_ID)."
+        if self.attachment is None:
+            cursor = self.cursor()
+            cursor.execute('SELECT CURRENT_CONNECTION FROM rdb$database')
+            self.attachment = cursor.fetchone()[0]
+        return self.attachment
 
     def get_server_version(self):           
-        return self.server_version
\ No newline at end of file
+        return self.server_version
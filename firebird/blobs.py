@@ -0,0 +1,136 @@
+"""
+Streamed BLOB access.
+
+By default kinterbasdb reads every BLOB of a fetched row into memory and
+the backend converts it to unicode, even if the value is never used. When
+'blob_stream' option is on, kinterbasdb returns BlobReader objects instead
+(no BLOB data is read at fetch time) and TextField values become BlobStream
+objects: file-like readers decoding text in chunks, which also turn into
+the whole text when used as a string. Raw cursors return the readers of
+text and binary BLOBs alike, as the BLOB sub type isn't known there.
+
+BLOB content can be read only while the transaction which fetched the row
+is active.
+
+Large values are written without building them in memory with write_blob(),
+kinterbasdb reads BLOB parameters given as file-like objects chunk by chunk.
+"""
+
+import codecs
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from firebird.resultcache import table_changed
+
+BLOB_CHUNK_SIZE = 65536
+
+
+def blob_encoding(connection):
+    "Returns Python codec of text BLOBs read through `connection`."
+    from firebird.external import CHARSET_CODECS
+    return CHARSET_CODECS.get(connection.settings.get('charset', '').upper(), 'utf-8')
+
+
+class BlobStream(object):
+    """
+    File-like reader of a text BLOB. read() and chunks() return unicode
+    decoded from the connection charset (UNICODE_FSS and UTF8 are both
+    UTF-8), invalid data raises UnicodeDecodeError. unicode() returns the
+    whole text (the rest of it after read() calls), which is kept then.
+    """
+
+    def __init__(self, reader, encoding='utf-8'):
+        self.reader = reader
+        self.encoding = encoding
+        self.decoder = codecs.getincrementaldecoder(encoding)('strict')
+        self.value = None
+        self.position = 0
+
+    def read(self, size=-1):
+        "Reads up to `size` bytes of BLOB (all if negative) and returns them decoded."
+        if self.value is not None:
+            if size < 0:
+                text = self.value[self.position:]
+            else:
+                text = self.value[self.position:self.position + size]
+            self.position += len(text)
+            return text
+        while True:
+            data = self.reader.read(size)
+            text = self.decoder.decode(data, final=size < 0 or not data)
+            # A chunk may end within a multibyte character.
+            if text or not data:
+                return text
+
+    def chunks(self, chunk_size=BLOB_CHUNK_SIZE):
+        while True:
+            text = self.read(chunk_size)
+            if not text:
+                break
+            yield text
+
+    def __iter__(self):
+        return self.chunks()
+
+    def close(self):
+        self.reader.close()
+
+    def __unicode__(self):
+        if self.value is None:
+            self.value = u''.join(self.chunks())
+            self.position = len(self.value)
+            self.close()
+        return self.value
+
+    def __str__(self):
+        return unicode(self).encode(self.encoding)
+
+    def __len__(self):
+        return len(unicode(self))
+
+    def __eq__(self, other):
+        if isinstance(other, basestring):
+            return unicode(self) == other
+        return self is other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<BlobStream %s>' % (self.value is None and 'unread' or 'read')
+
+
+def write_blob(model, pk, field_name, fileobj, using=None):
+    """
+    Sets `field_name` BLOB of `model` row with primary key `pk` to content
+    read from `fileobj` (bytes in the connection charset) chunk by chunk.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    cursor = connection.cursor()
+    table_changed(connection, opts.db_table)
+    cursor.execute('UPDATE %s SET %s = %%s WHERE %s = %%s' % (
+        qn(opts.db_table), qn(opts.get_field(field_name).column), qn(opts.pk.column)),
+        [fileobj, pk])
+    transaction.commit_unless_managed(using=using)
+
+
+def open_blob(model, pk, field_name, using=None):
+    """
+    Returns BlobStream reading `field_name` BLOB of `model` row with primary
+    key `pk`, None if the row or value is missing. Requires 'blob_stream'.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    cursor = connection.cursor()
+    cursor.execute('SELECT %s FROM %s WHERE %s = %%s' % (
+        qn(opts.get_field(field_name).column), qn(opts.db_table), qn(opts.pk.column)),
+        [pk])
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return BlobStream(row[0], blob_encoding(connection))
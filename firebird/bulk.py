@@ -0,0 +1,198 @@
+"""
+Bulk insertion helpers.
+
+Rows are packed into EXECUTE BLOCK statements (Firebird 2.0+), so that
+a single round trip inserts many rows. Blocks are kept within Firebird
+limits for statement text and input message length.
+"""
+
+import re
+import itertools
+
+from django.db import connections, router
+from django.db.models import AutoField
+
+from firebird.resultcache import table_changed
+
+# Firebird limits both statement text and input message to 64KB.
+MAX_STATEMENT_LENGTH = 65535
+MAX_MESSAGE_LENGTH = 65535
+
+BYTES_PER_CHAR = {
+    'UTF8': 4,
+    'UNICODE_FSS': 3,
+    'GB18030': 4,
+    'SJIS_0208': 2,
+    'EUCJ_0208': 2,
+    'BIG_5': 2,
+    'GB_2312': 2,
+    'KSC_5601': 2,
+    'GBK': 2,
+    'CP943C': 2,
+}
+
+# Parameter data lengths in bytes, the order matters (prefix match).
+TYPE_LENGTHS = (
+    ('smallint', 2),
+    ('integer', 4),
+    ('bigint', 8),
+    ('float', 4),
+    ('double', 8),
+    ('numeric', 8),
+    ('decimal', 8),
+    ('date', 4),
+    ('timestamp', 8),
+    ('time', 4),
+    ('blob', 8),
+)
+
+char_re = re.compile(r'(?:var)?char\((\d+)\)')
+
+
+def param_length(db_type, bytes_per_char=1):
+    "Returns approximate length of a parameter of given type in the input message."
+    db_type = db_type.lower()
+    # Each parameter is accompanied by a NULL indicator.
+    length = 2
+    match = char_re.match(db_type)
+    if match:
+        # Two more bytes for VARCHAR length prefix.
+        return length + int(match.group(1)) * bytes_per_char + 2
+    for prefix, size in TYPE_LENGTHS:
+        if db_type.startswith(prefix):
+            return length + size
+    return length + 8
+
+
+def clean_db_type(db_type):
+    "Strips column constraints (e.g. CHECK) from a column type definition."
+    return db_type.split('%')[0].split('CHECK')[0].strip()
+
+
+def get_batch_size(connection, table, columns, types, pk_column=None, pk_type='integer'):
+    "Returns the number of rows which fit into a single EXECUTE BLOCK."
+    row_sql = connection.ops.execute_block_insert_sql(table, columns, types, 1, pk_column, pk_type)
+    # Parameter names grow with their numbers, reserve some room for that.
+    row_length = len(row_sql) + 10 * len(columns)
+    bytes_per_char = BYTES_PER_CHAR.get(connection.settings.get('charset', '').upper(), 1)
+    row_message = sum([param_length(db_type, bytes_per_char) for db_type in types])
+    return max(1, min(MAX_STATEMENT_LENGTH // row_length, MAX_MESSAGE_LENGTH // max(row_message, 1)))
+
+
+def execute_block_statements(connection, table, columns, types, rows, pk_column=None, pk_type='integer', batch_size=None):
+    """
+    Yields (sql, params) EXECUTE BLOCK statements inserting `rows` (an iterable
+    of sequences of column values) into `table` in chunks.
+
+    `types` are Firebird column types for `columns`, used to declare
+    block parameters. `batch_size` caps the number of rows per statement.
+    """
+    limit = get_batch_size(connection, table, columns, types, pk_column, pk_type)
+    if batch_size:
+        limit = min(limit, batch_size)
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, limit))
+        if not chunk:
+            break
+        params = []
+        for row in chunk:
+            params.extend(row)
+        sql = connection.ops.execute_block_insert_sql(table, columns, types, len(chunk), pk_column, pk_type)
+        yield sql, tuple(params)
+
+
+def bulk_insert(connection, table, columns, types, rows, pk_column=None, pk_type='integer', batch_size=None):
+    """
+    Inserts `rows` into `table` with EXECUTE BLOCK statements
+    (see execute_block_statements()).
+
+    Returns the list of generated `pk_column` values if it is given.
+    """
+    cursor = connection.cursor()
+    ops = connection.ops
+    ids = []
+    table_changed(connection, table)
+
+    if connection.get_server_version()[0] < 2:
+        # No EXECUTE BLOCK before Firebird 2.0.
+        qn = ops.quote_name
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(table), ', '.join([qn(c) for c in columns]),
+                                                   ', '.join(['%s'] * len(columns)))
+        for row in rows:
+            cursor.execute(sql, row)
+            if pk_column:
+                ids.append(ops.last_insert_id(cursor, table, pk_column))
+        return ids
+
+    for sql, params in execute_block_statements(connection, table, columns, types, rows,
+                                                pk_column, pk_type, batch_size):
+        cursor.execute(sql, params)
+        if pk_column:
+            ids.extend([r[0] for r in cursor.fetchall()])
+    return ids
+
+
+def assign_keys(objs, using=None):
+    """
+    Sets primary keys of model instances `objs` lacking one, with keys
+    reserved from the model generator in blocks (see firebird.keys).
+    Allows building related instances before anything is inserted.
+    """
+    objs = [obj for obj in objs if obj.pk is None]
+    if not objs:
+        return
+    model = objs[0].__class__
+    if using is None:
+        using = router.db_for_write(model, instance=objs[0])
+    keys = connections[using].allocate_keys(model._meta.db_table, len(objs))
+    for obj, key in zip(objs, keys):
+        obj.pk = key
+
+
+def bulk_create(objs, using=None, batch_size=None, assign_pks=None):
+    """
+    Inserts model instances `objs` (all of the same model) with
+    EXECUTE BLOCK statements and sets their primary keys.
+
+    Unlike QuerySet.bulk_create() (which also uses EXECUTE BLOCK, see
+    SQLInsertCompiler) generated keys are set on the instances. If `assign_pks`
+    is True, keys are assigned client-side with assign_keys() before inserting,
+    otherwise generated keys are fetched back. It defaults to True
+    if 'key_block_size' is set in database OPTIONS.
+
+    Models with multi-table inheritance are not supported.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    model = objs[0].__class__
+    opts = model._meta
+    if opts.parents:
+        raise ValueError("Can't bulk create instances of inherited model %s." % model.__name__)
+
+    if using is None:
+        using = router.db_for_write(model, instance=objs[0])
+    connection = connections[using]
+
+    if assign_pks is None:
+        assign_pks = bool(connection.key_block_size)
+    if assign_pks and isinstance(opts.pk, AutoField):
+        assign_keys(objs, using)
+
+    # Keys are generated for all instances if any of them lacks one.
+    return_ids = isinstance(opts.pk, AutoField) and None in [obj.pk for obj in objs]
+    fields = [f for f in opts.local_fields if not (return_ids and f is opts.pk)]
+    columns = [f.column for f in fields]
+    types = [clean_db_type(f.db_type(connection=connection)) for f in fields]
+    rows = [[f.get_db_prep_save(f.pre_save(obj, True), connection=connection) for f in fields] for obj in objs]
+
+    pk_column = None
+    if return_ids:
+        pk_column = opts.pk.column
+    ids = bulk_insert(connection, opts.db_table, columns, types, rows, pk_column=pk_column, batch_size=batch_size)
+    if return_ids:
+        for obj, pk in zip(objs, ids):
+            obj.pk = pk
+    return objs
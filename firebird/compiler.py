@@ -1,8 +1,158 @@
 from django.db.models.sql import compiler
+from django.db.models.sql.constants import MULTI
+
+from firebird.blobs import BlobStream, blob_encoding
+from firebird.bulk import clean_db_type, execute_block_statements
+from firebird.where import rewrite_where
+from firebird.inlist import replace_in_lists, load_in_lists
+from firebird.resultcache import table_changed
 
 
 class SQLCompiler(compiler.SQLCompiler):
+    # Trigram index matches joined in FROM clause, see firebird.fulltext.
+    trigram_joins = None
+    # (where, rewritten where, trigram joins, IN list filters) of the last
+    # where with large IN lists rewritten, see firebird.inlist.
+    in_lists_where = None
+    # IN list filters of the statement compiled last, subqueries included.
+    statement_in_lists = ()
+    # Tells if the statement is compiled to be executed right away.
+    executing = False
+    # (fields, indexes of their TextField columns), see resolve_text_blobs().
+    text_blob_columns = None
+
+    def __init__(self, query, connection, using):
+        super(SQLCompiler, self).__init__(query, connection, using)
+        if connection.blob_stream:
+            # Django passes rows through resolve_columns() only if there is one.
+            self.resolve_columns = self.resolve_text_blobs
+
+    def resolve_text_blobs(self, row, fields):
+        """
+        Wraps BLOB readers of TextField columns into BlobStreams ('blob_stream'
+        option, see firebird.blobs). Readers of other BLOBs are left as they are.
+        """
+        if self.text_blob_columns is None or self.text_blob_columns[0] is not fields:
+            self.text_blob_columns = (fields, self.get_text_blob_columns(fields))
+        values = None
+        for index in self.text_blob_columns[1]:
+            if index >= len(row):
+                break
+            value = row[index]
+            if hasattr(value, 'read'):
+                if values is None:
+                    values = list(row)
+                values[index] = BlobStream(value, blob_encoding(self.connection))
+        if values is None:
+            return row
+        return tuple(values)
+
+    def get_text_blob_columns(self, fields):
+        "Returns indexes of TextField columns in rows of `fields` values."
+        if not self.query.select_fields:
+            # Django passes fields of the model only, columns of models
+            # selected with select_related() follow them.
+            fields = list(fields) + self.query.related_select_fields
+        offset = len(self.query.extra_select)
+        return [offset + index for index, field in enumerate(fields)
+                if field is not None and field.get_internal_type() == 'TextField']
+
+    def execute_sql(self, result_type=MULTI):
+        """
+        Read multiple rows in chunks of 'fetch_chunk_size' (if set)
+        instead of Django's fixed GET_ITERATOR_CHUNK_SIZE.
+        """
+        executing = self.executing
+        self.executing = True
+        try:
+            chunk_size = self.connection.fetch_chunk_size
+            if result_type != MULTI or not chunk_size or self.query.ordering_aliases:
+                return super(SQLCompiler, self).execute_sql(result_type)
+            cursor = super(SQLCompiler, self).execute_sql(None)
+        finally:
+            self.executing = executing
+        if cursor is None:
+            # Empty result set, no query was run.
+            return compiler.empty_iter()
+        return cursor.stream_chunks(chunk_size)
+
+    def with_rewritten_where(self, func, *args, **kwargs):
+        """
+        Calls `func` with query's where temporarily replaced by its
+        rewritten copy (see firebird.where). `joins` keyword argument
+        (default False) tells if trigram index matches may be joined in
+        FROM clause.
+
+        Large IN lists are replaced by filters on a temporary table (see
+        firebird.inlist) in statements compiled to be executed and in their
+        subqueries. Their values are loaded once the statement is compiled.
+        Statements compiled otherwise (e.g. str(queryset.query)) keep the
+        IN lists, nobody would load the values for them.
+        """
+        joins = kwargs.pop('joins', False)
+        where = self.query.where
+        outer_in_lists = self.connection.compiled_in_lists
+        if self.executing or outer_in_lists is not None:
+            where, rewritten, trigram_joins, in_lists = self.get_in_lists_where(joins)
+        else:
+            trigram_joins = joins and [] or None
+            rewritten = rewrite_where(where, self.connection, trigram_joins)
+            in_lists = None
+        self.query.where = rewritten
+        self.trigram_joins = trigram_joins
+        if in_lists is not None:
+            # Subqueries compiled by `func` add their filters to the list.
+            self.connection.compiled_in_lists = list(in_lists)
+        try:
+            result = func(*args, **kwargs)
+            if in_lists is not None:
+                self.statement_in_lists = self.connection.compiled_in_lists
+        finally:
+            self.query.where = where
+            self.trigram_joins = None
+            self.connection.compiled_in_lists = outer_in_lists
+        if self.executing:
+            self.load_in_lists()
+        elif outer_in_lists is not None:
+            outer_in_lists.extend(self.statement_in_lists)
+        return result
+
+    def get_in_lists_where(self, joins=False):
+        """
+        Returns (where, rewritten where, trigram joins, IN list filters)
+        for the query's where with large IN lists replaced by filters on
+        the IN list table. The rewrite is kept, so that compiling the
+        statement again reuses the same list ids.
+        """
+        where = self.query.where
+        if self.in_lists_where is None or self.in_lists_where[0] is not where:
+            trigram_joins = joins and [] or None
+            rewritten = rewrite_where(where, self.connection, trigram_joins)
+            rewritten, in_lists = replace_in_lists(rewritten, self.connection)
+            self.in_lists_where = (where, rewritten, trigram_joins, in_lists)
+        return self.in_lists_where
+
+    def load_in_lists(self):
+        "Loads values of large IN lists of the statement compiled last into the IN list table."
+        in_lists = [in_list for in_list in self.statement_in_lists if not in_list.loaded]
+        if in_lists:
+            load_in_lists(self.connection, in_lists)
+
     def as_sql(self, with_limits=True, with_col_aliases=False):
+        return self.with_rewritten_where(self.as_select_sql, with_limits, with_col_aliases, joins=True)
+
+    def get_from_clause(self):
+        result, params = super(SQLCompiler, self).get_from_clause()
+        if self.trigram_joins:
+            params = list(params)
+            qn = self.quote_name_unless_alias
+            for index, match in enumerate(self.trigram_joins):
+                sql, join_params = match.join_sql(qn, self.connection, 'FT%d' % index)
+                result.append(sql)
+                params.extend(join_params)
+        return result, params
+
+    def as_select_sql(self, with_limits=True, with_col_aliases=False):
         """
         Return custom SQL. Use FIRST and SKIP statement instead of
         LIMIT and OFFSET.
@@ -24,19 +174,90 @@ class SQLCompiler(compiler.SQLCompiler):
                     if val:
                         result.append('FIRST %d' % val)
                 result.append('SKIP %d' % self.query.low_mark)
-            sql = sql.replace("SELECT", ' '.join(result))
+            # Only the outermost SELECT (the statement starts with it), not
+            # those of subqueries, derived tables or string literals.
+            sql = ' '.join(result) + sql[len('SELECT'):]
 
         return sql, params
 
 
 class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
-    pass
+    def execute_sql(self, return_id=False):
+        table_changed(self.connection, self.query.model._meta.db_table)
+        return super(SQLInsertCompiler, self).execute_sql(return_id)
+
+    def as_sql(self):
+        """
+        Return INSERT statements.
+
+        For Firebird 2+ a single row insert gets RETURNING clause, so that
+        the new primary key is fetched in the same round trip, and multiple
+        rows are packed into EXECUTE BLOCK statements.
+        """
+        if self.return_id and self.connection.features.can_return_id_from_insert:
+            return self.as_returning_sql()
+        if self.can_use_execute_block():
+            return self.as_execute_block_sql()
+        return super(SQLInsertCompiler, self).as_sql()
+
+    def as_returning_sql(self):
+        # Firebird doesn't accept table prefixed column in RETURNING
+        # clause, so it is not left to Django.
+        self.return_id = False
+        try:
+            sql, params = super(SQLInsertCompiler, self).as_sql()[0]
+        finally:
+            self.return_id = True
+        qn = self.connection.ops.quote_name
+        r_fmt, r_params = self.connection.ops.return_insert_id()
+        sql = '%s %s' % (sql, r_fmt % qn(self.query.model._meta.pk.column))
+        return [(sql, tuple(params) + tuple(r_params))]
+
+    def can_use_execute_block(self):
+        fields = self.query.fields
+        version = self.connection.get_server_version()
+        return (len(self.query.objs) > 1 and fields and not self.return_id
+                and version is not None and version[0] >= 2
+                and not [f for f in fields if hasattr(f, 'get_placeholder')])
+
+    def as_execute_block_sql(self):
+        fields = self.query.fields
+        columns = [f.column for f in fields]
+        types = [clean_db_type(f.db_type(connection=self.connection)) for f in fields]
+        rows = [
+            [
+                f.get_db_prep_save(getattr(obj, f.attname) if self.query.raw else f.pre_save(obj, True), connection=self.connection)
+                for f in fields
+            ]
+            for obj in self.query.objs
+        ]
+        return list(execute_block_statements(self.connection, self.query.model._meta.db_table, columns, types, rows))
 
 class SQLDeleteCompiler(compiler.SQLDeleteCompiler, SQLCompiler):
-    pass
+    def as_sql(self):
+        return self.with_rewritten_where(super(SQLDeleteCompiler, self).as_sql)
+
+    def execute_sql(self, result_type=MULTI):
+        table_changed(self.connection, self.query.model._meta.db_table)
+        return super(SQLDeleteCompiler, self).execute_sql(result_type)
 
 class SQLUpdateCompiler(compiler.SQLUpdateCompiler, SQLCompiler):
-    pass
+    setup_done = False
+
+    def as_sql(self):
+        # The setup may replace the where with a pk__in list of rows to
+        # update, which is to be rewritten too.
+        self.pre_sql_setup()
+        return self.with_rewritten_where(super(SQLUpdateCompiler, self).as_sql)
+
+    def execute_sql(self, result_type):
+        table_changed(self.connection, self.query.model._meta.db_table)
+        return super(SQLUpdateCompiler, self).execute_sql(result_type)
+
+    def pre_sql_setup(self):
+        if not self.setup_done:
+            super(SQLUpdateCompiler, self).pre_sql_setup()
+            self.setup_done = True
 
 class SQLAggregateCompiler(compiler.SQLAggregateCompiler, SQLCompiler):
     pass
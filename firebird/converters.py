@@ -0,0 +1,116 @@
+"""
+Per-statement row converters.
+
+kinterbasdb calls registered output type translators once for every value
+fetched, which for wide result sets takes most of the fetch time. When
+'row_converters' option is on, translators for ROW_CONVERTED_TYPES are not
+registered, kinterbasdb returns those values in their naked form, and
+a conversion function specialized for the statement is applied to whole
+rows instead. The function is built once per statement from
+cursor.description and the first fetched row; columns needing no conversion
+(integers, floats, dates converted by kinterbasdb) are passed as is.
+"""
+
+import base64
+
+import kinterbasdb as Database
+import kinterbasdb.typeconv_fixed_decimal as typeconv_fixeddecimal
+import kinterbasdb.typeconv_text_unicode as typeconv_textunicode
+
+# Types converted by row converters instead of kinterbasdb translators.
+ROW_CONVERTED_TYPES = ('FIXED', 'TEXT', 'TEXT_UNICODE', 'BLOB')
+
+
+def convert_text(value):
+    # Handle binary data from RDB$DB_KEY calls
+    if '\0' in value:
+        return 'base64' + base64.b64encode(value)
+    return value.decode('utf-8')
+
+
+convert_text_unicode = typeconv_textunicode.unicode_conv_out
+convert_fixed = typeconv_fixeddecimal.fixed_conv_out_precise
+
+
+def get_converter(value):
+    "Returns converter for a naked value, None if no conversion is needed."
+    if isinstance(value, str):
+        return convert_text
+    if isinstance(value, tuple) and len(value) == 2:
+        if isinstance(value[0], basestring):
+            # (text, charset code)
+            return convert_text_unicode
+        # (integer value, scale)
+        return convert_fixed
+    return None
+
+
+def convert_any(value):
+    "Converts a value of a column whose type is not known yet."
+    converter = get_converter(value)
+    if converter is None:
+        return value
+    return converter(value)
+
+
+def build_row_function(description, row):
+    """
+    Returns a function converting rows of the given shape or None if rows
+    need no conversion. Columns which are NULL in `row` are converted
+    checking each value.
+    """
+    namespace = {}
+    items = []
+    identity = True
+    for index in range(len(description)):
+        value = row[index]
+        if value is None:
+            converter = convert_any
+        else:
+            converter = get_converter(value)
+        if converter is None:
+            items.append('row[%d]' % index)
+            continue
+        identity = False
+        name = 'c%d' % index
+        namespace[name] = converter
+        items.append('(%(c)s(row[%(i)d]) if row[%(i)d] is not None else None)' % {'i': index, 'c': name})
+    if identity:
+        return None
+    source = 'def convert(row):\n    return (%s,)\n' % ', '.join(items)
+    exec source in namespace
+    return namespace['convert']
+
+
+class RowConverter(object):
+    """
+    Converts rows fetched by a statement, the conversion function is built
+    on first use.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        self.built = False
+        self.function = None
+
+    def build(self, row):
+        self.function = build_row_function(self.description, row)
+        self.built = True
+
+    def convert_row(self, row):
+        if row is None:
+            return row
+        if not self.built:
+            self.build(row)
+        if self.function is None:
+            return row
+        return self.function(row)
+
+    def convert_rows(self, rows):
+        if not rows:
+            return rows
+        if not self.built:
+            self.build(rows[0])
+        if self.function is None:
+            return rows
+        return map(self.function, rows)
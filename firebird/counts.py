@@ -0,0 +1,66 @@
+"""
+Approximate row counts.
+
+SELECT COUNT(*) reads every record version of the table, which takes
+seconds on large tables. Selectivity of a unique index, stored in
+RDB$INDICES.RDB$STATISTICS when the index is built or SET STATISTICS is
+run, is 1 / (number of rows) at that moment, so the number of rows of an
+unfiltered table can be told without reading it.
+
+Estimates are as fresh as statistics: refresh them with
+refresh_statistics() after large loads or deletes (e.g. nightly). Tables
+estimated to have fewer rows than the threshold are counted exactly, as
+counting them is cheap anyway.
+"""
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+# Tables smaller than this are counted exactly.
+APPROXIMATE_COUNT_THRESHOLD = 100000
+
+
+def _table_name(connection, table):
+    # Names are stored the way quote_name() makes them (upper case in dialect 1).
+    return connection.ops.quote_name(table).strip('"')
+
+
+def get_row_estimate(table, using=None):
+    "Returns the estimated number of rows in `table`, None without statistics."
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    return connection.introspection.get_row_estimate(connection.cursor(), _table_name(connection, table))
+
+
+def refresh_statistics(table, using=None):
+    "Recomputes selectivity of all indexes of `table` (SET STATISTICS)."
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    cursor = connection.cursor()
+    cursor.execute('SELECT RDB$INDEX_NAME FROM RDB$INDICES WHERE RDB$RELATION_NAME = %s',
+                   [_table_name(connection, table)])
+    for row in cursor.fetchall():
+        cursor.execute('SET STATISTICS INDEX %s' % connection.ops.quote_name(row[0].strip()))
+    transaction.commit_unless_managed(using=using)
+
+
+def is_unfiltered(queryset):
+    "Tells if `queryset` counts all rows of its model table."
+    query = queryset.query
+    return (not query.where and not query.having and not query.distinct
+            and not query.low_mark and query.high_mark is None
+            and len([alias for alias in query.tables if query.alias_refcount[alias]]) <= 1)
+
+
+def approximate_count(queryset, threshold=APPROXIMATE_COUNT_THRESHOLD):
+    """
+    Returns the number of rows of an unfiltered `queryset` estimated from
+    index statistics if it is at least `threshold`, the exact count otherwise.
+    """
+    if not is_unfiltered(queryset):
+        return queryset.count()
+    using = queryset.db
+    if connections[using].vendor != 'firebird':
+        return queryset.count()
+    estimate = get_row_estimate(queryset.model._meta.db_table, using)
+    if estimate is None or estimate < threshold:
+        return queryset.count()
+    return estimate
@@ -1,9 +1,37 @@
+import os
 import re
+import sys
+import shutil
+import hashlib
+
 from django.conf import settings
-from django.db.backends.creation import BaseDatabaseCreation
+from django.db.backends.creation import BaseDatabaseCreation, TEST_DATABASE_PREFIX
+from django.utils.encoding import smart_str
+
+try:
+    import kinterbasdb as Database
+except ImportError, e:
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured("Error loading KInterbasDB module: %s" % e)
+
+from firebird import fulltext, inlist
 
 precision_re = re.compile(r'\((\d{1,2}), (\d{1,2})\)')
 
+TEMPLATE_PREFIX = 'template_'
+
+# Length of schema hashes in template database names.
+SCHEMA_HASH_LENGTH = 12
+
+# Hosts whose database files can be copied by this process.
+LOCAL_HOSTS = ('', 'localhost', '127.0.0.1')
+
+# Application directories whose files affect the template database.
+TEMPLATE_SOURCE_DIRS = ('sql', 'fixtures', 'migrations')
+
+# Test databases created by copying a template in this process.
+cloned_databases = set()
+
 class DatabaseCreation(BaseDatabaseCreation):
 
     # This dictionary maps Field objects to their associated Firebird column
@@ -72,12 +100,205 @@ class DatabaseCreation(BaseDatabaseCreation):
                         line = line.replace('%', '')
                 output += line
             output_parts.append(output)
+
+        if fulltext.is_registered(model):
+            output_parts.extend(fulltext.sql_create(model, self.connection))
                  
         return output_parts, pending_references
+
+    def sql_destroy_model(self, model, references_to_delete, style):
+        output = super(DatabaseCreation, self).sql_destroy_model(model, references_to_delete, style)
+        if output and fulltext.is_registered(model):
+            output.extend(fulltext.sql_destroy(model, self.connection))
+        return output
     
+    def _get_test_db_name(self):
+        """
+        Returns TEST_NAME or NAME with 'test_' prefixed to the file name.
+        FIREBIRD_TEST_WORKER environment variable (if set) is appended, so
+        that parallel test processes get a database each.
+        """
+        name = self._get_shared_test_db_name()
+        worker = os.environ.get('FIREBIRD_TEST_WORKER')
+        if worker:
+            root, ext = os.path.splitext(name)
+            name = '%s_%s%s' % (root, worker, ext)
+        return name
+
+    def _get_shared_test_db_name(self):
+        settings_dict = self.connection.settings_dict
+        name = settings_dict['TEST_NAME']
+        if not name:
+            directory, filename = os.path.split(settings_dict['NAME'])
+            name = os.path.join(directory, TEST_DATABASE_PREFIX + filename)
+        return name
+
+    def can_clone(self):
+        """
+        Tells if test database can be created by copying a template database
+        file: the server must be local and the database name a file path
+        in an existing directory. TEST_TEMPLATE setting set to False turns
+        cloning off.
+        """
+        settings_dict = self.connection.settings_dict
+        if not settings_dict.get('TEST_TEMPLATE', True) or settings_dict['HOST'] not in LOCAL_HOSTS:
+            return False
+        directory = os.path.dirname(self._get_test_db_name())
+        return bool(directory) and os.path.isdir(directory)
+
+    def get_schema_hash(self):
+        """
+        Returns a hash of everything the template database is built from:
+        SQL creating tables and indexes of all models, and custom SQL,
+        fixtures and migrations files of installed applications.
+        """
+        from django.core.management.color import no_style
+        from django.db import models
+
+        style = no_style()
+        digest = hashlib.md5()
+        for model in models.get_models(include_auto_created=True):
+            sql, references = self.sql_create_model(model, style)
+            for statement in sql + self.sql_indexes_for_model(model, style):
+                digest.update(smart_str(statement))
+        if self.connection.in_list_threshold:
+            for statement in inlist.sql_create():
+                digest.update(statement)
+        for app in models.get_apps():
+            app_dir = os.path.dirname(app.__file__)
+            if os.path.basename(app_dir) == 'models':
+                app_dir = os.path.dirname(app_dir)
+            for name in TEMPLATE_SOURCE_DIRS:
+                for root, dirs, files in sorted(os.walk(os.path.join(app_dir, name))):
+                    for filename in sorted(files):
+                        if filename.endswith('.pyc'):
+                            continue
+                        path = os.path.join(root, filename)
+                        digest.update(path)
+                        digest.update(open(path, 'rb').read())
+        return digest.hexdigest()[:SCHEMA_HASH_LENGTH]
+
+    def get_template_name(self, schema_hash):
+        "Returns template database name, the same for all test workers."
+        directory, filename = os.path.split(self._get_shared_test_db_name())
+        root, ext = os.path.splitext(filename)
+        return os.path.join(directory, '%s%s_%s%s' % (TEMPLATE_PREFIX, root, schema_hash, ext))
+
+    def create_test_db(self, verbosity=1, autoclobber=False):
+        """
+        Creates test database by copying a template database file, building
+        the template first if there is none for the current schema hash.
+        Falls back to the default way if cloning is not possible.
+        """
+        if not self.can_clone():
+            return super(DatabaseCreation, self).create_test_db(verbosity, autoclobber)
+
+        test_database_name = self._get_test_db_name()
+        template_name = self.get_template_name(self.get_schema_hash())
+        if verbosity >= 1:
+            test_db_repr = ''
+            if verbosity >= 2:
+                test_db_repr = " ('%s' from '%s')" % (test_database_name, template_name)
+            print "Creating test database for alias '%s'%s..." % (
+                self.connection.alias, test_db_repr)
+
+        if not os.path.exists(template_name):
+            self.create_template_db(template_name, verbosity)
+
+        self.connection.close()
+        if os.path.exists(test_database_name):
+            if not autoclobber:
+                confirm = raw_input("Type 'yes' if you would like to try deleting the test "
+                                    "database '%s', or 'no' to cancel: " % test_database_name)
+            if autoclobber or confirm == 'yes':
+                os.remove(test_database_name)
+            else:
+                print "Tests cancelled."
+                sys.exit(1)
+        shutil.copy(template_name, test_database_name)
+        cloned_databases.add(test_database_name)
+
+        self.connection.use_database(test_database_name)
+        self.connection.features.confirm()
+        self.connection.cursor()
+        return test_database_name
+
+    def create_template_db(self, template_name, verbosity=1):
+        """
+        Builds template database: creates the file, runs syncdb and flush
+        (loading initial data) as Django does for test databases and creates
+        cache tables and the IN list table. Templates of other schema hashes are removed.
+        """
+        from django.core.management import call_command
+        from django.core.cache import get_cache
+        from django.core.cache.backends.db import BaseDatabaseCache
+
+        old_name = self.connection.settings_dict['NAME']
+        # Parallel workers may build the same template, the last rename wins.
+        building_name = '%s.%d.tmp' % (template_name, os.getpid())
+        if verbosity >= 1:
+            print "Building template database '%s'..." % template_name
+        self.create_database(building_name)
+        self.connection.use_database(building_name)
+        try:
+            call_command('syncdb', verbosity=max(verbosity - 1, 0), interactive=False,
+                         database=self.connection.alias, load_initial_data=False)
+            call_command('flush', verbosity=max(verbosity - 1, 0), interactive=False,
+                         database=self.connection.alias)
+            for cache_alias in settings.CACHES:
+                cache = get_cache(cache_alias)
+                if isinstance(cache, BaseDatabaseCache):
+                    call_command('createcachetable', cache._table, database=self.connection.alias)
+            if self.connection.in_list_threshold:
+                inlist.create_table(self.connection.alias)
+        finally:
+            self.disconnect()
+            self.connection.use_database(old_name)
+
+        for name in self.get_stale_templates(template_name):
+            os.remove(name)
+        os.rename(building_name, template_name)
+
+    def get_stale_templates(self, template_name):
+        "Returns paths of templates of this test database built for other schema hashes."
+        directory, filename = os.path.split(self._get_shared_test_db_name())
+        root, ext = os.path.splitext(filename)
+        template_re = re.compile('^%s[0-9a-f]{%d}%s$' % (
+            re.escape('%s%s_' % (TEMPLATE_PREFIX, root)), SCHEMA_HASH_LENGTH, re.escape(ext)))
+        return [os.path.join(directory, name) for name in os.listdir(directory or '.')
+                if template_re.match(name) and os.path.join(directory, name) != template_name]
+
+    def create_database(self, name):
+        "Creates an empty database file `name`."
+        settings_dict = self.connection.settings_dict
+        dsn = name
+        if settings_dict['HOST']:
+            dsn = '%s:%s' % (settings_dict['HOST'], name)
+        sql = "CREATE DATABASE '%s'" % dsn
+        if settings_dict['USER']:
+            sql += " USER '%s' PASSWORD '%s'" % (settings_dict['USER'], settings_dict['PASSWORD'])
+        sql += ' DEFAULT CHARACTER SET %s' % self.connection.settings['charset']
+        Database.create_database(sql, self.connection.dialect).close()
+
+    def disconnect(self):
+        "Closes the connection, idle pooled connections and monitoring one to the current database."
+        self.connection.close()
+        self.connection.close_monitor()
+        if self.connection.pool is not None:
+            self.connection.pool.close()
+
+    def destroy_test_db(self, old_database_name, verbosity=1):
+        # Pooled connections must not keep the file open.
+        self.disconnect()
+        super(DatabaseCreation, self).destroy_test_db(old_database_name, verbosity)
+        self.connection.use_database(old_database_name)
+
     def _create_test_db(self, verbosity, autoclobber):
-        test_database_name = self.connection.settings_dict['TEST_NAME']
+        test_database_name = self._get_test_db_name()
         return test_database_name
 
     def _destroy_test_db(self, test_database_name, verbosity):
-        pass
\ No newline at end of file
+        if test_database_name in cloned_databases:
+            cloned_databases.discard(test_database_name)
+            if os.path.exists(test_database_name):
+                os.remove(test_database_name)
\ No newline at end of file
@@ -0,0 +1,378 @@
+"""
+Running independent read queries concurrently.
+
+Django connections are per thread, so queries of a view run one after
+another. QueryExecutor runs callables (queryset evaluations, raw queries)
+in a few worker threads, each with its own connection; kinterbasdb
+releases the GIL while waiting for the server, so their queries overlap:
+
+    with connection.executor(workers=3) as executor:
+        futures = [
+            executor.submit(Order.objects.filter(status='new').count),
+            executor.submit(list, Order.objects.order_by('-total')[:10]),
+            executor.submit_sql('SELECT SUM(TOTAL) FROM SHOP_ORDER', timeout=5),
+        ]
+        new_count, top, [(total,)] = executor.gather(futures)
+
+Each task runs in its own read only read committed transaction (see
+firebird.transaction.read_only()), so it sees data committed by the time
+it starts, and the caller's uncommitted changes are not seen.
+
+Futures can be waited for with a timeout, cancelled and given callbacks
+called when they are done, e.g. to resolve an event loop's future. A
+running statement is interrupted on cancel() or when its task `timeout`
+expires by deleting it from MON$STATEMENTS (Firebird 2.5+), with older
+servers its result is dropped.
+"""
+
+from __future__ import with_statement
+
+import sys
+import time
+import Queue
+import threading
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from firebird.monitoring import Monitor
+from firebird.transaction import read_only
+
+PENDING = 'pending'
+RUNNING = 'running'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class CancelledError(Exception):
+    pass
+
+
+class Future(object):
+    """
+    Result of a task run by QueryExecutor. `timeout` (seconds, optional)
+    limits the time the task may run, the task is cancelled when it
+    expires whether it is waited for or not.
+    """
+
+    def __init__(self, executor, func, args, kwargs, timeout=None):
+        self.executor = executor
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.state = PENDING
+        self.started = None
+        self.timed_out = False
+        self._timer = None
+        # Server attachment the task runs on while its worker runs it, for
+        # interruption. Changed under the condition.
+        self.attachment = None
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._condition = threading.Condition()
+
+    def done(self):
+        return self.state in (FINISHED, CANCELLED)
+
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def running(self):
+        return self.state == RUNNING
+
+    def cancel(self, timed_out=False):
+        """
+        Cancels the task, interrupting its statement if it is running.
+        Returns False if it is done already.
+        """
+        self._condition.acquire()
+        try:
+            if self.done():
+                return False
+            was_running = self.state == RUNNING
+            self.state = CANCELLED
+            self.timed_out = timed_out
+            self._stop_timer()
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        if was_running:
+            self.executor.interrupt(self)
+        self._run_callbacks()
+        return True
+
+    def add_done_callback(self, callback):
+        "Calls `callback` with the future when it is done (right away if it is)."
+        self._condition.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._condition.release()
+        callback(self)
+
+    def result(self, timeout=None):
+        """
+        Returns the task result, waiting for at most `timeout` seconds
+        (TimeoutError then). Re-raises the task exception.
+        """
+        self.wait(timeout)
+        self._raise_cancelled()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        "Returns the task exception, None if it succeeded."
+        self.wait(timeout)
+        self._raise_cancelled()
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def wait(self, timeout=None):
+        """
+        Waits for the task to be done, raises TimeoutError after `timeout`
+        seconds.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._condition.acquire()
+        try:
+            while not self.done():
+                if deadline is None:
+                    # Waiting without a timeout can't be interrupted in Python 2.
+                    self._condition.wait(3600)
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError()
+                self._condition.wait(remaining)
+        finally:
+            self._condition.release()
+
+    def _raise_cancelled(self):
+        if self.state == CANCELLED:
+            if self.timed_out:
+                raise TimeoutError()
+            raise CancelledError()
+
+    def _expire(self):
+        "Cancels the task when its `timeout` expires."
+        self.cancel(timed_out=True)
+
+    def _stop_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def set_running(self):
+        "Marks the task as running, returns False if it was cancelled."
+        self._condition.acquire()
+        try:
+            if self.state != PENDING:
+                return False
+            self.state = RUNNING
+            self.started = time.time()
+            if self.timeout is not None:
+                self._timer = threading.Timer(self.timeout, self._expire)
+                self._timer.daemon = True
+                self._timer.start()
+            self._condition.notifyAll()
+            return True
+        finally:
+            self._condition.release()
+
+    def set_result(self, result, exc_info=None):
+        self._condition.acquire()
+        try:
+            if self.state != RUNNING:
+                # Cancelled meanwhile.
+                return
+            self._result = result
+            self._exc_info = exc_info
+            self.state = FINISHED
+            self._stop_timer()
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        self._condition.acquire()
+        try:
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._condition.release()
+        for callback in callbacks:
+            callback(self)
+
+
+def fetch_sql(sql, params=None, using=None):
+    "Executes `sql` and returns all rows."
+    cursor = connections[using or DEFAULT_DB_ALIAS].cursor()
+    cursor.execute(sql, params or ())
+    return cursor.fetchall()
+
+
+class QueryExecutor(object):
+    """
+    Runs tasks in `workers` threads with their own connections to `using`
+    database. Querysets evaluated by tasks must be routed to it too.
+    """
+
+    def __init__(self, using=None, workers=4, read_only=True):
+        self.using = using or DEFAULT_DB_ALIAS
+        self.workers = workers
+        self.read_only = read_only
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.closed = False
+        # Interrupts statements through a connection of its own, shared by
+        # all threads cancelling tasks (see interrupt()).
+        self.monitor = Monitor(connections[self.using]._connect_monitor)
+        self.monitor_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(cancel=exc_type is not None)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedules `func(*args, **kwargs)`, returns its Future. `timeout`
+        keyword argument limits the time it may run.
+        """
+        timeout = kwargs.pop('timeout', None)
+        if self.closed:
+            raise RuntimeError('Executor is shut down.')
+        future = Future(self, func, args, kwargs, timeout)
+        self._start_workers()
+        self.queue.put(future)
+        return future
+
+    def submit_sql(self, sql, params=None, timeout=None):
+        "Schedules a raw query, the future result is the list of its rows."
+        return self.submit(fetch_sql, sql, params, self.using, timeout=timeout)
+
+    def gather(self, futures, timeout=None):
+        """
+        Returns results of `futures` in their order. If a task fails or
+        `timeout` (for all of them) expires, the rest is cancelled and the
+        error raised.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        results = []
+        try:
+            for future in futures:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(deadline - time.time(), 0)
+                results.append(future.result(remaining))
+        except:
+            exc_info = sys.exc_info()
+            for future in futures:
+                future.cancel()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return results
+
+    def map(self, func, *iterables, **kwargs):
+        "Runs `func` for every set of arguments, returns results in order (see gather())."
+        timeout = kwargs.pop('timeout', None)
+        return self.gather([self.submit(func, *args) for args in zip(*iterables)], timeout)
+
+    def interrupt(self, future):
+        "Interrupts the statement of a running `future` task."
+        # The worker doesn't leave the task meanwhile, so that a statement
+        # of its next task is not interrupted instead.
+        with future._condition:
+            if future.attachment is None:
+                return
+            with self.monitor_lock:
+                try:
+                    self.monitor.cancel_statements(future.attachment)
+                except Exception:
+                    # Not supported by the server, the result is dropped anyway.
+                    self.monitor.close()
+
+    def shutdown(self, wait=True, cancel=False):
+        "Stops the workers once queued tasks are done (cancelled if `cancel`)."
+        self.lock.acquire()
+        try:
+            self.closed = True
+            threads = self.threads
+        finally:
+            self.lock.release()
+        if cancel:
+            while True:
+                try:
+                    future = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if future is not None:
+                    future.cancel()
+        for thread in threads:
+            self.queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+        with self.monitor_lock:
+            self.monitor.close()
+
+    def _start_workers(self):
+        "Starts a worker per submitted task until there are `workers` of them."
+        self.lock.acquire()
+        try:
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='firebird-executor-%d' % len(self.threads))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        finally:
+            self.lock.release()
+
+    def _work(self):
+        # Connections are per thread, this one is the worker's own.
+        connection = connections[self.using]
+        try:
+            while True:
+                future = self.queue.get()
+                if future is None:
+                    break
+                if future.set_running():
+                    self._run(connection, future)
+        finally:
+            connection.close()
+
+    def _run(self, connection, future):
+        try:
+            try:
+                attachment = connection.attachment_id()
+                with future._condition:
+                    future.attachment = attachment
+                if self.read_only:
+                    with read_only(self.using):
+                        result = future.func(*future.args, **future.kwargs)
+                else:
+                    try:
+                        result = future.func(*future.args, **future.kwargs)
+                    finally:
+                        connection._rollback()
+            finally:
+                with future._condition:
+                    future.attachment = None
+        except:
+            future.set_result(None, sys.exc_info())
+        else:
+            future.set_result(result)
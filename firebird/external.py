@@ -0,0 +1,379 @@
+"""
+Bulk loading through external tables.
+
+Even EXECUTE BLOCK inserts (see firebird.bulk) send every row through the
+client connection. For loads of millions of rows it is much faster to
+write them to a file and let the server read it as an external table:
+
+    from firebird.external import load
+
+    load(Item, rows, fields=['name', 'price'], deactivate_indexes=True)
+
+Rows are written in fixed-width text records, one CHAR CHARACTER SET NONE
+column per field with widths derived from column types, and a single
+INSERT ... SELECT casts them into the model table. Nullable fields get a
+NULL flag column, text fields a length column, so that spaces are kept.
+Text is encoded in the character set of its target column, as the bytes
+of CHARACTER SET NONE columns are taken as they are.
+Indexes not backing constraints can be deactivated during the load and
+rebuilt once afterwards.
+
+The file is written on the client, so it must be in a `directory` the
+server sees under the same path (the server host or a shared mount) and
+allowed by ExternalFileAccess setting of firebird.conf, e.g.:
+
+    ExternalFileAccess = Restrict /var/lib/firebird/load
+
+The load commits the current transaction, as DDL is involved.
+"""
+
+import os
+import re
+import datetime
+import decimal
+import tempfile
+
+from django.db import connections, router
+from django.db.backends import util
+from django.db.models import AutoField
+
+from firebird.bulk import BYTES_PER_CHAR, char_re, clean_db_type
+from firebird.resultcache import table_changed
+
+# Character widths of values of fixed size types, the order matters (prefix match).
+TYPE_WIDTHS = (
+    ('smallint', 6),
+    ('integer', 11),
+    ('bigint', 20),
+    ('float', 25),
+    ('double', 25),
+    ('date', 10),
+    ('timestamp', 24),
+    ('time', 13),
+)
+
+numeric_re = re.compile(r'(?:numeric|decimal)\((\d+)')
+
+NULL_FLAG = 'N'
+
+# Python codecs of Firebird character sets. Bytes of a CHARACTER SET NONE
+# column are taken as they are in the character set of the target column.
+CHARSET_CODECS = {
+    'ASCII': 'ascii',
+    'UTF8': 'utf-8',
+    'UNICODE_FSS': 'utf-8',
+    'ISO8859_1': 'latin-1',
+    'ISO8859_2': 'iso8859_2',
+    'ISO8859_3': 'iso8859_3',
+    'ISO8859_4': 'iso8859_4',
+    'ISO8859_5': 'iso8859_5',
+    'ISO8859_6': 'iso8859_6',
+    'ISO8859_7': 'iso8859_7',
+    'ISO8859_8': 'iso8859_8',
+    'ISO8859_9': 'iso8859_9',
+    'ISO8859_13': 'iso8859_13',
+    'WIN1250': 'cp1250',
+    'WIN1251': 'cp1251',
+    'WIN1252': 'cp1252',
+    'WIN1253': 'cp1253',
+    'WIN1254': 'cp1254',
+    'WIN1255': 'cp1255',
+    'WIN1256': 'cp1256',
+    'WIN1257': 'cp1257',
+    'WIN1258': 'cp1258',
+    'DOS437': 'cp437',
+    'DOS737': 'cp737',
+    'DOS775': 'cp775',
+    'DOS850': 'cp850',
+    'DOS852': 'cp852',
+    'DOS857': 'cp857',
+    'DOS858': 'cp858',
+    'DOS860': 'cp860',
+    'DOS861': 'cp861',
+    'DOS862': 'cp862',
+    'DOS863': 'cp863',
+    'DOS864': 'cp864',
+    'DOS865': 'cp865',
+    'DOS866': 'cp866',
+    'DOS869': 'cp869',
+    'KOI8R': 'koi8_r',
+    'KOI8U': 'koi8_u',
+    'TIS620': 'tis_620',
+    'SJIS_0208': 'shift_jis',
+    'EUCJ_0208': 'euc_jp',
+    'BIG_5': 'big5',
+    'GB_2312': 'gb2312',
+    'KSC_5601': 'euc_kr',
+    'GBK': 'gbk',
+    'CP943C': 'cp932',
+    'GB18030': 'gb18030',
+}
+
+# Character sets whose bytes are stored as they are.
+BINARY_CHARSETS = ('NONE', 'OCTETS')
+
+
+def column_width(db_type, bytes_per_char=1, text_length=None):
+    """
+    Returns the width in bytes of the external table column holding
+    values of `db_type`, None if it can't be loaded. Text BLOBs are
+    loaded if `text_length` (in characters) is given.
+    """
+    db_type = db_type.lower()
+    match = char_re.match(db_type)
+    if match:
+        return int(match.group(1)) * bytes_per_char
+    match = numeric_re.match(db_type)
+    if match:
+        # Sign and decimal point.
+        return int(match.group(1)) + 2
+    if db_type.startswith('blob'):
+        if text_length and 'sub_type 1' in db_type:
+            return text_length * bytes_per_char
+        return None
+    for prefix, width in TYPE_WIDTHS:
+        if db_type.startswith(prefix):
+            return width
+    return None
+
+
+def is_text(db_type):
+    db_type = db_type.lower()
+    return bool(char_re.match(db_type)) or db_type.startswith('blob')
+
+
+def format_value(value, codec='ascii'):
+    """
+    Returns `value` as a byte string the server can cast to the column type,
+    unicode is encoded with `codec` (None for byte strings only).
+    """
+    if isinstance(value, bool):
+        return value and '1' or '0'
+    if isinstance(value, datetime.datetime):
+        # Firebird timestamps keep 1/10000 of a second.
+        return '%s.%04d' % (value.strftime('%Y-%m-%d %H:%M:%S'), value.microsecond // 100)
+    if isinstance(value, datetime.time):
+        return '%s.%04d' % (value.strftime('%H:%M:%S'), value.microsecond // 100)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return format(value, 'f')
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, unicode):
+        if codec is None:
+            raise UnicodeError('unicode given for a column of a binary character set')
+        return value.encode(codec)
+    return str(value)
+
+
+class Layout(object):
+    """
+    Record layout of an external table for `columns` of `types` with
+    Firebird `charsets` (of text columns). Unicode values of NONE and
+    OCTETS columns are encoded with `binary_codec`, as the client would.
+    Each column is a (name, width) pair, the record ends with a new line.
+    """
+
+    def __init__(self, columns, types, nullable, charsets, text_length=None, binary_codec=None):
+        self.columns = columns
+        self.types = types
+        self.codecs = []
+        self.fields = []
+        for index, (column, db_type) in enumerate(zip(columns, types)):
+            codec = 'ascii'
+            bytes_per_char = 1
+            length_width = None
+            if is_text(db_type):
+                charset = charsets[index]
+                if charset in BINARY_CHARSETS:
+                    codec = binary_codec
+                elif charset in CHARSET_CODECS:
+                    codec = CHARSET_CODECS[charset]
+                else:
+                    raise ValueError("Character set %s of column %s isn't supported." % (charset, column))
+                bytes_per_char = BYTES_PER_CHAR.get(charset, 1)
+            width = column_width(db_type, bytes_per_char, text_length)
+            if width is None:
+                raise ValueError("Column %s of type %s can't be loaded from an external table." % (column, db_type))
+            if is_text(db_type):
+                length_width = len(str(width))
+            self.codecs.append(codec)
+            self.fields.append((index, width, length_width, nullable[index]))
+
+    def ext_columns(self):
+        "Returns (name, width) pairs of external table columns."
+        result = []
+        for index, width, length_width, nullable in self.fields:
+            if nullable:
+                result.append(('N%d' % index, 1))
+            if length_width:
+                result.append(('L%d' % index, length_width))
+            result.append(('V%d' % index, width))
+        result.append(('EOL', 1))
+        return result
+
+    def select_list(self):
+        "Returns expressions casting external table columns into column values."
+        result = []
+        for index, width, length_width, nullable in self.fields:
+            db_type = self.types[index]
+            if length_width:
+                # Spaces are significant in text, only the length padding is dropped.
+                value = 'SUBSTRING(V%d FROM 1 FOR CAST(L%d AS INTEGER))' % (index, index)
+            else:
+                value = 'TRIM(V%d)' % index
+            value = 'CAST(%s AS %s)' % (value, db_type)
+            if nullable:
+                value = "CASE WHEN N%d = '%s' THEN NULL ELSE %s END" % (index, NULL_FLAG, value)
+            result.append(value)
+        return result
+
+    def record(self, row):
+        "Returns `row` values as a fixed-width record."
+        parts = []
+        for index, width, length_width, nullable in self.fields:
+            value = row[index]
+            if value is None:
+                if not nullable:
+                    raise ValueError('Column %s is not nullable.' % self.columns[index])
+                parts.append(NULL_FLAG + ' ' * ((length_width or 0) + width))
+                continue
+            if nullable:
+                parts.append(' ')
+            try:
+                value = format_value(value, self.codecs[index])
+            except UnicodeError, e:
+                raise ValueError('Value of column %s can\'t be stored in its character set: %s.' % (
+                    self.columns[index], e))
+            if len(value) > width:
+                raise ValueError('Value of column %s is longer than %d bytes: %r.' % (
+                    self.columns[index], width, value))
+            if length_width:
+                parts.append(str(len(value)).rjust(length_width))
+            parts.append(value.ljust(width))
+        parts.append('\n')
+        return ''.join(parts)
+
+
+def write_file(f, layout, rows):
+    "Writes `rows` into file `f` in `layout`, returns their number."
+    count = 0
+    for row in rows:
+        f.write(layout.record(row))
+        count += 1
+    return count
+
+
+def get_loadable_indexes(cursor, table):
+    "Returns names of active indexes of `table` which don't back a constraint."
+    cursor.execute('SELECT i.RDB$INDEX_NAME FROM RDB$INDICES i '
+                   'WHERE i.RDB$RELATION_NAME = %s AND COALESCE(i.RDB$INDEX_INACTIVE, 0) = 0 '
+                   'AND NOT EXISTS (SELECT 1 FROM RDB$RELATION_CONSTRAINTS c '
+                   'WHERE c.RDB$INDEX_NAME = i.RDB$INDEX_NAME)', [table])
+    return [row[0].strip() for row in cursor.fetchall()]
+
+
+def get_charsets(cursor, table, columns, default=None):
+    """
+    Returns Firebird character sets of `columns` of `table`: their own,
+    the database default one or `default`, in this order.
+    """
+    cursor.execute('SELECT rf.RDB$FIELD_NAME, cs.RDB$CHARACTER_SET_NAME FROM RDB$RELATION_FIELDS rf '
+                   'JOIN RDB$FIELDS f ON f.RDB$FIELD_NAME = rf.RDB$FIELD_SOURCE '
+                   'LEFT JOIN RDB$CHARACTER_SETS cs ON cs.RDB$CHARACTER_SET_ID = f.RDB$CHARACTER_SET_ID '
+                   'WHERE rf.RDB$RELATION_NAME = %s', [table])
+    charsets = dict([(name.strip(), charset and charset.strip()) for name, charset in cursor.fetchall()])
+    cursor.execute('SELECT RDB$CHARACTER_SET_NAME FROM RDB$DATABASE')
+    row = cursor.fetchone()
+    if row is not None and row[0]:
+        default = row[0].strip()
+    return [(charsets.get(column) or default or 'NONE').upper() for column in columns]
+
+
+def load_rows(connection, table, columns, types, rows, nullable=None, directory=None,
+              deactivate_indexes=False, text_length=None):
+    """
+    Inserts `rows` (an iterable of sequences of column values) into
+    `table` through an external table file created in `directory`.
+    `nullable` tells for each of `columns` if it may be NULL (all may
+    by default). Text is encoded in character sets of the columns.
+    Returns the number of rows inserted.
+    """
+    ops = connection.ops
+    qn = ops.quote_name
+    if nullable is None:
+        nullable = [True] * len(columns)
+    table_name = qn(table).strip('"')
+    cursor = connection.cursor()
+    connection_charset = connection.settings.get('charset', 'NONE').upper()
+    charsets = get_charsets(cursor, table_name, [qn(column).strip('"') for column in columns], connection_charset)
+    layout = Layout(columns, types, nullable, charsets, text_length, CHARSET_CODECS.get(connection_charset))
+
+    fd, path = tempfile.mkstemp(suffix='.ext', prefix='fbload', dir=directory)
+    # The server process reads the file.
+    os.chmod(path, 0644)
+    f = os.fdopen(fd, 'wb')
+    try:
+        count = write_file(f, layout, rows)
+    finally:
+        f.close()
+
+    ext_table = qn(util.truncate_name('%s_EXT%d' % (table_name, os.getpid()), 31))
+    indexes = []
+    try:
+        cursor.execute("CREATE TABLE %s EXTERNAL FILE '%s' (%s)" % (
+            ext_table, path.replace("'", "''"),
+            ', '.join(['%s CHAR(%d) CHARACTER SET NONE' % (name, width)
+                       for name, width in layout.ext_columns()])))
+        connection._commit()
+        try:
+            if deactivate_indexes:
+                indexes = get_loadable_indexes(cursor, table_name)
+                for name in indexes:
+                    cursor.execute('ALTER INDEX %s INACTIVE' % qn(name))
+                connection._commit()
+            table_changed(connection, table)
+            cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s' % (
+                qn(table), ', '.join([qn(column) for column in columns]),
+                ', '.join(layout.select_list()), ext_table))
+            connection._commit()
+        except:
+            connection._rollback()
+            raise
+        finally:
+            # Reactivation rebuilds the indexes.
+            for name in indexes:
+                cursor.execute('ALTER INDEX %s ACTIVE' % qn(name))
+            cursor.execute('DROP TABLE %s' % ext_table)
+            connection._commit()
+    finally:
+        os.remove(path)
+    return count
+
+
+def load(model, rows, fields=None, using=None, directory=None, deactivate_indexes=False, text_length=None):
+    """
+    Loads `rows` (sequences of values of `fields`, names of model fields
+    defaulting to all local ones but an automatic primary key) into
+    `model` table. Values are converted with Field.to_python(), so rows
+    of strings (e.g. read from a CSV file) may be given.
+
+    See load_rows() for the rest of arguments.
+    """
+    opts = model._meta
+    if fields is None:
+        fields = [f for f in opts.local_fields if not isinstance(f, AutoField)]
+    else:
+        fields = [opts.get_field(name) for name in fields]
+    if using is None:
+        using = router.db_for_write(model)
+    connection = connections[using]
+
+    def prepare(row):
+        return [f.to_python(value) for f, value in zip(fields, row)]
+
+    return load_rows(connection, opts.db_table, [f.column for f in fields],
+                     [clean_db_type(f.db_type(connection=connection)) for f in fields],
+                     (prepare(row) for row in rows), nullable=[f.null for f in fields],
+                     directory=directory, deactivate_indexes=deactivate_indexes, text_length=text_length)
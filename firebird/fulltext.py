@@ -0,0 +1,235 @@
+"""
+Trigram index for substring searches.
+
+Firebird answers CONTAINING and LIKE '%x%' only by reading every row (and
+every blob) of the table. For a registered text field a side table keeps
+each distinct lowercase trigram (three character substring) of the field
+value along with the row's primary key; a trigger on the model table keeps
+it up to date. A search for 'widget' then first finds rows having all of
+'wid', 'idg', 'dge', 'get' trigrams using the side table's index and only
+those rows are checked with the original predicate.
+
+Needs Firebird 2.1+ (multi-action triggers, UPDATE OR INSERT, derived
+tables). Register fields before the tables are created (e.g. in models.py):
+
+    from firebird import fulltext
+    fulltext.register(Product, 'name', 'description')
+
+For tables that already exist use create_index().
+"""
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.backends import util
+
+from firebird.bulk import clean_db_type
+
+TOKEN_LENGTH = 3
+
+# Lookups a trigram match is a necessary condition of.
+SEARCH_LOOKUPS = ('search', 'contains', 'icontains', 'startswith', 'istartswith',
+                  'endswith', 'iendswith')
+
+TEXT_TYPES = ('CharField', 'TextField', 'SlugField', 'EmailField', 'URLField')
+
+# Trigger rebuilds trigrams of unchanged values too when this context
+# variable is set (see rebuild()).
+REBUILD_VARIABLE = 'FT_REBUILD'
+
+# Registered fields: {db_table: [column, ...]}
+registry = {}
+
+
+def register(model, *field_names):
+    "Registers `model` text fields for trigram indexing."
+    columns = registry.setdefault(model._meta.db_table, [])
+    for name in field_names:
+        field = model._meta.get_field(name)
+        if field.get_internal_type() not in TEXT_TYPES:
+            raise ValueError('%s.%s is not a text field.' % (model.__name__, name))
+        if field.column not in columns:
+            columns.append(field.column)
+
+
+def is_registered(model):
+    return model._meta.db_table in registry
+
+
+def get_trigrams(value):
+    "Returns a sorted list of distinct lowercase trigrams of `value`."
+    value = value.lower()
+    return sorted(set([value[i:i + TOKEN_LENGTH] for i in range(len(value) - TOKEN_LENGTH + 1)]))
+
+
+def _name(ops, table, suffix):
+    return '%s_%s' % (util.truncate_name(table, ops.max_name_length() - len(suffix) - 1).upper(), suffix)
+
+
+def get_index_table(ops, table):
+    return _name(ops, table, 'FT')
+
+
+def sql_create(model, connection):
+    "Returns statements creating the side table and the trigger for `model`."
+    ops = connection.ops
+    qn = ops.quote_name
+    table = model._meta.db_table
+    pk = model._meta.pk
+    pk_type = clean_db_type(pk.db_type(connection=connection))
+    index_table = qn(get_index_table(ops, table))
+    columns = registry[table]
+
+    output = [
+        'CREATE TABLE %s (\n'
+        '    FIELD_NAME VARCHAR(31) NOT NULL,\n'
+        '    TOKEN VARCHAR(%d) NOT NULL,\n'
+        '    ROW_ID %s NOT NULL,\n'
+        '    PRIMARY KEY (FIELD_NAME, TOKEN, ROW_ID)\n'
+        ')' % (index_table, TOKEN_LENGTH, pk_type),
+        'CREATE INDEX %s ON %s (ROW_ID)' % (qn(_name(ops, table, 'FTI')), index_table),
+    ]
+
+    body = []
+    for column in columns:
+        values = {
+            'table': index_table,
+            'column': qn(column),
+            'name': column,
+            'pk': qn(pk.column),
+            'length': TOKEN_LENGTH,
+        }
+        body.append("""
+                changed = 0;
+                IF (UPDATING) THEN
+                    IF (force = 1 OR NEW.%(column)s IS DISTINCT FROM OLD.%(column)s OR NEW.%(pk)s <> OLD.%(pk)s) THEN
+                        changed = 1;
+                IF (DELETING OR changed = 1) THEN
+                    DELETE FROM %(table)s WHERE ROW_ID = OLD.%(pk)s AND FIELD_NAME = '%(name)s';
+                IF (INSERTING OR changed = 1) THEN
+                BEGIN
+                    i = 1;
+                    n = CHAR_LENGTH(NEW.%(column)s) - %(length)d + 1;
+                    WHILE (i <= n) DO
+                    BEGIN
+                        token = LOWER(SUBSTRING(NEW.%(column)s FROM i FOR %(length)d));
+                        UPDATE OR INSERT INTO %(table)s (FIELD_NAME, TOKEN, ROW_ID)
+                            VALUES ('%(name)s', :token, NEW.%(pk)s) MATCHING (FIELD_NAME, TOKEN, ROW_ID);
+                        i = i + 1;
+                    END
+                END""" % values)
+
+    output.append("""
+            CREATE TRIGGER %(trigger)s FOR %(table)s
+            ACTIVE AFTER INSERT OR UPDATE OR DELETE
+            AS
+            DECLARE VARIABLE i INTEGER;
+            DECLARE VARIABLE n INTEGER;
+            DECLARE VARIABLE token VARCHAR(%(length)d);
+            DECLARE VARIABLE changed SMALLINT;
+            DECLARE VARIABLE force SMALLINT;
+            BEGIN
+                force = 0;
+                IF (RDB$GET_CONTEXT('USER_TRANSACTION', '%(variable)s') = '1') THEN
+                    force = 1;%(body)s
+            END""" % {
+        'trigger': qn(_name(ops, table, 'FTR')),
+        'table': qn(table),
+        'length': TOKEN_LENGTH,
+        'variable': REBUILD_VARIABLE,
+        'body': ''.join(body),
+    })
+    return output
+
+
+def sql_destroy(model, connection):
+    "Returns statements dropping the side table (the trigger goes with the model table)."
+    ops = connection.ops
+    return ['DROP TABLE %s' % ops.quote_name(get_index_table(ops, model._meta.db_table))]
+
+
+def rebuild(model, using=None):
+    "Builds trigrams of all existing rows of `model` again."
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    pk = qn(model._meta.pk.column)
+    cursor = connection.cursor()
+    cursor.execute("SELECT RDB$SET_CONTEXT('USER_TRANSACTION', '%s', '1') FROM rdb$database" % REBUILD_VARIABLE)
+    try:
+        cursor.execute('DELETE FROM %s' % qn(get_index_table(connection.ops, table)))
+        cursor.execute('UPDATE %s SET %s = %s' % (qn(table), pk, pk))
+    finally:
+        cursor.execute("SELECT RDB$SET_CONTEXT('USER_TRANSACTION', '%s', NULL) FROM rdb$database" % REBUILD_VARIABLE)
+    transaction.commit_unless_managed(using=using)
+
+
+def create_index(model, using=None):
+    "Creates the side table and the trigger for an existing `model` table and fills them."
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    cursor = connection.cursor()
+    for sql in sql_create(model, connection):
+        cursor.execute(sql)
+    # Metadata must be committed before the new objects are used.
+    connection._commit()
+    rebuild(model, using)
+
+
+class TrigramMatch(object):
+    """
+    Restricts a table alias to rows whose `column` has all `tokens` in the
+    trigram index, either as an inner join to a derived table (join_sql())
+    or as a where node.
+    """
+
+    def __init__(self, alias, pk_column, index_table, column, tokens):
+        self.alias = alias
+        self.pk_column = pk_column
+        self.index_table = index_table
+        self.column = column
+        self.tokens = tokens
+
+    def subquery_sql(self, connection):
+        return ('SELECT ROW_ID FROM %s WHERE FIELD_NAME = %%s AND TOKEN IN (%s) '
+                'GROUP BY ROW_ID HAVING COUNT(*) = %%s' % (
+                    connection.ops.quote_name(self.index_table),
+                    ', '.join(['%s'] * len(self.tokens))))
+
+    def params(self):
+        return [self.column] + list(self.tokens) + [len(self.tokens)]
+
+    def join_sql(self, qn, connection, name):
+        sql = 'INNER JOIN (%s) %s ON (%s.ROW_ID = %s.%s)' % (
+            self.subquery_sql(connection), name, name,
+            qn(self.alias), connection.ops.quote_name(self.pk_column))
+        return sql, self.params()
+
+    def as_sql(self, qn, connection):
+        sql = '%s.%s IN (%s)' % (qn(self.alias), connection.ops.quote_name(self.pk_column),
+                                 self.subquery_sql(connection))
+        return sql, self.params()
+
+    def relabel_aliases(self, change_map):
+        self.alias = change_map.get(self.alias, self.alias)
+
+
+def get_match(child, connection):
+    """
+    Returns TrigramMatch for a where leaf that can be prefiltered by
+    a trigram index, None otherwise.
+    """
+    if not isinstance(child, tuple) or len(child) != 4:
+        return None
+    constraint, lookup_type, value_annotation, value = child
+    field = getattr(constraint, 'field', None)
+    if lookup_type not in SEARCH_LOOKUPS or field is None or not isinstance(value, basestring):
+        return None
+    table = field.model._meta.db_table
+    if constraint.col not in registry.get(table, ()):
+        return None
+    tokens = get_trigrams(value)
+    if not tokens:
+        # Too short to have trigrams.
+        return None
+    return TrigramMatch(constraint.alias, field.model._meta.pk.column,
+                        get_index_table(connection.ops, table), constraint.col, tokens)
@@ -0,0 +1,165 @@
+"""
+Large IN lists.
+
+Firebird accepts at most 1500 values in an IN list, longer lists are split
+by Django into OR-ed IN lists of that size (see max_in_list_size()). Each
+value is a separate index lookup and a parameter of the statement, so such
+statements get long and slow, and fail when they exceed 64KB.
+
+With 'in_list_table' option statements (e.g. SELECTs of rows Django
+collects before deleting them, filtered by pk__in or fk__in) load the values
+of IN lists longer than the option value into a global temporary table and
+filter by a subquery on it instead:
+
+    SELECT ... FROM "app_item" WHERE "app_item"."id" IN
+        (SELECT INT_VALUE FROM DJANGO_IN_LIST WHERE LIST_ID = ?)
+
+Values are loaded with EXECUTE BLOCK statements, a few round trips for
+thousands of values. The table is created once per database with
+create_table() (and in test databases), its rows live until the end of the
+transaction. Without the table statements are left to Django.
+"""
+
+import copy
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models.sql.where import WhereNode, AND, Constraint
+
+from firebird.bulk import execute_block_statements
+from firebird.where import flatten_and
+
+MAX_IN_LIST_SIZE = 1500
+
+TABLE = 'DJANGO_IN_LIST'
+
+MAX_STRING_LENGTH = 255
+
+# Value columns by the kind of values and their types.
+VALUE_COLUMNS = {
+    'int': ('INT_VALUE', 'bigint'),
+    'str': ('STR_VALUE', 'varchar(%d)' % MAX_STRING_LENGTH),
+}
+
+
+def sql_create():
+    "Returns statements creating the IN list table and its indexes."
+    return [
+        'CREATE GLOBAL TEMPORARY TABLE %s (\n'
+        '    LIST_ID INTEGER NOT NULL,\n'
+        '    INT_VALUE BIGINT,\n'
+        '    STR_VALUE VARCHAR(%d)\n'
+        ') ON COMMIT DELETE ROWS' % (TABLE, MAX_STRING_LENGTH),
+        'CREATE INDEX %s_INT ON %s (LIST_ID, INT_VALUE)' % (TABLE, TABLE),
+        'CREATE INDEX %s_STR ON %s (LIST_ID, STR_VALUE)' % (TABLE, TABLE),
+    ]
+
+
+def create_table(using=None):
+    "Creates the IN list table (Firebird 2.1+) in `using` database."
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    cursor = connection.cursor()
+    for sql in sql_create():
+        cursor.execute(sql)
+    # Metadata must be committed before the table is used.
+    connection._commit()
+    connection.in_list_table_exists = True
+
+
+def table_exists(connection):
+    "Tells if the IN list table exists, checked once per connection."
+    if connection.in_list_table_exists is None:
+        cursor = connection.cursor()
+        cursor.execute('SELECT RDB$RELATION_NAME FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = %s', [TABLE])
+        connection.in_list_table_exists = cursor.fetchone() is not None
+    return connection.in_list_table_exists
+
+
+def value_kind(values):
+    "Returns 'int' or 'str' if all `values` fit a value column, None otherwise."
+    if not [v for v in values if not isinstance(v, (int, long)) or isinstance(v, bool)]:
+        return 'int'
+    if not [v for v in values if not isinstance(v, basestring) or len(v) > MAX_STRING_LENGTH]:
+        return 'str'
+    return None
+
+
+class InListTable(object):
+    """
+    Filters a column by `values` loaded into the IN list table under
+    `list_id` (see load_in_lists()).
+    """
+
+    def __init__(self, alias, col, list_id, kind, values):
+        self.alias = alias
+        self.col = col
+        self.list_id = list_id
+        self.value_column, self.value_type = VALUE_COLUMNS[kind]
+        self.values = values
+        self.loaded = False
+
+    def as_sql(self, qn, connection):
+        if self.alias:
+            column = '%s.%s' % (qn(self.alias), qn(self.col))
+        else:
+            column = qn(self.col)
+        return '%s IN (SELECT %s FROM %s WHERE LIST_ID = %%s)' % (
+            column, self.value_column, TABLE), [self.list_id]
+
+    def relabel_aliases(self, change_map):
+        self.alias = change_map.get(self.alias, self.alias)
+
+
+def _large_in_list(child, threshold, connection):
+    "Returns (alias, col, params) for IN lookup leaf with more than `threshold` values."
+    if not isinstance(child, tuple) or len(child) != 4:
+        return None
+    constraint, lookup_type, value_annotation, value = child
+    if lookup_type != 'in' or not isinstance(constraint, Constraint) \
+            or not isinstance(value, (list, tuple)) or len(value) <= threshold:
+        return None
+    (alias, col, db_type), params = constraint.process(lookup_type, value, connection)
+    return alias, col, params
+
+
+def replace_in_lists(node, connection):
+    """
+    Returns (node, in_lists): copy of top level where `node` with large
+    IN lists of its top level AND chain replaced by InListTable filters
+    with reserved list ids, and the list of those filters. Returns `node`
+    if there is nothing to replace. Nothing is written, values are loaded
+    with load_in_lists() before the statement is executed.
+    """
+    threshold = connection.in_list_threshold
+    if not threshold or not isinstance(node, WhereNode) or node.connector != AND or node.negated:
+        return node, []
+    children = flatten_and(node.children)
+    in_lists = []
+    for index, child in enumerate(children):
+        in_list = _large_in_list(child, threshold, connection)
+        if in_list is None:
+            continue
+        alias, col, params = in_list
+        kind = value_kind(params)
+        if kind is None or not table_exists(connection):
+            continue
+        connection.in_list_counter += 1
+        children[index] = InListTable(alias, col, connection.in_list_counter, kind, set(params))
+        in_lists.append(children[index])
+    if not in_lists:
+        return node, []
+    rewritten = copy.copy(node)
+    rewritten.children = children
+    return rewritten, in_lists
+
+
+def load_in_lists(connection, in_lists):
+    "Loads values of InListTable filters `in_lists` into the IN list table."
+    cursor = connection.cursor()
+    for in_list in in_lists:
+        # Not bulk_insert(): rows of the table are private to the transaction,
+        # so nothing cached by firebird.resultcache becomes stale.
+        for sql, params in execute_block_statements(
+                connection, TABLE, ['LIST_ID', in_list.value_column], ['integer', in_list.value_type],
+                [(in_list.list_id, value) for value in in_list.values]):
+            cursor.execute(sql, params)
+        in_list.loaded = True
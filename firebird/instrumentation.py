@@ -0,0 +1,175 @@
+"""
+Query instrumentation.
+
+When 'instrumentation' option is set, CursorWrapper records each executed
+statement: wall time, rows fetched and (sampled) Firebird PLAN. Records are
+aggregated per normalized SQL, statements slower than a threshold are logged
+to 'firebird.queries' logger, and hooks can be registered to receive every
+record. Instrumentation is shared by all connections to the same database
+alias within a process.
+"""
+
+import re
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger('firebird.queries')
+
+whitespace_re = re.compile(r'\s+')
+string_re = re.compile(r"'(?:[^']|'')*'")
+number_re = re.compile(r'\b\d+(?:\.\d+)?\b')
+placeholders_re = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def normalize_sql(sql):
+    "Replaces literals with placeholders, so that statements of the same shape look the same."
+    sql = string_re.sub('?', sql)
+    sql = number_re.sub('?', sql)
+    sql = placeholders_re.sub('?, ...', sql)
+    return whitespace_re.sub(' ', sql).strip()
+
+
+class StatementRecord(object):
+    "A single statement execution."
+
+    def __init__(self, sql, duration, plan=None, stats=None):
+        self.sql = sql
+        self.duration = duration
+        self.plan = plan
+        self.rows = 0
+        self.stats = stats
+        self.timestamp = time.time()
+
+    def add_rows(self, count):
+        self.rows += count
+        if self.stats is not None:
+            self.stats.rows += count
+
+
+class QueryStats(object):
+    "Aggregated statistics for statements of the same normalized SQL."
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.plan = None
+
+    @property
+    def avg_time(self):
+        if not self.count:
+            return 0.0
+        return self.total_time / self.count
+
+    def as_dict(self):
+        return {
+            'sql': self.sql,
+            'count': self.count,
+            'total_time': self.total_time,
+            'avg_time': self.avg_time,
+            'max_time': self.max_time,
+            'rows': self.rows,
+            'slow': self.slow,
+            'plan': self.plan,
+        }
+
+
+class Instrumentation(object):
+    """
+    Collects statement records.
+
+    - slow_query_threshold: seconds, slower statements are logged
+    - plan_sample_rate: share of executions (0..1) for which PLAN is captured
+    - max_statements: maximum number of distinct normalized statements tracked
+    """
+
+    def __init__(self, slow_query_threshold=None, plan_sample_rate=0.0, max_statements=1000):
+        self.slow_query_threshold = slow_query_threshold
+        self.plan_sample_rate = plan_sample_rate
+        self.max_statements = max_statements
+        self.hooks = []
+        self.stats = {}
+        self.untracked = 0
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        "Registers a callable to be called with every StatementRecord."
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def should_capture_plan(self):
+        rate = self.plan_sample_rate
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def record(self, sql, duration, plan=None):
+        "Records an executed statement and returns its StatementRecord."
+        normalized = normalize_sql(sql)
+        slow = self.slow_query_threshold is not None and duration >= self.slow_query_threshold
+
+        self._lock.acquire()
+        try:
+            stats = self.stats.get(normalized)
+            if stats is None and len(self.stats) < self.max_statements:
+                stats = self.stats[normalized] = QueryStats(normalized)
+            if stats is None:
+                self.untracked += 1
+            else:
+                stats.count += 1
+                stats.total_time += duration
+                stats.max_time = max(stats.max_time, duration)
+                if slow:
+                    stats.slow += 1
+                if plan:
+                    stats.plan = plan
+        finally:
+            self._lock.release()
+
+        if slow:
+            logger.warning('Slow query (%.3f s): %s%s', duration, sql, plan and '\n%s' % plan or '')
+
+        record = StatementRecord(sql, duration, plan, stats)
+        for hook in self.hooks:
+            hook(record)
+        return record
+
+    def get_stats(self, order_by='total_time'):
+        "Returns a list of aggregated statistics dictionaries, the most expensive first."
+        self._lock.acquire()
+        try:
+            stats = [s.as_dict() for s in self.stats.values()]
+        finally:
+            self._lock.release()
+        stats.sort(key=lambda s: s[order_by], reverse=True)
+        return stats
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.stats = {}
+            self.untracked = 0
+        finally:
+            self._lock.release()
+
+
+_instrumentations = {}
+_instrumentations_lock = threading.Lock()
+
+
+def get_instrumentation(alias, **options):
+    "Returns the Instrumentation for database `alias`, creating it on first use."
+    _instrumentations_lock.acquire()
+    try:
+        instrumentation = _instrumentations.get(alias)
+        if instrumentation is None:
+            instrumentation = _instrumentations[alias] = Instrumentation(**options)
+        return instrumentation
+    finally:
+        _instrumentations_lock.release()
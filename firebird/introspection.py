@@ -27,19 +27,102 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
         # of all of that.
     }
 
+    def __init__(self, connection):
+        super(DatabaseIntrospection, self).__init__(connection)
+        self._catalog = None
+
+    def get_catalog(self, cursor):
+        """
+        Returns a Catalog snapshot of tables, fields, relations and indexes,
+        loading it on first call. The snapshot is kept until
+        invalidate_catalog() is called (this is done automatically when
+        a DDL statement is executed or the connection is closed).
+        """
+        if self._catalog is None:
+            self._catalog = Catalog(cursor)
+        return self._catalog
+
+    def invalidate_catalog(self):
+        self._catalog = None
+
     def get_table_list(self, cursor):
         "Returns a list of table names in the current database."
+        return list(self.get_catalog(cursor).tables)
+
+    def get_table_description(self, cursor, table_name):
+        "Returns a description of the table, with the DB-API cursor.description interface."
+        return list(self.get_catalog(cursor).fields.get(table_name, []))
+        
+    def get_relations(self, cursor, table_name):
+        """
+        Returns a dictionary of {field_index: (field_index_other_table, other_table)}
+        representing all relationships to the given table. Indexes are 0-based.
+        """
+        return dict(self.get_catalog(cursor).relations.get(table_name, {}))
+
+    def get_indexes(self, cursor, table_name):
+        """
+        Returns a dictionary of fieldname -> infodict for the given table,
+        where each infodict is in the format:
+            {'primary_key': boolean representing whether it's the primary key,
+             'unique': boolean representing whether it's a unique index/constraint}
+        """
+        indexes = {}
+        for index in self.get_catalog(cursor).indexes.get(table_name, []):
+            if not index['unique']:
+                continue
+            for field_name in index['fields']:
+                indexes[field_name] = {
+                    'primary_key': index['primary_key'],
+                    'unique': not index['primary_key']
+                }
+        return indexes
+
+    def get_row_estimate(self, cursor, table_name):
+        """
+        Returns the number of rows in the table estimated from selectivity
+        of its unique indexes (1 / rows as of the last SET STATISTICS),
+        None if there are no statistics.
+        """
+        cursor.execute("""
+            select min(rdb$statistics) from rdb$indices
+            where rdb$relation_name = %s and rdb$unique_flag = 1
+              and rdb$statistics > 0 and coalesce(rdb$index_inactive, 0) = 0""", [table_name])
+        row = cursor.fetchone()
+        if row is None or not row[0]:
+            return None
+        return int(round(1 / row[0]))
+
+
+class Catalog(object):
+    """
+    A snapshot of database schema loaded with a few set-based queries
+    against system tables:
+
+    - tables: list of table names
+    - fields: {table_name: [cursor.description-like tuples]}
+    - relations: {table_name: {field_index: (field_index_other_table, other_table)}}
+    - indexes: {table_name: [{'name', 'fields', 'unique', 'primary_key',
+                              'foreign_key', 'inactive', 'statistics'}]}
+    """
+
+    def __init__(self, cursor):
+        self.tables = self.load_tables(cursor)
+        self.fields = self.load_fields(cursor)
+        self.relations = self.load_relations(cursor)
+        self.indexes = self.load_indexes(cursor)
+
+    def load_tables(self, cursor):
         cursor.execute("""select rdb$relation_name from rdb$relations
             where rdb$system_flag=0 and rdb$view_source is null
             order by rdb$relation_name""")
         return [r[0].strip() for r in cursor.fetchall()]
 
-    def get_table_description(self, cursor, table_name):
-        "Returns a description of the table, with the DB-API cursor.description interface."
-        tbl_name = "'%s'" % table_name
+    def load_fields(self, cursor):
         cursor.execute("""
             select
-              rf.rdb$field_name
+              rf.rdb$relation_name
+              , rf.rdb$field_name
               , case
                   when (f.rdb$field_type in (7,8,16)) and (f.rdb$field_sub_type > 0) then
                     160 + f.rdb$field_sub_type
@@ -51,22 +134,23 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
               , rf.rdb$null_flag
             from
               rdb$relation_fields rf join rdb$fields f on (rf.rdb$field_source = f.rdb$field_name)
+              join rdb$relations r on (r.rdb$relation_name = rf.rdb$relation_name)
             where
-              rf.rdb$relation_name = %s
+              r.rdb$system_flag = 0
             order by
-              rf.rdb$field_position
-            """ % (tbl_name,))
-        return [(r[0].strip(), r[1], r[2], r[2] or 0, r[3], r[4], not (r[5] == 1)) for r in cursor.fetchall()]
-        
-    def get_relations(self, cursor, table_name):
-        """
-        Returns a dictionary of {field_index: (field_index_other_table, other_table)}
-        representing all relationships to the given table. Indexes are 0-based.
-        """
-        tbl_name = "'%s'" % table_name
+              rf.rdb$relation_name, rf.rdb$field_position
+            """)
+        fields = {}
+        for r in cursor.fetchall():
+            fields.setdefault(r[0].strip(), []).append(
+                (r[1].strip(), r[2], r[3], r[3] or 0, r[4], r[5], not (r[6] == 1)))
+        return fields
+
+    def load_relations(self, cursor):
         cursor.execute("""
             select
-              rf1.rdb$field_position
+              rf1.rdb$relation_name
+              , rf1.rdb$field_position
               , rf2.rdb$field_position
               , rf2.rdb$relation_name
             from
@@ -78,53 +162,49 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
               join rdb$index_segments is2 on (rc2.rdb$index_name = is2.rdb$index_name)
               join rdb$relation_fields rf2 on (rc2.rdb$relation_name = rf2.rdb$relation_name and is2.rdb$field_name = rf2.rdb$field_name)
             where
-              rf1.rdb$relation_name = %s
-              and rc1.rdb$constraint_type = 'FOREIGN KEY'
+              rc1.rdb$constraint_type = 'FOREIGN KEY'
             order by
-              rf1.rdb$field_position""" % (tbl_name,))
-
+              rf1.rdb$relation_name, rf1.rdb$field_position""")
         relations = {}
         for r in cursor.fetchall():
-            relations[r[0]] = (r[1], r[2].strip())
+            relations.setdefault(r[0].strip(), {})[r[1]] = (r[2], r[3].strip())
         return relations
 
-    def get_indexes(self, cursor, table_name):
-        """
-        Returns a dictionary of fieldname -> infodict for the given table,
-        where each infodict is in the format:
-            {'primary_key': boolean representing whether it's the primary key,
-             'unique': boolean representing whether it's a unique index/constraint}
-        """
-
-        # This query retrieves each field name and index type on the given table.
-        tbl_name = "'%s'" % table_name
+    def load_indexes(self, cursor):
         cursor.execute("""
-            SELECT
-              seg2.rdb$field_name
-              , case
-                  when exists (
-                    select
-                      1
-                    from
-                      rdb$relation_constraints con
-                    where
-                      con.rdb$constraint_type = 'PRIMARY KEY'
-                      and con.rdb$index_name = i.rdb$index_name
-                  ) then
-                    'PRIMARY KEY'
-                  else
-                    'UNIQUE'
-              end
-            FROM
+            select
+              i.rdb$relation_name
+              , i.rdb$index_name
+              , seg.rdb$field_name
+              , i.rdb$unique_flag
+              , i.rdb$index_inactive
+              , i.rdb$statistics
+              , i.rdb$foreign_key
+              , con.rdb$constraint_type
+            from
               rdb$indices i
-              JOIN rdb$index_segments seg2 on seg2.rdb$index_name = i.rdb$index_name
-            WHERE
-              i.rdb$relation_name = %s
-              and i.rdb$unique_flag = 1""" % (tbl_name,))
+              join rdb$index_segments seg on (seg.rdb$index_name = i.rdb$index_name)
+              join rdb$relations r on (r.rdb$relation_name = i.rdb$relation_name)
+              left join rdb$relation_constraints con on (con.rdb$index_name = i.rdb$index_name)
+            where
+              r.rdb$system_flag = 0
+            order by
+              i.rdb$relation_name, i.rdb$index_name, seg.rdb$field_position""")
         indexes = {}
+        by_name = {}
         for r in cursor.fetchall():
-            indexes[r[0].strip()] = {
-                'primary_key': (r[1].strip() == 'PRIMARY KEY'),
-                'unique': (r[1].strip() == 'UNIQUE')
-            }
+            name = r[1].strip()
+            index = by_name.get(name)
+            if index is None:
+                index = by_name[name] = {
+                    'name': name,
+                    'fields': [],
+                    'unique': r[3] == 1,
+                    'primary_key': (r[7] or '').strip() == 'PRIMARY KEY',
+                    'foreign_key': r[6] is not None,
+                    'inactive': r[4] == 1,
+                    'statistics': r[5],
+                }
+                indexes.setdefault(r[0].strip(), []).append(index)
+            index['fields'].append(r[2].strip())
         return indexes
@@ -0,0 +1,78 @@
+"""
+Hi-lo primary key allocation.
+
+Instead of letting the BEFORE INSERT trigger (see DatabaseOperations.autoinc_sql)
+call GEN_ID(gn, 1) for each row, keys are reserved in blocks with a single
+GEN_ID(gn, N) call and handed out from an in-process cache. As generators
+are not transactional, reserved keys are never given out twice, though
+unused ones are lost when the process exits. Cached blocks are forgotten
+when a statement may reset a generator (SET GENERATOR of sql_flush(), DDL).
+"""
+
+import threading
+
+
+class KeyAllocator(object):
+    """
+    Thread-safe cache of key blocks reserved from generators.
+
+    Blocks are kept per database and generator name, `block_size` is the
+    default number of keys reserved at once.
+    """
+
+    def __init__(self, block_size=100):
+        self.block_size = block_size
+        self.reservations = 0
+        self._blocks = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, connection, table, count=1, block_size=None):
+        "Returns a list of `count` new keys for `table`."
+        generator = connection.ops.get_generator_name(table)
+        settings_dict = connection.settings_dict
+        key = (settings_dict['HOST'], settings_dict['NAME'], generator)
+        block_size = block_size or self.block_size
+
+        lock = self._get_lock(key)
+        lock.acquire()
+        try:
+            keys = []
+            block = self._blocks.get(key)
+            while count > 0:
+                if block is None or block[0] > block[1]:
+                    size = max(block_size, count)
+                    last = self.reserve(connection, generator, size)
+                    block = self._blocks[key] = [last - size + 1, last]
+                taken = min(count, block[1] - block[0] + 1)
+                keys.extend(range(block[0], block[0] + taken))
+                block[0] += taken
+                count -= taken
+            return keys
+        finally:
+            lock.release()
+
+    def reserve(self, connection, generator, size):
+        "Increments generator by `size` and returns its new value."
+        cursor = connection.cursor()
+        cursor.execute('SELECT GEN_ID(%s, %d) FROM rdb$database' % (generator, size))
+        self.reservations += 1
+        return cursor.fetchone()[0]
+
+    def reset(self):
+        "Forgets all cached blocks."
+        self._lock.acquire()
+        try:
+            self._blocks.clear()
+        finally:
+            self._lock.release()
+
+    def _get_lock(self, key):
+        self._lock.acquire()
+        try:
+            return self._locks.setdefault(key, threading.Lock())
+        finally:
+            self._lock.release()
+
+
+allocator = KeyAllocator()
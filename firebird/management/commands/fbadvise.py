@@ -0,0 +1,61 @@
+import time
+from optparse import make_option
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.base import NoArgsCommand, CommandError
+
+from firebird.advisor import IndexAdvisor, MIN_ROWS
+from firebird.monitoring import STATE_ACTIVE
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates a database to advise on. '
+                'Defaults to the "default" database.'),
+        make_option('--duration', action='store', dest='duration', type='float', default=60,
+            help='Seconds to collect statements for.'),
+        make_option('--interval', action='store', dest='interval', type='float', default=1,
+            help='Seconds between two monitoring snapshots.'),
+        make_option('--min-rows', action='store', dest='min_rows', type='int', default=MIN_ROWS,
+            help='Tables estimated to have fewer rows are skipped.'),
+        make_option('--limit', action='store', dest='limit', type='int', default=20,
+            help='Number of suggestions to show.'),
+        make_option('--no-foreign-keys', action='store_false', dest='foreign_keys', default=True,
+            help="Doesn't suggest indexes for foreign key columns of installed models."),
+    )
+    help = ('Collects statements of all attachments from MON$STATEMENTS (Firebird 2.1+) '
+            'for a while and suggests indexes for those reading large tables with NATURAL '
+            'scans or sorts.')
+
+    def handle_noargs(self, **options):
+        using = options.get('database')
+        connection = connections[using]
+        if connection.vendor != 'firebird':
+            raise CommandError('Database %s is not a Firebird one.' % using)
+
+        advisor = IndexAdvisor(using, min_rows=options.get('min_rows'))
+        # Prepared statements are counted once, active ones on every snapshot.
+        seen = set()
+        deadline = time.time() + options.get('duration')
+        while True:
+            for statement in connection.monitoring_snapshot().statements:
+                if not statement['sql']:
+                    continue
+                key = (statement['attachment_id'], statement['statement_id'], statement['sql'])
+                if key not in seen or statement['state'] == STATE_ACTIVE:
+                    seen.add(key)
+                    advisor.add(statement['sql'])
+            if time.time() + options.get('interval') > deadline:
+                break
+            time.sleep(options.get('interval'))
+        connection.close_monitor()
+
+        suggestions = advisor.suggestions(foreign_keys=options.get('foreign_keys'))
+        self.stdout.write('%d statements collected, %d suggestions.\n' % (len(advisor.statements), len(suggestions)))
+        qn = connection.ops.quote_name
+        for suggestion in suggestions[:options.get('limit')]:
+            rows = suggestion.rows is None and 'unknown' or '~%d' % suggestion.rows
+            self.stdout.write('\n-- %s: %d queries, %d executions, %s rows\n' % (
+                ', '.join(sorted(suggestion.reasons)), suggestion.queries, suggestion.executions, rows))
+            self.stdout.write('%s;\n' % suggestion.sql(qn))
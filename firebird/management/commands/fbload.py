@@ -0,0 +1,85 @@
+import csv
+from optparse import make_option
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import get_model, AutoField
+from django.db.models.fields import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+
+from firebird.external import load
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates a database to load into. '
+                'Defaults to the "default" database.'),
+        make_option('--fields', action='store', dest='fields', default=None,
+            help='Comma separated names of fields in the order of CSV columns. '
+                'Defaults to all fields but an automatic primary key.'),
+        make_option('--delimiter', action='store', dest='delimiter', default=',',
+            help='CSV field delimiter.'),
+        make_option('--skip-header', action='store_true', dest='skip_header', default=False,
+            help='Skips the first CSV line.'),
+        make_option('--directory', action='store', dest='directory', default=None,
+            help='Directory for the external table file, it must be accessible by '
+                'the server under the same path (see ExternalFileAccess in firebird.conf).'),
+        make_option('--deactivate-indexes', action='store_true', dest='deactivate_indexes', default=False,
+            help='Deactivates indexes during the load and rebuilds them afterwards.'),
+        make_option('--text-length', action='store', dest='text_length', type='int', default=None,
+            help='Maximum length of values of text BLOB fields, which are not loaded without it.'),
+    )
+    args = '<app_label.ModelName> <file.csv>'
+    help = ('Loads rows of a UTF-8 CSV file into a model table through a Firebird '
+            'external table. Empty values of nullable fields are loaded as NULL.')
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Expected a model and a CSV file.')
+        label, path = args
+        try:
+            app_label, model_name = label.split('.')
+        except ValueError:
+            raise CommandError('Model is expected as app_label.ModelName, got %s.' % label)
+        model = get_model(app_label, model_name)
+        if model is None:
+            raise CommandError('Unknown model %s.' % label)
+        using = options.get('database')
+        if connections[using].vendor != 'firebird':
+            raise CommandError('Database %s is not a Firebird one.' % using)
+
+        fields = options.get('fields')
+        if fields:
+            fields = [name.strip() for name in fields.split(',')]
+            try:
+                nullable = [model._meta.get_field(name).null for name in fields]
+            except FieldDoesNotExist, e:
+                raise CommandError(str(e))
+        else:
+            fields = None
+            nullable = [f.null for f in model._meta.local_fields if not isinstance(f, AutoField)]
+
+        def read_rows(f):
+            reader = csv.reader(f, delimiter=options.get('delimiter'))
+            if options.get('skip_header'):
+                reader.next()
+            for row in reader:
+                values = []
+                for value, null in zip(row, nullable):
+                    if value == '' and null:
+                        values.append(None)
+                    else:
+                        values.append(value.decode('utf-8'))
+                yield values
+
+        f = open(path, 'rb')
+        try:
+            count = load(model, read_rows(f), fields=fields, using=using,
+                         directory=options.get('directory'),
+                         deactivate_indexes=options.get('deactivate_indexes'),
+                         text_length=options.get('text_length'))
+        except ValueError, e:
+            raise CommandError(str(e))
+        finally:
+            f.close()
+        self.stdout.write('Loaded %d rows into %s.\n' % (count, model._meta.db_table))
@@ -0,0 +1,65 @@
+import time
+from optparse import make_option
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.base import NoArgsCommand, CommandError
+
+from firebird.monitoring import COUNTERS
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates a database to report on. '
+                'Defaults to the "default" database.'),
+        make_option('--interval', action='store', dest='interval', type='float', default=0,
+            help='Seconds between two snapshots, activity between them is reported. '
+                'Without it totals are reported.'),
+        make_option('--limit', action='store', dest='limit', type='int', default=10,
+            help='Number of statements to show.'),
+        make_option('--order-by', action='store', dest='order_by', default='page_reads',
+            help='Counter to order statements by: %s.' % ', '.join(COUNTERS)),
+        make_option('--long-running', action='store', dest='long_running', type='float', default=60,
+            help='Seconds after which a transaction is flagged as long running.'),
+    )
+    help = ('Reports Firebird monitoring tables statistics: oldest and long running '
+            'transactions, and statements with the most I/O.')
+
+    def handle_noargs(self, **options):
+        connection = connections[options.get('database')]
+        if connection.vendor != 'firebird':
+            raise CommandError('Database %s is not a Firebird one.' % options.get('database'))
+        order_by = options.get('order_by')
+        if order_by not in COUNTERS:
+            raise CommandError('Unknown counter %s, expected one of: %s.' % (order_by, ', '.join(COUNTERS)))
+
+        interval = options.get('interval')
+        snapshot = connection.monitoring_snapshot()
+        if interval:
+            time.sleep(interval)
+            before, snapshot = snapshot, connection.monitoring_snapshot()
+            statements = snapshot.delta(before).top_statements(order_by, options.get('limit'))
+            title = 'Statements by %s in %s seconds' % (order_by, interval)
+        else:
+            statements = sorted(snapshot.statements, key=lambda s: s[order_by], reverse=True)
+            statements = statements[:options.get('limit')]
+            title = 'Statements by %s' % order_by
+        connection.close_monitor()
+
+        database = snapshot.database
+        self.stdout.write('Transactions: oldest %s, oldest active %s, oldest snapshot %s, next %s (gap %s)\n' % (
+            database.get('oldest_transaction'), database.get('oldest_active'),
+            database.get('oldest_snapshot'), database.get('next_transaction'), snapshot.transaction_gap()))
+
+        flagged = snapshot.flagged_transactions(options.get('long_running'))
+        if flagged:
+            self.stdout.write('\nFlagged transactions:\n')
+            for transaction in flagged:
+                self.stdout.write('  %s (attachment %s): %s, running %.1f seconds\n' % (
+                    transaction['transaction_id'], transaction['attachment_id'],
+                    ', '.join(transaction['flags']), transaction['age'] or 0))
+
+        self.stdout.write('\n%s:\n' % title)
+        for statement in statements:
+            self.stdout.write('  %s\n' % ' '.join(['%s=%s' % (name, statement[name]) for name in COUNTERS if statement[name]]))
+            self.stdout.write('    (attachment %s) %s\n' % (statement['attachment_id'], ' '.join((statement['sql'] or '').split())))
@@ -0,0 +1,300 @@
+"""
+Monitoring tables (Firebird 2.1+).
+
+MON$ tables show what the server is doing: attachments, transactions and
+statements along with their page I/O (MON$IO_STATS) and record level
+(MON$RECORD_STATS) counters. Their content is a snapshot taken at the first
+access within a transaction, so every Snapshot is read in a new transaction
+of a separate connection, which is excluded from the results.
+
+Counters are totals since an attachment, transaction or statement began.
+Snapshot.delta() subtracts an earlier snapshot, so that activity between
+the two is seen, e.g. of a single view:
+
+    before = connection.monitoring_snapshot()
+    response = view(request)
+    delta = connection.monitoring_snapshot().delta(before)
+    delta.attachments[connection.attachment_id()]
+
+Only SYSDBA and the database owner see all attachments, other users see
+their own ones.
+"""
+
+from firebird.instrumentation import normalize_sql
+
+IO_STATS = (
+    ('MON$PAGE_READS', 'page_reads'),
+    ('MON$PAGE_WRITES', 'page_writes'),
+    ('MON$PAGE_FETCHES', 'page_fetches'),
+    ('MON$PAGE_MARKS', 'page_marks'),
+)
+
+RECORD_STATS = (
+    ('MON$RECORD_SEQ_READS', 'seq_reads'),
+    ('MON$RECORD_IDX_READS', 'idx_reads'),
+    ('MON$RECORD_INSERTS', 'inserts'),
+    ('MON$RECORD_UPDATES', 'updates'),
+    ('MON$RECORD_DELETES', 'deletes'),
+    ('MON$RECORD_BACKOUTS', 'backouts'),
+    ('MON$RECORD_PURGES', 'purges'),
+    ('MON$RECORD_EXPUNGES', 'expunges'),
+)
+
+COUNTERS = tuple([name for column, name in IO_STATS + RECORD_STATS])
+
+DATABASE_COLUMNS = (
+    ('CURRENT_TIMESTAMP', 'timestamp'),
+    ('t.MON$OLDEST_TRANSACTION', 'oldest_transaction'),
+    ('t.MON$OLDEST_ACTIVE', 'oldest_active'),
+    ('t.MON$OLDEST_SNAPSHOT', 'oldest_snapshot'),
+    ('t.MON$NEXT_TRANSACTION', 'next_transaction'),
+    ('t.MON$PAGE_SIZE', 'page_size'),
+)
+
+ATTACHMENT_COLUMNS = (
+    ('t.MON$ATTACHMENT_ID', 'attachment_id'),
+    ('t.MON$SERVER_PID', 'server_pid'),
+    ('t.MON$STATE', 'state'),
+    ('t.MON$USER', 'user'),
+    ('t.MON$REMOTE_ADDRESS', 'remote_address'),
+    ('t.MON$REMOTE_PID', 'remote_pid'),
+    ('t.MON$REMOTE_PROCESS', 'remote_process'),
+    ('t.MON$TIMESTAMP', 'timestamp'),
+)
+
+TRANSACTION_COLUMNS = (
+    ('t.MON$TRANSACTION_ID', 'transaction_id'),
+    ('t.MON$ATTACHMENT_ID', 'attachment_id'),
+    ('t.MON$STATE', 'state'),
+    ('t.MON$TIMESTAMP', 'timestamp'),
+    ('t.MON$ISOLATION_MODE', 'isolation_mode'),
+    ('t.MON$READ_ONLY', 'read_only'),
+)
+
+STATEMENT_COLUMNS = (
+    ('t.MON$STATEMENT_ID', 'statement_id'),
+    ('t.MON$ATTACHMENT_ID', 'attachment_id'),
+    ('t.MON$TRANSACTION_ID', 'transaction_id'),
+    ('t.MON$STATE', 'state'),
+    ('t.MON$TIMESTAMP', 'timestamp'),
+    ('t.MON$SQL_TEXT', 'sql'),
+)
+
+# MON$STATE value of active attachments, transactions and statements.
+STATE_ACTIVE = 1
+
+
+def sql_select(table, columns, exclude_own=True):
+    "Returns SELECT of `columns` of MON$ `table` joined with its I/O and record stats."
+    fields = [column for column, name in columns]
+    fields.extend(['io.%s' % column for column, name in IO_STATS])
+    fields.extend(['r.%s' % column for column, name in RECORD_STATS])
+    sql = ('SELECT %s FROM %s t '
+           'LEFT JOIN MON$IO_STATS io ON io.MON$STAT_ID = t.MON$STAT_ID '
+           'LEFT JOIN MON$RECORD_STATS r ON r.MON$STAT_ID = t.MON$STAT_ID' % (', '.join(fields), table))
+    if exclude_own:
+        sql += ' WHERE t.MON$ATTACHMENT_ID <> CURRENT_CONNECTION'
+    return sql
+
+
+def _fetch(cursor, table, columns, exclude_own=True):
+    cursor.execute(sql_select(table, columns, exclude_own))
+    names = [name for column, name in columns] + list(COUNTERS)
+    rows = []
+    for row in cursor.fetchall():
+        row = dict(zip(names, row))
+        for name in COUNTERS:
+            row[name] = row[name] or 0
+        rows.append(row)
+    return rows
+
+
+def subtract(after, before):
+    "Returns counters of `after` minus those of `before` (None for nothing to subtract)."
+    result = {}
+    for name in COUNTERS:
+        value = after.get(name, 0)
+        if before is not None:
+            previous = before.get(name, 0)
+            # A smaller value means counting started again (e.g. the
+            # statement was prepared anew).
+            if value >= previous:
+                value -= previous
+        result[name] = value
+    return result
+
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+class Snapshot(object):
+    """
+    Content of monitoring tables at one moment: `database` row, lists of
+    `attachments`, `transactions` and `statements` rows (dictionaries with
+    COUNTERS). Timestamps are server ones.
+    """
+
+    def __init__(self, database, attachments, transactions, statements):
+        self.database = database
+        self.timestamp = database.get('timestamp')
+        self.attachments = attachments
+        self.transactions = transactions
+        self.statements = statements
+
+    def age(self, row):
+        "Returns seconds since `row` (transaction, statement) started."
+        if self.timestamp is None or row.get('timestamp') is None:
+            return None
+        return _seconds(self.timestamp - row['timestamp'])
+
+    def transaction_gap(self):
+        "Returns the distance between the next and the oldest active transaction."
+        database = self.database
+        if database.get('next_transaction') is None or database.get('oldest_active') is None:
+            return None
+        return database['next_transaction'] - database['oldest_active']
+
+    def flagged_transactions(self, long_running=60):
+        """
+        Returns active transactions which are the oldest active one or run
+        longer than `long_running` seconds, oldest first. Each has 'age' and
+        'flags' ('oldest_active', 'long_running') added.
+        """
+        oldest_active = self.database.get('oldest_active')
+        result = []
+        for transaction in self.transactions:
+            if transaction['state'] != STATE_ACTIVE:
+                continue
+            flags = []
+            if transaction['transaction_id'] == oldest_active:
+                flags.append('oldest_active')
+            age = self.age(transaction)
+            if age is not None and age >= long_running:
+                flags.append('long_running')
+            if flags:
+                result.append(dict(transaction, age=age, flags=flags))
+        result.sort(key=lambda t: t['transaction_id'])
+        return result
+
+    def long_running_statements(self, threshold=10):
+        "Returns active statements running for `threshold` seconds or longer, oldest first."
+        result = []
+        for statement in self.statements:
+            if statement['state'] != STATE_ACTIVE:
+                continue
+            age = self.age(statement)
+            if age is not None and age >= threshold:
+                result.append(dict(statement, age=age))
+        result.sort(key=lambda s: s['age'], reverse=True)
+        return result
+
+    def delta(self, earlier):
+        "Returns Delta of activity since `earlier` snapshot."
+        return Delta(earlier, self)
+
+
+class Delta(object):
+    """
+    Activity between two snapshots: `elapsed` seconds, `database` counters,
+    `attachments` counters by attachment id, and `statements` rows with
+    counters of what they did meanwhile (only those that did something).
+    """
+
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+        self.elapsed = None
+        if before.timestamp is not None and after.timestamp is not None:
+            self.elapsed = _seconds(after.timestamp - before.timestamp)
+        self.database = subtract(after.database, before.database)
+
+        previous = dict([(a['attachment_id'], a) for a in before.attachments])
+        self.attachments = dict([
+            (a['attachment_id'], subtract(a, previous.get(a['attachment_id'])))
+            for a in after.attachments])
+
+        previous = dict([((s['attachment_id'], s['statement_id']), s) for s in before.statements])
+        self.statements = []
+        for statement in after.statements:
+            counters = subtract(statement, previous.get((statement['attachment_id'], statement['statement_id'])))
+            if [value for value in counters.values() if value]:
+                row = dict(statement)
+                row.update(counters)
+                self.statements.append(row)
+
+    def top_statements(self, order_by='page_reads', limit=None):
+        "Returns statements ordered by `order_by` counter, greatest first."
+        statements = sorted(self.statements, key=lambda s: s[order_by], reverse=True)
+        if limit is not None:
+            statements = statements[:limit]
+        return statements
+
+    def by_sql(self, order_by='page_reads'):
+        """
+        Returns counters aggregated per normalized SQL text (see
+        firebird.instrumentation.normalize_sql()), greatest first.
+        """
+        totals = {}
+        for statement in self.statements:
+            sql = normalize_sql(statement['sql'] or '')
+            total = totals.get(sql)
+            if total is None:
+                total = totals[sql] = dict([(name, 0) for name in COUNTERS], sql=sql, count=0)
+            total['count'] += 1
+            for name in COUNTERS:
+                total[name] += statement[name]
+        return sorted(totals.values(), key=lambda t: t[order_by], reverse=True)
+
+
+class Monitor(object):
+    """
+    Takes snapshots through its own connection made by `connect`
+    callable on first use.
+    """
+
+    def __init__(self, connect, charset='utf-8'):
+        self.connect = connect
+        self.charset = charset
+        self.connection = None
+
+    def snapshot(self):
+        "Returns a new Snapshot."
+        if self.connection is None:
+            self.connection = self.connect()
+        cursor = self.connection.cursor()
+        try:
+            rows = _fetch(cursor, 'MON$DATABASE', DATABASE_COLUMNS, exclude_own=False)
+            database = rows and rows[0] or {}
+            attachments = _fetch(cursor, 'MON$ATTACHMENTS', ATTACHMENT_COLUMNS)
+            transactions = _fetch(cursor, 'MON$TRANSACTIONS', TRANSACTION_COLUMNS)
+            statements = _fetch(cursor, 'MON$STATEMENTS', STATEMENT_COLUMNS)
+        finally:
+            # The next snapshot needs a new transaction.
+            self.connection.commit()
+            cursor.close()
+        for statement in statements:
+            if isinstance(statement['sql'], str):
+                statement['sql'] = statement['sql'].decode(self.charset, 'replace')
+        return Snapshot(database, attachments, transactions, statements)
+
+    def cancel_statements(self, attachment_id):
+        "Cancels statements running on attachment `attachment_id` (Firebird 2.5+)."
+        if self.connection is None:
+            self.connection = self.connect()
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('DELETE FROM MON$STATEMENTS WHERE MON$ATTACHMENT_ID = ? AND MON$STATE = ?',
+                           (attachment_id, STATE_ACTIVE))
+        finally:
+            self.connection.commit()
+            cursor.close()
+
+    def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            try:
+                connection.close()
+            except Exception:
+                # The server may be gone already.
+                pass
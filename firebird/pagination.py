@@ -0,0 +1,122 @@
+"""
+Pagination helpers.
+
+Sliced querysets are compiled into SELECT FIRST n SKIP m, and Firebird
+evaluates SKIP by reading and discarding m rows, so deep pages get slower
+and slower. Keyset ("seek") pagination instead remembers the ordering values
+of the last row seen and asks for rows following it, which an index on the
+ordering columns answers in constant time per page.
+"""
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+from firebird.counts import approximate_count, APPROXIMATE_COUNT_THRESHOLD
+
+
+def _parse_ordering(ordering):
+    return [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+
+def keyset_filter(ordering, last):
+    """
+    Returns Q object selecting rows which follow `last` (a sequence of values)
+    in `ordering` (field names, '-' prefixed for descending order).
+
+    Firebird has no row value comparisons, so (a, b) > (x, y) is expanded
+    into a >= x AND (a > x OR (a = x AND b > y)). The leading range predicate
+    lets Firebird use an index on the first ordering column.
+    """
+    fields = _parse_ordering(ordering)
+    if len(fields) != len(last):
+        raise ValueError('Expected %d key values, got %d.' % (len(fields), len(last)))
+
+    first_name, first_desc = fields[0]
+    lookup = first_desc and 'lte' or 'gte'
+    result = Q(**{'%s__%s' % (first_name, lookup): last[0]})
+
+    seek = None
+    for index, (name, desc) in enumerate(fields):
+        condition = Q(**{'%s__%s' % (name, desc and 'lt' or 'gt'): last[index]})
+        for prev_index in range(index):
+            condition &= Q(**{fields[prev_index][0]: last[prev_index]})
+        if seek is None:
+            seek = condition
+        else:
+            seek |= condition
+    return result & seek
+
+
+def get_key(item, ordering, pk_name='pk'):
+    """
+    Returns values of `ordering` fields for a model instance or values()
+    dictionary, which has the primary key value under `pk_name` (attname
+    of the primary key field) instead of 'pk'.
+    """
+    key = []
+    for name, desc in _parse_ordering(ordering):
+        if isinstance(item, dict):
+            if name == 'pk':
+                name = pk_name
+            key.append(item[name])
+        else:
+            key.append(item.serializable_value(name))
+    return tuple(key)
+
+
+def _unique_ordering(ordering):
+    ordering = list(ordering)
+    if not [name for name in ordering if name.lstrip('-') == 'pk']:
+        ordering.append('pk')
+    return ordering
+
+
+def keyset_page(queryset, ordering=('pk',), last=None, size=100):
+    """
+    Returns a tuple (items, last_key) for the page of `size` items following
+    `last` key (None for the first page). Pass `last_key` to get the next page,
+    it is None when there are no more items.
+
+    Ordering columns should be NOT NULL and covered by an index;
+    primary key is appended to make the ordering unique.
+    """
+    ordering = _unique_ordering(ordering)
+    queryset = queryset.order_by(*ordering)
+    if last is not None:
+        queryset = queryset.filter(keyset_filter(ordering, last))
+    items = list(queryset[:size])
+
+    last_key = None
+    if len(items) == size:
+        last_key = get_key(items[-1], ordering, queryset.model._meta.pk.attname)
+    return items, last_key
+
+
+def keyset_iterator(queryset, ordering=('pk',), chunk_size=1000):
+    "Iterates over the whole `queryset` fetching `chunk_size` items per query."
+    last = None
+    while True:
+        items, last = keyset_page(queryset, ordering, last, chunk_size)
+        for item in items:
+            yield item
+        if last is None:
+            break
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator counting unfiltered querysets of large tables from index
+    statistics (see firebird.counts). The count may be off, so the last
+    pages may come out empty or be missing. Use as ModelAdmin.paginator
+    for changelists of large tables.
+    """
+    threshold = APPROXIMATE_COUNT_THRESHOLD
+
+    def _get_count(self):
+        if self._count is None:
+            if hasattr(self.object_list, 'query'):
+                self._count = approximate_count(self.object_list, self.threshold)
+            else:
+                self._count = len(self.object_list)
+        return self._count
+    count = property(_get_count)
@@ -0,0 +1,222 @@
+"""
+Process-wide pool of kinterbasdb connections.
+
+Attaching to a Firebird database is expensive (security database lookup,
+page cache warm-up), so DatabaseWrapper can borrow connections from a pool
+instead of attaching on every request. Pools are shared by all threads and
+keyed by connection settings, the setup of their connections and pool options.
+"""
+
+import time
+import threading
+
+from django.db import utils
+
+
+class PoolExhaustedError(utils.DatabaseError):
+    pass
+
+
+class PooledConnection(object):
+    """
+    A physical connection held by a pool.
+
+    `state` is a dictionary for data bound to the physical connection, which
+    should survive checkouts (server version, prepared statements, etc.).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.state = {}
+        self.created = self.last_used = time.time()
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe connection pool.
+
+    - min_size: number of idle connections kept open despite `idle_timeout`
+    - max_size: maximum number of open connections
+    - idle_timeout: seconds an idle connection is kept open
+    - max_lifetime: seconds after which a connection is reopened
+    - timeout: seconds to wait for a free connection when pool is exhausted
+    - health_check: whether to probe a connection on checkout
+    """
+
+    health_check_sql = 'SELECT 1 FROM rdb$database'
+
+    def __init__(self, connect, min_size=0, max_size=10, idle_timeout=600,
+                 max_lifetime=3600, timeout=30, health_check=True):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.health_check = health_check
+
+        self.size = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self._idle = []
+        self._cond = threading.Condition(threading.Lock())
+
+    def checkout(self):
+        "Returns a PooledConnection, opening a new one if needed."
+        deadline = time.time() + self.timeout
+        while True:
+            pooled = self._reserve(deadline)
+            if pooled is None:
+                try:
+                    pooled = PooledConnection(self.connect())
+                except:
+                    self._forget()
+                    raise
+                self.created += 1
+                return pooled
+            if self._is_usable(pooled):
+                self.reused += 1
+                return pooled
+            self.discard(pooled)
+
+    def checkin(self, pooled):
+        "Rolls back pending work and returns connection to the pool."
+        try:
+            pooled.connection.rollback()
+        except Exception:
+            self.discard(pooled)
+            return
+        if self._is_expired(pooled, time.time()):
+            self.discard(pooled)
+            return
+        pooled.last_used = time.time()
+        self._cond.acquire()
+        try:
+            self._idle.append(pooled)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def discard(self, pooled):
+        pooled.close()
+        self.discarded += 1
+        self._forget()
+
+    def close(self):
+        "Closes all idle connections."
+        self._cond.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._cond.release()
+        for pooled in idle:
+            self.discard(pooled)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'idle': len(self._idle),
+            'created': self.created,
+            'reused': self.reused,
+            'discarded': self.discarded,
+        }
+
+    def _reserve(self, deadline):
+        """
+        Returns an idle connection, or None if the caller is allowed to
+        open a new one.
+        """
+        self._cond.acquire()
+        try:
+            while True:
+                stale = self._prune()
+                if stale:
+                    break
+                if self._idle:
+                    return self._idle.pop()
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolExhaustedError('No free connection in pool of %s within %s seconds.' % (self.max_size, self.timeout))
+                self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+        # Stale connections are closed outside of the lock.
+        for pooled in stale:
+            self.discard(pooled)
+        return self._reserve(deadline)
+
+    def _prune(self):
+        "Removes idle connections which are too old. Must be called under lock."
+        now = time.time()
+        stale = []
+        keep = []
+        # The most recently used connections are at the end of the list.
+        for index, pooled in enumerate(reversed(self._idle)):
+            idle_for = now - pooled.last_used
+            if self._is_expired(pooled, now) or (index >= self.min_size and idle_for > self.idle_timeout):
+                stale.append(pooled)
+            else:
+                keep.append(pooled)
+        keep.reverse()
+        self._idle = keep
+        return stale
+
+    def _forget(self):
+        self._cond.acquire()
+        try:
+            self.size -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _is_expired(self, pooled, now):
+        return self.max_lifetime is not None and now - pooled.created > self.max_lifetime
+
+    def _is_usable(self, pooled):
+        if not self.health_check:
+            return True
+        try:
+            cursor = pooled.connection.cursor()
+            try:
+                cursor.execute(self.health_check_sql)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(connect, settings, setup=(), **options):
+    """
+    Returns the pool for given connection settings and pool `options`,
+    creating it on first use. `connect` is called with settings as keyword
+    arguments to open connections. `setup` lists options the connections
+    are set up with after they are opened (type translators, prepared
+    statements, etc.), so that physical connections are shared only by
+    databases which set them up the same way.
+    """
+    settings = dict(settings)
+    key = repr((sorted(settings.items()), tuple(setup), sorted(options.items())))
+    _pools_lock.acquire()
+    try:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(lambda: connect(**settings), **options)
+        return pool
+    finally:
+        _pools_lock.release()
@@ -0,0 +1,382 @@
+"""
+Query result cache.
+
+When 'result_cache' option is set, rows of SELECT statements are kept in
+a cache keyed by SQL and parameters, and the same statement executed again
+is answered from the cache without a round trip to the server.
+
+Each table has a version number which is incremented whenever a model
+INSERT, UPDATE or DELETE compiled by the backend (or a bulk helper) changes
+the table, and again when the writing transaction ends. A cached result
+keeps versions of the tables its statement reads and is discarded when any
+of them has changed since. A connection with uncommitted writes neither
+reads nor fills the cache, so uncommitted rows are never shared.
+
+Writes the backend doesn't see (raw SQL, triggers, other applications)
+don't invalidate anything, results then live until `ttl` expires. The same
+goes for results read by a snapshot transaction started before a change
+was committed: caching works best with read committed transactions (see
+firebird.transaction).
+
+Options:
+
+- storage: 'locmem' (per process, default) or 'django' (Django cache
+  `cache` alias, shared by processes, versions included)
+- max_entries: maximum number of cached results (locmem)
+- ttl: seconds a result is kept
+- max_rows: results with more rows are not cached
+- tables: if given, only statements reading just these tables are cached
+"""
+
+import re
+import sys
+import time
+import uuid
+import hashlib
+import threading
+
+from firebird.utils import LRUCache
+
+CACHE_PREFIX = 'fbrc'
+# Seconds table versions are kept in a Django cache (at least).
+VERSION_TIMEOUT = 86400
+
+select_re = re.compile(r'^\s*SELECT\b', re.I)
+table_re = re.compile(r'\b(?:FROM|JOIN)\s+("[^"]+"|[A-Za-z_][\w$]*)', re.I)
+# Statements whose results depend on more than table contents.
+volatile_re = re.compile(r"\bGEN_ID\b|\bNEXT\s+VALUE\b|\bCURRENT_\w+|'NOW'|'TODAY'|\bRAND\s*\("
+                         r"|\bRDB\$|\bMON\$|\bFOR\s+UPDATE\b|\bWITH\s+LOCK\b", re.I)
+
+
+def get_tables(sql):
+    "Returns a sorted tuple of upper case names of tables `sql` reads."
+    names = set()
+    for name in table_re.findall(sql):
+        names.add(name.strip('"').upper())
+    return tuple(sorted(names))
+
+
+def estimate_size(rows):
+    "Returns approximate memory taken by `rows` in bytes."
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+class CachedResult(object):
+    "Rows of a statement along with versions of tables it was read from."
+
+    def __init__(self, description, rows, versions):
+        self.description = description
+        self.rows = rows
+        self.versions = versions
+        self.size = estimate_size(rows)
+
+
+class CachedRows(object):
+    """
+    Cursor-like reader of `rows`, continued with `rest` cursor (if given)
+    when they are exhausted.
+    """
+
+    rowcount = -1
+
+    def __init__(self, description, rows, rest=None):
+        self.description = description
+        self.rows = rows
+        self.rest = rest
+        self.position = 0
+
+    def fetchone(self):
+        if self.position < len(self.rows):
+            self.position += 1
+            return self.rows[self.position - 1]
+        if self.rest is not None:
+            return self.rest.fetchone()
+        return None
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = 1
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        if len(rows) < size and self.rest is not None:
+            rows = list(rows) + list(self.rest.fetchmany(size - len(rows)))
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        if self.rest is not None:
+            rows = list(rows) + list(self.rest.fetchall())
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        pass
+
+
+class LocMemStorage(object):
+    "Results and table versions in process memory, results in an LRU cache."
+
+    def __init__(self, max_entries=1000):
+        self.results = LRUCache(max_entries, on_evict=self._evicted)
+        self.versions = {}
+        self.memory = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        item = self.results.get(key)
+        if item is None:
+            return None
+        result, expires = item
+        if expires is not None and expires < time.time():
+            self.results.pop(key)
+            return None
+        return result
+
+    def set(self, key, result, ttl):
+        expires = None
+        if ttl:
+            expires = time.time() + ttl
+        self._lock.acquire()
+        try:
+            self.memory += result.size
+        finally:
+            self._lock.release()
+        self.results.set(key, (result, expires))
+
+    def delete(self, key):
+        self.results.pop(key)
+
+    def get_versions(self, tables):
+        versions = self.versions
+        return tuple([versions.get(table, 0) for table in tables])
+
+    def increment(self, table):
+        self._lock.acquire()
+        try:
+            self.versions[table] = self.versions.get(table, 0) + 1
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        stats = self.results.stats()
+        stats['memory'] = self.memory
+        return stats
+
+    def clear(self):
+        self.results.clear()
+
+    def _evicted(self, key, item):
+        self._lock.acquire()
+        try:
+            self.memory -= item[0].size
+        finally:
+            self._lock.release()
+
+
+class DjangoCacheStorage(object):
+    """
+    Results and table versions in a Django cache. A version is a random
+    token replaced on every change, so that a version key which expired
+    and was created again never matches versions of older results. Version
+    keys are kept for `version_timeout` seconds, longer than results. The
+    versions of every result include a generation token replaced by clear(),
+    so that clearing the cache (e.g. on schema changes) invalidates results
+    of all processes.
+    """
+
+    def __init__(self, cache='default', prefix=CACHE_PREFIX, version_timeout=VERSION_TIMEOUT):
+        from django.core.cache import get_cache
+        self.cache = get_cache(cache)
+        self.prefix = prefix
+        self.version_timeout = version_timeout
+        self.generation_key = '%s:g' % prefix
+
+    def version_key(self, table):
+        return '%s:v:%s' % (self.prefix, table)
+
+    def get(self, key):
+        return self.cache.get('%s:r:%s' % (self.prefix, key))
+
+    def set(self, key, result, ttl):
+        self.cache.set('%s:r:%s' % (self.prefix, key), result, ttl)
+
+    def delete(self, key):
+        self.cache.delete('%s:r:%s' % (self.prefix, key))
+
+    def get_versions(self, tables):
+        keys = [self.generation_key] + [self.version_key(table) for table in tables]
+        versions = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            for key in missing:
+                self.cache.add(key, new_version(), self.version_timeout)
+            versions.update(self.cache.get_many(missing))
+        # A version the cache didn't keep matches no result.
+        return tuple([versions.get(key) or new_version() for key in keys])
+
+    def increment(self, table):
+        self.cache.set(self.version_key(table), new_version(), self.version_timeout)
+
+    def stats(self):
+        return {}
+
+    def clear(self):
+        self.cache.set(self.generation_key, new_version(), self.version_timeout)
+
+
+def new_version():
+    "Returns a table version token of DjangoCacheStorage, unique across processes."
+    return uuid.uuid4().hex
+
+
+STORAGES = {
+    'locmem': LocMemStorage,
+    'django': DjangoCacheStorage,
+}
+
+
+class ResultCache(object):
+    """
+    Caches statement results in `storage`. Counters: `hits`, `misses`,
+    `stale` (found but invalidated or expired), `stored`, `too_large`
+    (not stored because of `max_rows`) and `invalidations`.
+    """
+
+    def __init__(self, storage, ttl=300, max_rows=1000, tables=None):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.tables = None
+        if tables is not None:
+            self.tables = set([table.upper() for table in tables])
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stored = 0
+        self.too_large = 0
+        self.invalidations = 0
+        # Tables read by statements, None for statements not to be cached.
+        self.statement_tables = LRUCache(1000)
+
+    def get_statement_tables(self, sql):
+        "Returns tables read by `sql`, None if its result must not be cached."
+        tables = self.statement_tables.get(sql, False)
+        if tables is False:
+            tables = None
+            if select_re.match(sql) and not volatile_re.search(sql):
+                tables = get_tables(sql) or None
+                if tables and self.tables is not None and not self.tables.issuperset(tables):
+                    tables = None
+            self.statement_tables.set(sql, tables)
+        return tables
+
+    def make_key(self, sql, params):
+        return hashlib.md5(repr((sql, tuple(params)))).hexdigest()
+
+    def get(self, key, tables):
+        "Returns valid CachedResult stored under `key`, None if there is none."
+        result = self.storage.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        if result.versions != self.storage.get_versions(tables):
+            self.stale += 1
+            self.misses += 1
+            self.storage.delete(key)
+            return None
+        self.hits += 1
+        return result
+
+    def get_versions(self, tables):
+        return self.storage.get_versions(tables)
+
+    def set(self, key, description, rows, versions):
+        """
+        Stores `rows` read with table `versions` (taken before the
+        statement was executed) under `key` unless they are too many.
+        Returns True if stored.
+        """
+        if len(rows) > self.max_rows:
+            self.too_large += 1
+            return False
+        self.storage.set(key, CachedResult(description, rows, versions), self.ttl)
+        self.stored += 1
+        return True
+
+    def invalidate(self, tables):
+        for table in tables:
+            self.storage.increment(table.upper())
+        self.invalidations += 1
+
+    def clear(self):
+        self.storage.clear()
+
+    def stats(self):
+        "Returns a dictionary with cache counters and storage statistics."
+        stats = self.storage.stats()
+        lookups = self.hits + self.misses
+        hit_ratio = 0.0
+        if lookups:
+            hit_ratio = float(self.hits) / lookups
+        stats.update({
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': hit_ratio,
+            'stale': self.stale,
+            'stored': self.stored,
+            'too_large': self.too_large,
+            'invalidations': self.invalidations,
+        })
+        return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_result_cache(alias, storage='locmem', max_entries=1000, cache='default', **options):
+    "Returns the ResultCache for database `alias`, creating it on first use."
+    _caches_lock.acquire()
+    try:
+        result_cache = _caches.get(alias)
+        if result_cache is None:
+            if storage not in STORAGES:
+                raise ValueError('Unknown result cache storage %r, expected one of: %s.' % (
+                    storage, ', '.join(sorted(STORAGES))))
+            if storage == 'locmem':
+                storage = LocMemStorage(max_entries)
+            else:
+                # Versions must outlive the results read with them.
+                version_timeout = max(VERSION_TIMEOUT, 2 * (options.get('ttl') or 0))
+                storage = DjangoCacheStorage(cache, '%s:%s' % (CACHE_PREFIX, alias), version_timeout)
+            result_cache = _caches[alias] = ResultCache(storage, **options)
+        return result_cache
+    finally:
+        _caches_lock.release()
+
+
+def table_changed(connection, table):
+    """
+    Invalidates cached results reading `table` on a write through
+    `connection`. They are invalidated again when the transaction ends.
+    """
+    if connection.result_cache is None:
+        return
+    connection.result_cache.invalidate([table])
+    connection.changed_tables.add(table)
+
+
+def transaction_ended(connection):
+    "Invalidates results reading tables changed by the transaction just ended."
+    if connection.changed_tables:
+        tables, connection.changed_tables = connection.changed_tables, set()
+        if connection.result_cache is not None:
+            connection.result_cache.invalidate(tables)
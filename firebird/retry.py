@@ -0,0 +1,194 @@
+"""
+Retrying transactions on update conflicts and lock timeouts.
+
+Concurrent writers of the same row get "update conflicts with concurrent
+update", "deadlock" or "lock time-out on wait transaction" errors. Such
+errors are transient: the same transaction started again usually succeeds.
+retry_transaction() runs a function in a transaction and runs it again
+(in a new transaction) after a randomized, exponentially growing delay
+when it fails with a transient error. Random delays keep competing clients
+from retrying in lockstep.
+"""
+
+import time
+import random
+import threading
+from functools import wraps
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+# GDS error codes of transient errors.
+isc_deadlock = 335544336
+isc_lock_conflict = 335544345
+isc_update_conflict = 335544451
+isc_lock_timeout = 335544510
+
+TRANSIENT_CODES = {
+    isc_deadlock: 'deadlock',
+    isc_lock_conflict: 'lock_conflict',
+    isc_update_conflict: 'update_conflict',
+    isc_lock_timeout: 'lock_timeout',
+}
+
+# kinterbasdb reports SQLCODE and error messages, GDS codes only show up
+# in messages of some versions, so messages are matched too.
+TRANSIENT_MESSAGES = (
+    ('update conflicts with concurrent update', 'update_conflict'),
+    ('lock time-out on wait transaction', 'lock_timeout'),
+    ('lock conflict on no wait transaction', 'lock_conflict'),
+    ('deadlock', 'deadlock'),
+)
+
+# SQLCODEs transient errors are reported with.
+TRANSIENT_SQLCODES = (-913, -901)
+
+
+def classify_error(error):
+    """
+    Returns kind of transient error ('deadlock', 'update_conflict',
+    'lock_conflict', 'lock_timeout') or None if `error` is not transient.
+    """
+    args = getattr(error, 'args', ())
+    if not args:
+        return None
+    code = args[0]
+    if code in TRANSIENT_CODES:
+        return TRANSIENT_CODES[code]
+    if code not in TRANSIENT_SQLCODES or len(args) < 2 or not isinstance(args[1], basestring):
+        return None
+    message = args[1].lower()
+    for text, kind in TRANSIENT_MESSAGES:
+        if text in message:
+            return kind
+    return None
+
+
+class RetryPolicy(object):
+    """
+    How many times and how soon to retry.
+
+    The n-th retry (counting from 0) waits for a random time between
+    (1 - jitter) and 1 of min(base_delay * 2 ** n, max_delay) seconds.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.05, max_delay=2.0, jitter=1.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, retry):
+        delay = min(self.base_delay * 2 ** retry, self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+    def sleep(self, retry):
+        time.sleep(self.delay(retry))
+
+
+default_policy = RetryPolicy()
+
+
+class RetryStats(object):
+    "Process-wide counters of transient errors and retries."
+
+    def __init__(self):
+        self.errors = {}
+        self.retries = 0
+        self.recovered = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def add_error(self, kind):
+        self._lock.acquire()
+        try:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+        finally:
+            self._lock.release()
+
+    def add(self, name):
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self._lock.release()
+
+    def as_dict(self):
+        return {
+            'errors': dict(self.errors),
+            'conflicts': sum(self.errors.values()),
+            'retries': self.retries,
+            'recovered': self.recovered,
+            'failures': self.failures,
+        }
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.errors = {}
+            self.retries = self.recovered = self.failures = 0
+        finally:
+            self._lock.release()
+
+
+stats = RetryStats()
+
+
+def run_with_retry(func, args=(), kwargs=None, using=None, policy=None):
+    """
+    Calls `func` in a transaction committed on success, retrying on
+    transient errors according to `policy`. `func` is run from scratch on
+    each attempt, so it must not have side effects outside the database.
+
+    Inside an already managed transaction the earlier work of that
+    transaction would be lost on retry, so `func` is just called then.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    policy = policy or default_policy
+    kwargs = kwargs or {}
+    if transaction.is_managed(using=using):
+        return func(*args, **kwargs)
+
+    attempt = 0
+    while True:
+        try:
+            result = transaction.commit_on_success(using=using)(func)(*args, **kwargs)
+        except Exception, e:
+            kind = classify_error(e)
+            if kind is None:
+                raise
+            stats.add_error(kind)
+            # A new snapshot is needed to see the competing transaction's changes.
+            connections[using]._rollback()
+            attempt += 1
+            if attempt >= policy.max_attempts:
+                stats.add('failures')
+                raise
+            stats.add('retries')
+            policy.sleep(attempt - 1)
+            continue
+        if attempt:
+            stats.add('recovered')
+        return result
+
+
+def retry_transaction(using=None, policy=None):
+    """
+    Decorator running the function with run_with_retry():
+
+        @retry_transaction
+        def book(seat_id):
+            ...
+
+        @retry_transaction(using='other', policy=RetryPolicy(max_attempts=3))
+        def book(seat_id):
+            ...
+    """
+    def decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            return run_with_retry(func, args, kwargs, using=using, policy=policy)
+        return inner
+    if callable(using):
+        func, using = using, None
+        return decorator(func)
+    return decorator
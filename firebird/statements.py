@@ -0,0 +1,102 @@
+"""
+Server-side prepared statement cache.
+
+Firebird parses and optimizes every statement text it receives. The cache
+below keeps kinterbasdb PreparedStatement objects around (keyed by the final
+qmark SQL), so repeated ORM statements skip that step.
+
+kinterbasdb binds a PreparedStatement to the cursor that prepared it, thus
+every cached statement owns a dedicated cursor. A CursorWrapper leases an
+entry for as long as it reads the entry's result set; an entry that is
+already leased (e.g. the same query nested in its own loop) is bypassed
+rather than shared.
+"""
+
+from firebird.utils import LRUCache
+
+# Only these statements are worth preparing once and reusing.
+CACHEABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'MERGE')
+
+
+class CachedStatement(object):
+
+    def __init__(self, cursor, statement):
+        self.cursor = cursor
+        self.statement = statement
+        self.leased = False
+        self.evicted = False
+
+    def release(self):
+        self.leased = False
+        if self.evicted:
+            # Evicted while in use, free it now that the reader is done.
+            self.free()
+
+    def free(self):
+        "Frees server handles held by this statement."
+        close = getattr(self.statement, 'close', None)
+        if close is not None:
+            close()
+        self.statement = None
+        self.cursor.close()
+
+
+class StatementCache(object):
+    """
+    Per-connection LRU cache of prepared statements.
+
+    `hits`, `misses` and `evictions` are taken from the underlying LRU cache,
+    `bypassed` counts executions that could not use a cached statement
+    because it was leased by another cursor.
+    """
+
+    def __init__(self, connection, size):
+        self.connection = connection
+        self.bypassed = 0
+        self.statements = LRUCache(size, on_evict=self._free)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def is_cacheable(self, sql):
+        words = sql.split(None, 1)
+        return bool(words) and words[0].upper() in CACHEABLE_STATEMENTS
+
+    def acquire(self, sql):
+        """
+        Returns a leased CachedStatement for `sql`, preparing it on a
+        dedicated cursor on cache miss. Returns None if the statement is
+        already in use.
+        """
+        entry = self.statements.get(sql)
+        if entry is None:
+            cursor = self.connection.cursor()
+            try:
+                entry = CachedStatement(cursor, cursor.prep(sql))
+            except:
+                cursor.close()
+                raise
+            self.statements.set(sql, entry)
+        elif entry.leased:
+            self.bypassed += 1
+            return None
+        entry.leased = True
+        return entry
+
+    def clear(self):
+        self.statements.clear()
+
+    def stats(self):
+        stats = self.statements.stats()
+        stats['bypassed'] = self.bypassed
+        return stats
+
+    def _free(self, sql, entry):
+        if entry.leased:
+            entry.evicted = True
+            return
+        try:
+            entry.free()
+        except Exception:
+            # The connection may be already gone, nothing to free then.
+            pass
@@ -0,0 +1,140 @@
+"""
+Transaction parameter buffers.
+
+kinterbasdb starts every transaction as read-write snapshot (concurrency)
+one by default. A snapshot transaction left open by a page doing only reads
+holds back the oldest active transaction marker, so record versions can't
+be garbage collected and the database slowly gets slower. Read committed
+read-only transactions don't have this effect and are cheap to start.
+
+'transaction' OPTIONS item sets connection's default TPB, read_only() and
+transaction_options() run a block of code in a transaction with other
+parameters.
+"""
+
+from contextlib import contextmanager
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.transaction import TransactionManagementError
+
+try:
+    import kinterbasdb as Database
+except ImportError, e:
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured("Error loading KInterbasDB module: %s" % e)
+
+ACCESS_MODES = {
+    'read': Database.isc_tpb_read,
+    'write': Database.isc_tpb_write,
+}
+
+ISOLATION_LEVELS = {
+    'snapshot': Database.isc_tpb_concurrency,
+    'concurrency': Database.isc_tpb_concurrency,
+    'consistency': Database.isc_tpb_consistency,
+    'read_committed': Database.isc_tpb_read_committed,
+}
+
+LOCK_RESOLUTIONS = {
+    'wait': Database.isc_tpb_wait,
+    'nowait': Database.isc_tpb_nowait,
+}
+
+READ_ONLY = {'access_mode': 'read', 'isolation_level': 'read_committed', 'rec_version': True}
+
+
+def _choice(options, name, choices):
+    value = options[name]
+    if value not in choices:
+        raise ValueError('Unknown %s %r, expected one of: %s.' % (
+            name, value, ', '.join(sorted(choices))))
+    return choices[value]
+
+
+def build_tpb(options):
+    """
+    Returns kinterbasdb.TPB built from `options` dictionary:
+
+    - access_mode: 'read' or 'write'
+    - isolation_level: 'snapshot', 'consistency' or 'read_committed'
+    - rec_version: for read committed, True to read the last committed
+      record version instead of waiting for uncommitted ones (default)
+    - lock_resolution: 'wait' or 'nowait'
+    - lock_timeout: seconds to wait for a lock (Firebird 2+), implies 'wait'
+    """
+    unknown = set(options) - set(['access_mode', 'isolation_level', 'rec_version',
+                                  'lock_resolution', 'lock_timeout'])
+    if unknown:
+        raise ValueError('Unknown transaction options: %s.' % ', '.join(sorted(unknown)))
+
+    tpb = Database.TPB()
+    if 'access_mode' in options:
+        tpb.access_mode = _choice(options, 'access_mode', ACCESS_MODES)
+    if 'isolation_level' in options:
+        level = _choice(options, 'isolation_level', ISOLATION_LEVELS)
+        if level == Database.isc_tpb_read_committed:
+            if options.get('rec_version', True):
+                level = (level, Database.isc_tpb_rec_version)
+            else:
+                level = (level, Database.isc_tpb_no_rec_version)
+        tpb.isolation_level = level
+    if 'lock_resolution' in options:
+        tpb.lock_resolution = _choice(options, 'lock_resolution', LOCK_RESOLUTIONS)
+    if options.get('lock_timeout') is not None:
+        tpb.lock_resolution = Database.isc_tpb_wait
+        tpb.lock_timeout = int(options['lock_timeout'])
+    return tpb
+
+
+@contextmanager
+def transaction_options(using=None, **options):
+    """
+    Runs the block in a separate transaction started with `options`
+    (see build_tpb()), committed when the block is left. Transactions
+    started after a commit within the block get the same options.
+
+    Uncommitted changes can't be carried into the block, so the current
+    transaction must not be dirty. Nested blocks join the outer one.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.tpb_override is not None:
+        yield
+        return
+    if connection.is_dirty():
+        raise TransactionManagementError(
+            'Transaction has uncommitted changes, commit or roll them back first.')
+
+    # Make sure there is a connection and no (read only) transaction is active.
+    connection.cursor()
+    connection._rollback()
+    connection.tpb_override = build_tpb(options)
+    tpb = connection.tpb_override.render()
+    raw = connection.connection
+    default_tpb = raw.default_tpb
+    # Transactions kinterbasdb starts implicitly after a commit in the block
+    # (e.g. by save() outside of managed transactions) get the options too.
+    raw.default_tpb = tpb
+    raw.begin(tpb=tpb)
+    try:
+        try:
+            yield
+        except:
+            connection.tpb_override = None
+            connection._rollback()
+            raise
+        else:
+            connection.tpb_override = None
+            connection._commit()
+    finally:
+        raw.default_tpb = default_tpb
+
+
+def read_only(using=None):
+    """
+    Runs the block in a read only read committed transaction, which doesn't
+    hold back garbage collection:
+
+        with read_only():
+            articles = list(Article.objects.all())
+    """
+    return transaction_options(using, **READ_ONLY)
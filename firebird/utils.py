@@ -0,0 +1,143 @@
+"""
+Small helpers shared by the Firebird backend modules.
+"""
+
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python < 2.7
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that drops the least recently used item when full.
+
+    `on_evict` (if given) is called with (key, value) for every item leaving
+    the cache, be it through eviction, pop() or clear(), so that the owner
+    can release resources bound to the value.
+
+    Hit, miss and eviction counters are kept for diagnostics.
+    """
+
+    def __init__(self, max_size, on_evict=None):
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        evicted = []
+        self._lock.acquire()
+        try:
+            if key in self._data:
+                evicted.append((key, self._data.pop(key)))
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                oldest = iter(self._data).next()
+                evicted.append((oldest, self._data.pop(oldest)))
+                self.evictions += 1
+        finally:
+            self._lock.release()
+        self._release(evicted)
+
+    def pop(self, key, default=None):
+        self._lock.acquire()
+        try:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+        finally:
+            self._lock.release()
+        self._release([(key, value)])
+        return value
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            evicted = self._data.items()
+            self._data.clear()
+        finally:
+            self._lock.release()
+        self._release(evicted)
+
+    def items(self):
+        self._lock.acquire()
+        try:
+            return self._data.items()
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        "Returns a dictionary with cache counters."
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _release(self, items):
+        if self.on_evict is not None:
+            for key, value in items:
+                self.on_evict(key, value)
+
+
+class StreamStats(object):
+    """
+    Counters of a streamed result set read: rows, chunks, seconds spent
+    and the largest number of rows buffered at once.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.chunks = 0
+        self.peak_buffered = 0
+        self.elapsed = 0.0
+
+    def add_chunk(self, size):
+        self.rows += size
+        self.chunks += 1
+        self.peak_buffered = max(self.peak_buffered, size)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.chunks += other.chunks
+        self.peak_buffered = max(self.peak_buffered, other.peak_buffered)
+        self.elapsed += other.elapsed
+
+    @property
+    def rows_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return self.rows / self.elapsed
+
+    def __repr__(self):
+        return '<StreamStats rows=%s chunks=%s peak_buffered=%s rows/sec=%.1f>' % (
+            self.rows, self.chunks, self.peak_buffered, self.rows_per_second)
@@ -0,0 +1,190 @@
+"""
+WHERE clause rewrites applied by the compilers.
+
+Django compiles month and day lookups into EXTRACT(...) = %s, which Firebird
+can't answer with an index on the column. When such lookups come together
+with a year lookup on the same column in an AND node (as in date archive
+views: pub_date__year=2010, pub_date__month=3), they describe a continuous
+range of dates, so they are replaced with a single half-open range
+predicate on the raw column: col >= start AND col < end.
+
+Search lookups on fields registered in firebird.fulltext get a trigram index
+prefilter (see add_trigram_matches()).
+
+Rewrites build a new tree, the query's own where is never modified.
+"""
+
+import copy
+import datetime
+
+from django.db.models.sql.where import WhereNode, AND
+
+from firebird import fulltext
+
+DATE_PART_LOOKUPS = ('year', 'month', 'day')
+DATE_TYPES = ('DateField', 'DateTimeField')
+
+
+class DateRange(object):
+    "Half-open range predicate on a date or timestamp column."
+
+    def __init__(self, alias, col, start, end):
+        self.alias = alias
+        self.col = col
+        self.start = start
+        self.end = end
+
+    def as_sql(self, qn, connection):
+        if self.alias:
+            column = '%s.%s' % (qn(self.alias), qn(self.col))
+        else:
+            column = qn(self.col)
+        return '(%s >= %%s AND %s < %%s)' % (column, column), [self.start, self.end]
+
+    def relabel_aliases(self, change_map):
+        self.alias = change_map.get(self.alias, self.alias)
+
+
+def date_range(parts, internal_type):
+    """
+    Returns (start, end) bounds for `parts` dictionary with 'year' and
+    optionally 'month' and 'day' values, None if they make no valid date.
+    """
+    year = parts['year']
+    month = parts.get('month')
+    day = parts.get('day')
+    try:
+        if month is None:
+            start = datetime.date(year, 1, 1)
+            end = datetime.date(year + 1, 1, 1)
+        elif day is None:
+            start = datetime.date(year, month, 1)
+            if month == 12:
+                end = datetime.date(year + 1, 1, 1)
+            else:
+                end = datetime.date(year, month + 1, 1)
+        else:
+            start = datetime.date(year, month, day)
+            end = start + datetime.timedelta(days=1)
+    except (ValueError, OverflowError):
+        # Matches nothing, left for the original lookups to deal with.
+        return None
+    if internal_type == 'DateTimeField':
+        start = datetime.datetime(start.year, start.month, start.day)
+        end = datetime.datetime(end.year, end.month, end.day)
+    return start, end
+
+
+def _date_part(child):
+    "Returns (alias, col, field) for year/month/day lookup leaf, None otherwise."
+    if not isinstance(child, tuple) or len(child) != 4:
+        return None
+    constraint, lookup_type, value_annotation, value = child
+    if lookup_type not in DATE_PART_LOOKUPS:
+        return None
+    field = getattr(constraint, 'field', None)
+    if field is None or field.get_internal_type() not in DATE_TYPES:
+        return None
+    return constraint.alias, constraint.col, field
+
+
+def collapse_date_lookups(children):
+    "Returns list of AND node `children` with date part lookups collapsed."
+    groups = {}
+    for child in children:
+        part = _date_part(child)
+        if part is not None:
+            groups.setdefault(part[:2], []).append(child)
+
+    replaced = {}
+    for (alias, col), lookups in groups.items():
+        parts = {}
+        for constraint, lookup_type, value_annotation, value in lookups:
+            if lookup_type in parts:
+                # The same part looked up twice, rare enough to leave as is.
+                break
+            try:
+                parts[lookup_type] = int(value)
+            except (TypeError, ValueError):
+                break
+        else:
+            if 'year' not in parts or ('day' in parts and 'month' not in parts):
+                continue
+            bounds = date_range(parts, lookups[0][0].field.get_internal_type())
+            if bounds is None:
+                continue
+            for lookup in lookups:
+                replaced[id(lookup)] = None
+            replaced[id(lookups[0])] = DateRange(alias, col, *bounds)
+
+    if not replaced:
+        return children
+    result = []
+    for child in children:
+        if id(child) in replaced:
+            if replaced[id(child)] is not None:
+                result.append(replaced[id(child)])
+        else:
+            result.append(child)
+    return result
+
+
+def flatten_and(children):
+    """
+    Returns AND node `children` with children of nested non-negated AND
+    nodes pulled up (Django puts each filter() argument into its own node).
+    """
+    result = []
+    for child in children:
+        if isinstance(child, WhereNode) and child.connector == AND and not child.negated:
+            result.extend(flatten_and(child.children))
+        else:
+            result.append(child)
+    return result
+
+
+def add_trigram_matches(node, connection, joins=None):
+    """
+    Returns copy of top level where `node` with a trigram index match added
+    for every search lookup on a registered field in the top level AND
+    chain. If `joins` list is given, matches are appended to it (to be
+    joined in FROM clause) instead. Lookups under OR or NOT are left alone.
+    """
+    if not fulltext.registry or not isinstance(node, WhereNode) \
+            or node.connector != AND or node.negated:
+        return node
+    children = flatten_and(node.children)
+    matches = [fulltext.get_match(child, connection) for child in children]
+    matches = [match for match in matches if match is not None]
+    if not matches:
+        return node
+    rewritten = copy.copy(node)
+    if joins is not None:
+        joins.extend(matches)
+        rewritten.children = children
+    else:
+        # Matches go first, so that Firebird evaluates them first.
+        rewritten.children = matches + children
+    return rewritten
+
+
+def rewrite_where(node, connection=None, joins=None):
+    """
+    Returns `node` or its rewritten copy. Trigram index matches are added
+    when `connection` is given, see add_trigram_matches() for `joins`.
+    """
+    if connection is not None:
+        return add_trigram_matches(rewrite_where(node), connection, joins)
+    if not isinstance(node, WhereNode):
+        return node
+    if node.connector == AND:
+        children = flatten_and(node.children)
+        children = collapse_date_lookups([rewrite_where(child) for child in children])
+    else:
+        children = [rewrite_where(child) for child in node.children]
+    if len(children) == len(node.children) and \
+            not [c for c, o in zip(children, node.children) if c is not o]:
+        return node
+    rewritten = copy.copy(node)
+    rewritten.children = children
+    return rewritten